@@ -0,0 +1,251 @@
+"""
+Client throughput, latency and memory per call against the fake ENSEK server
+(`tests.fake_server`), serving the recorded cassettes plus synthetic signup
+pages and accounts.
+
+Scenarios:
+
+- dispatch: a mix of `get_*` calls served from the cassettes
+- pagination: `iter_completed_signups` over `--pages` pages of 100 signups
+- readings: a `get_meter_point_readings` of `--readings` readings
+- create_reading: one `create_meter_reading` POST
+- create_readings: a `create_meter_readings` POST of 100 readings
+
+For each, calls are made from `--threads` threads and requests/s, p50/p99
+latency per call and the peak memory allocated per call (tracemalloc, in a
+separate, untimed pass) are reported. The server runs in its own process, so
+its work doesn't show up in the client's numbers.
+
+Save results with `--save results.json` and compare a later run against them
+with `--compare results.json`, which exits with status 1 if any scenario
+got more than `--tolerance` worse.
+
+    python -m benchmarks.bench_client --calls 2000 --threads 4
+    python -m benchmarks.bench_client --error-rate 0.05 --throttle-rate 0.05
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from ensek import Ensek, RateLimiter, RetryPolicy
+
+from tests.fake_server import (
+    FakeEnsekServer, account_routes, signup_routes,
+)
+
+ACCOUNT_ID = 1507
+SIGNUPS_PAGE_SIZE = 100
+
+DISPATCH = [
+    ('get_account', {'account_id': ACCOUNT_ID}),
+    ('get_meter_points', {'account_id': ACCOUNT_ID}),
+    ('get_account_tariffs', {
+        'account_id': ACCOUNT_ID, 'include_history': True,
+    }),
+    ('get_account_settings', {'account_id': ACCOUNT_ID}),
+    ('get_region_id_for_postcode', {'postcode': 'se14yu'}),
+    ('get_gas_utility', {'mprn': '3226987202'}),
+]
+
+
+def serve(conn, options):
+    # Runs in the server process until told to stop
+    routes = signup_routes(
+        pages=options['pages'], page_size=SIGNUPS_PAGE_SIZE
+    )
+    routes.update(
+        account_routes(1, meter_points=1, readings=options['readings'])
+    )
+    server = FakeEnsekServer.from_cassettes(
+        routes=routes, latency=options['latency'],
+        error_rate=options['error_rate'],
+        throttle_rate=options['throttle_rate'], retry_after=0, seed=0,
+    )
+    with server:
+        conn.send(server.url)
+        conn.recv()
+
+
+def scenarios(client, args):
+    dispatch = itertools.cycle(DISPATCH)
+    dispatch_lock = threading.Lock()
+
+    def get():
+        with dispatch_lock:
+            name, kwargs = next(dispatch)
+        getattr(client, name)(**kwargs)
+
+    def paginate():
+        for _ in client.iter_completed_signups(after=0):
+            pass
+
+    reading = {
+        'account_id': ACCOUNT_ID, 'meter_point_id': 1597,
+        'register_id': 1496, 'value': 2, 'timestamp': datetime(2018, 7, 30),
+    }
+
+    # name: (call, HTTP requests per call)
+    return {
+        'dispatch': (get, 1),
+        'pagination': (paginate, args.pages + 1),
+        'readings': (
+            lambda: client.get_meter_point_readings(meter_point_id=100), 1,
+        ),
+        'create_reading': (lambda: client.create_meter_reading(**reading), 1),
+        'create_readings': (
+            lambda: client.create_meter_readings(
+                ACCOUNT_ID, [reading] * 100
+            ),
+            1,
+        ),
+    }
+
+
+def timed_calls(call, *, calls, threads):
+    def run(_):
+        start = time.perf_counter()
+        call()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        latencies = list(executor.map(run, range(calls)))
+    return latencies, time.perf_counter() - start
+
+
+def memory_per_call(call, *, calls):
+    # Peak allocated during each call, averaged over the calls. Tracing is
+    # restarted per call, as `tracemalloc.reset_peak` needs Python 3.9.
+    peaks = []
+    for _ in range(calls):
+        tracemalloc.start()
+        try:
+            call()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        peaks.append(peak)
+    return statistics.mean(peaks)
+
+
+def percentile(values, percent):
+    # Nearest rank, as `statistics.quantiles` needs Python 3.8
+    values = sorted(values)
+    rank = max(1, -(-len(values) * percent // 100))
+    return values[rank - 1]
+
+
+def run_scenario(call, requests_per_call, args):
+    for _ in range(min(args.calls, 10)):
+        call()
+    latencies, elapsed = timed_calls(
+        call, calls=args.calls, threads=args.threads
+    )
+    return {
+        'requests_per_second': args.calls * requests_per_call / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'memory_kib': memory_per_call(
+            call, calls=max(1, args.calls // 10)
+        ) / 1024,
+    }
+
+
+def regressions(results, baseline, tolerance):
+    worse = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]
+        if result['requests_per_second'] < (
+            before['requests_per_second'] * (1 - tolerance)
+        ):
+            worse.append(f'{name}: requests/s')
+        for key in ('p99_ms', 'memory_kib'):
+            if result[key] > before[key] * (1 + tolerance):
+                worse.append(f'{name}: {key}')
+    return worse
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--throttle-rate', type=float, default=0)
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--readings', type=int, default=1000)
+    parser.add_argument(
+        '--scenario', action='append', choices=[
+            'dispatch', 'pagination', 'readings', 'create_reading',
+            'create_readings',
+        ],
+        help='run only these scenarios (repeatable)',
+    )
+    parser.add_argument('--save', help='write the results to this file')
+    parser.add_argument('--compare', help='results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    conn, child_conn = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve, args=(child_conn, {
+        'pages': args.pages, 'readings': args.readings,
+        'latency': args.latency, 'error_rate': args.error_rate,
+        'throttle_rate': args.throttle_rate,
+    }))
+    server.start()
+    url = conn.recv()
+
+    faults = args.error_rate or args.throttle_rate
+    results = {}
+    try:
+        with Ensek(
+            api_url=url, api_key='benchmark',
+            # Retry injected failures, including POSTs, straight away
+            retry_policy=RetryPolicy(
+                max_attempts=10, base_wait=0.001, budget_ratio=1,
+                retry_non_idempotent=True,
+            ) if faults else None,
+            rate_limiter=RateLimiter() if args.throttle_rate else None,
+        ) as client:
+            for name, (call, requests_per_call) in scenarios(
+                client, args
+            ).items():
+                if args.scenario and name not in args.scenario:
+                    continue
+                result = results[name] = run_scenario(
+                    call, requests_per_call, args
+                )
+                print(
+                    f'{name:16} {result["requests_per_second"]:9.0f} req/s  '
+                    f'p50 {result["p50_ms"]:7.2f}ms  '
+                    f'p99 {result["p99_ms"]:7.2f}ms  '
+                    f'{result["memory_kib"]:8.1f} KiB/call'
+                )
+    finally:
+        conn.send('stop')
+        server.join()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            worse = regressions(results, json.load(f), args.tolerance)
+        for regression in worse:
+            print(f'Regression: {regression}')
+        if worse:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Per-call overhead of turning `get_*` arguments into a path and query params,
+with the compiled routes and with the per-call template parsing they
+replaced, and of a whole `get_*` call with the HTTP request stubbed out.
+
+    python -m benchmarks.bench_dispatch --calls 200000
+"""
+import argparse
+import time
+
+import stringcase
+
+from ensek import Ensek
+
+CALLS = [
+    ('get_account', {'account_id': 1507}),
+    ('get_meter_point_readings', {'meter_point_id': 1597}),
+    ('get_account_tariffs', {'account_id': 1507, 'include_history': True}),
+    ('get_addresses_at_postcode', {'postcode': 'se14yu'}),
+]
+
+
+def legacy_endpoint_request(client, name, **kwargs):
+    # `_endpoint_request` before routes were compiled
+    path = client.ENDPOINTS[name]
+    params = {}
+    for key, val in kwargs.items():
+        if f'${key}' not in path.template:
+            params[stringcase.camelcase(key)] = val
+    return path.substitute(**kwargs), params
+
+
+def timed(call, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        call()
+    return (time.perf_counter() - start) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=100000)
+    args = parser.parse_args()
+
+    client = Ensek(api_url='http://localhost', api_key='benchmark')
+    client._request = lambda *args, **kwargs: {}
+    for name, kwargs in CALLS:
+        legacy = timed(
+            lambda: legacy_endpoint_request(client, name, **kwargs),
+            args.calls,
+        )
+        routed = timed(
+            lambda: client._endpoint_request(name, **kwargs), args.calls
+        )
+        call = timed(lambda: getattr(client, name)(**kwargs), args.calls)
+        print(
+            f'{name:28} legacy {legacy * 1e6:6.2f}us  '
+            f'routed {routed * 1e6:6.2f}us ({legacy / routed:4.1f}x)  '
+            f'full call {call * 1e6:6.2f}us'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Memory held by meter point readings as decoded JSON dicts versus
+`ensek.models` objects, measured with tracemalloc.
+
+Models hold their fields in slots and only turn nested objects (the register
+readings) into models when first read, so they are measured both straight
+after construction and once every nested reading has been accessed.
+
+    python -m benchmarks.bench_models --readings 100000
+"""
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+
+from ensek.models import Reading
+
+
+def readings_json(count):
+    return json.dumps([
+        {
+            'id': num,
+            'readingType': 'Actual',
+            'meterPointId': 1597,
+            'dateTime': '2018-07-30T00:00:00',
+            'createdDate': '2018-07-30T12:58:53.237',
+            'readings': [{'id': num, 'registerId': 1496, 'value': 2.0}],
+            'meterReadingSource': 'SMART',
+        }
+        for num in range(count)
+    ])
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size, elapsed
+
+
+def touch(readings):
+    for reading in readings:
+        reading.date_time
+        for register in reading.readings:
+            register.value
+    return readings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--readings', type=int, default=100000)
+    args = parser.parse_args()
+    text = readings_json(args.readings)
+
+    dicts, dicts_size, dicts_time = measure(lambda: json.loads(text))
+    print(
+        f'dicts: {dicts_size / 2 ** 20:.1f} MiB, '
+        f'{dicts_time:.3f}s to decode'
+    )
+    del dicts
+
+    models, models_size, models_time = measure(
+        lambda: [Reading(item) for item in json.loads(text)]
+    )
+    print(
+        f'models: {models_size / 2 ** 20:.1f} MiB '
+        f'({models_size / dicts_size:.0%} of dicts), '
+        f'{models_time:.3f}s to decode'
+    )
+    del models
+
+    touched, touched_size, touched_time = measure(
+        lambda: touch([Reading(item) for item in json.loads(text)])
+    )
+    print(
+        f'models, all fields read: {touched_size / 2 ** 20:.1f} MiB '
+        f'({touched_size / dicts_size:.0%} of dicts), '
+        f'{touched_time:.3f}s to decode and read'
+    )
+
+
+if __name__ == '__main__':
+    main()
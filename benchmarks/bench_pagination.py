@@ -0,0 +1,56 @@
+"""
+Full enumeration of /SignUps/Completed against a local server with injected
+latency, with and without prefetching the next pages.
+
+Each page of signups costs the consumer `--work` seconds to process. The
+cursor for a page is only known once the previous page has arrived, so the
+best pipelining can do is overlap fetching with processing: the speedup
+tends to 2x as the per-page work approaches the request latency.
+
+    python -m benchmarks.bench_pagination --pages 20 --latency 0.05
+"""
+import argparse
+import time
+
+from ensek import Ensek
+
+from tests.fake_server import FakeEnsekServer, signup_routes
+
+
+def enumerate_signups(client, *, page_size, work, prefetch):
+    start = time.perf_counter()
+    count = 0
+    for signup in client.iter_completed_signups(after=0, prefetch=prefetch):
+        count += 1
+        if count % page_size == 0:
+            time.sleep(work)
+    return count, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--work', type=float, default=None)
+    args = parser.parse_args()
+    work = args.latency if args.work is None else args.work
+
+    routes = signup_routes(pages=args.pages, page_size=args.page_size)
+    with FakeEnsekServer(routes=routes, latency=args.latency) as server:
+        with Ensek(api_url=server.url, api_key='benchmark') as client:
+            baseline = None
+            for prefetch in (0, 1, 2, 4):
+                count, elapsed = enumerate_signups(
+                    client, page_size=args.page_size, work=work,
+                    prefetch=prefetch,
+                )
+                baseline = baseline or elapsed
+                print(
+                    f'prefetch={prefetch}: {count} signups in '
+                    f'{elapsed:.3f}s ({baseline / elapsed:.2f}x)'
+                )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Consumption between consecutive meter reads, computed from decoded
+`get_meter_point_readings` responses with `ensek.readings.ReadingCollection`
+versus grouping dict-of-list rows in Python loops.
+
+Both start from the decoded JSON of every meter point and end with the
+consumption of each register between consecutive reads, ordered by time.
+
+    python -m benchmarks.bench_readings --meter-points 2000 --readings 50
+"""
+import argparse
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from ensek.models import parse_datetime
+from ensek.readings import ReadingCollection
+
+
+def portfolio(meter_points, readings):
+    start = datetime(2018, 1, 1)
+    data = {}
+    for meter_point_id in range(meter_points):
+        totals = [0.0, 0.0]
+        items = []
+        for num in range(readings):
+            totals = [total + random.uniform(0, 500) for total in totals]
+            items.append({
+                'id': meter_point_id * readings + num,
+                'readingType': 'Actual',
+                'meterPointId': meter_point_id,
+                'dateTime': (start + timedelta(days=30 * num)).isoformat(),
+                'createdDate': '2018-07-30T12:58:53.237',
+                'readings': [
+                    {'id': num, 'registerId': 2 * meter_point_id + reg,
+                     'value': total}
+                    for reg, total in enumerate(totals)
+                ],
+                'meterReadingSource': 'SMART',
+            })
+        # Readings don't come back in date order
+        random.shuffle(items)
+        data[meter_point_id] = items
+    return data
+
+
+def with_dicts(data):
+    rows = defaultdict(list)
+    for meter_point_id, readings in data.items():
+        for reading in readings:
+            timestamp = parse_datetime(reading['dateTime'])
+            for register in reading['readings']:
+                rows[meter_point_id, register['registerId']].append(
+                    (timestamp, register['value'])
+                )
+    consumption = {
+        'meter_point_id': [], 'register_id': [], 'start': [], 'end': [],
+        'consumption': [],
+    }
+    for (meter_point_id, register_id), reads in sorted(rows.items()):
+        reads.sort()
+        for (start, first), (end, second) in zip(reads, reads[1:]):
+            consumption['meter_point_id'].append(meter_point_id)
+            consumption['register_id'].append(register_id)
+            consumption['start'].append(start)
+            consumption['end'].append(end)
+            consumption['consumption'].append(second - first)
+    return consumption
+
+
+def with_columns(data):
+    readings = ReadingCollection()
+    for meter_point_id, items in data.items():
+        readings.add(meter_point_id, items)
+    return readings.consumption()
+
+
+def measure(func, data, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(data)
+        times.append(time.perf_counter() - start)
+    return result, min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--meter-points', type=int, default=2000)
+    parser.add_argument('--readings', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    data = portfolio(args.meter_points, args.readings)
+
+    dicts, dicts_time = measure(with_dicts, data, args.repeat)
+    columns, columns_time = measure(with_columns, data, args.repeat)
+    assert len(columns) == len(dicts['consumption'])
+
+    print(f'{len(columns)} consumption periods')
+    print(f'dict-of-list: {dicts_time:.3f}s')
+    print(
+        f'columnar: {columns_time:.3f}s '
+        f'({dicts_time / columns_time:.1f}x faster)'
+    )
+
+    # Analytics on the result: total consumption per meter point
+    start = time.perf_counter()
+    totals = defaultdict(float)
+    for meter_point_id, value in zip(
+        dicts['meter_point_id'], dicts['consumption']
+    ):
+        totals[meter_point_id] += value
+    dicts_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    np.bincount(columns['meter_point_id'], columns['consumption'])
+    columns_time = time.perf_counter() - start
+    print(
+        f'total per meter point: dict-of-list {dicts_time:.4f}s, '
+        f'columnar {columns_time:.4f}s '
+        f'({dicts_time / columns_time:.1f}x faster)'
+    )
+
+
+if __name__ == '__main__':
+    main()
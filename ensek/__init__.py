@@ -1 +1,22 @@
 from .client import *  # noqa
+from .cache import *  # noqa
+from .ratelimit import *  # noqa
+from .retry import *  # noqa
+from .breaker import *  # noqa
+from .instrument import *  # noqa
+from .models import *  # noqa
+from .sync import *  # noqa
+from .postcodes import *  # noqa
+from .outbox import *  # noqa
+
+try:
+    from .aio import *  # noqa
+except ImportError:
+    # `AsyncEnsek` needs the optional aiohttp dependency
+    pass
+
+try:
+    from .readings import *  # noqa
+except ImportError:
+    # `ReadingCollection` needs the optional numpy dependency
+    pass
@@ -0,0 +1,538 @@
+import asyncio
+import codecs
+import itertools
+from copy import deepcopy
+
+import aiohttp
+
+from .client import (
+    DEFAULT_ACCOUNT_VIEW, EnsekError, BulkResult, METER_READINGS_BATCH_SIZE,
+    _AccountViewBuilder, _BaseEnsek, _BULK_ERRORS, _RejectedError,
+    _STREAM_CHUNK_SIZE, diff_account_attributes,
+)
+from .instrument import _Timing
+from .jsonstream import _ArrayParser
+from .models import Signup
+
+__all__ = ['AsyncEnsek']
+
+
+class AsyncEnsek(_BaseEnsek):
+
+    def __init__(
+        self, *, api_url, api_key, retry_count=0, retry_wait=0,
+        retry_policy=None, limit=100, limit_per_host=0, keep_alive=True,
+        timeout=None, cache=None, circuit_breaker=None, models=False,
+        coalesce=False, instrumentation=None,
+    ):
+        super().__init__(
+            api_url=api_url, api_key=api_key, retry_count=retry_count,
+            retry_wait=retry_wait, retry_policy=retry_policy, cache=cache,
+            circuit_breaker=circuit_breaker, models=models,
+            instrumentation=instrumentation,
+        )
+        # Share identical GETs that are in flight at the same time
+        self._single_flight = (
+            _AsyncSingleFlight(self._counters) if coalesce else None
+        )
+        self._limit = limit
+        self._connector_kwargs = {
+            'limit': limit,
+            'limit_per_host': limit_per_host,
+            'force_close': not keep_alive,
+        }
+        self._timeout = self._client_timeout(timeout)
+        # The session binds to the running event loop, so it is only
+        # created on the first request
+        self._session = None
+
+    @staticmethod
+    def _client_timeout(timeout):
+        # Accept the same values as `Ensek`: a single number applied to both
+        # connecting and reading, or a (connect, read) tuple
+        if timeout is None or isinstance(timeout, aiohttp.ClientTimeout):
+            return timeout or aiohttp.ClientTimeout()
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+        else:
+            connect = read = timeout
+        return aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+
+    def _get_session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(**self._connector_kwargs),
+                headers=self._headers,
+                timeout=self._timeout,
+                trace_configs=(
+                    [_connect_trace_config()]
+                    if self._instrumentation is not None else None
+                ),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def get_all_account_ids(self):
+        return {
+            signup['accountId']
+            async for signup in self._iter_completed_signups()
+        }
+
+    def iter_completed_signups(self, after=None, stream=False):
+        if stream:
+            signups = self._stream_completed_signups(after=after)
+        else:
+            signups = self._iter_completed_signups(after=after)
+        return _map_async(Signup, signups) if self._models else signups
+
+    async def _iter_completed_signups(self, after=None):
+        while True:
+            resp = await self._get(self._completed_signups_path(after=after))
+            signups = resp['results']
+            if not signups:
+                break
+            for signup in signups:
+                yield signup
+            after = self._completed_signups_cursor(resp)
+
+    async def _stream_completed_signups(self, after=None):
+        while True:
+            rest = {}
+            newest = None
+            async for signup in self._stream(
+                self._completed_signups_path(after=after), key='results',
+                rest=rest,
+            ):
+                if newest is None or signup['accountId'] > newest:
+                    newest = signup['accountId']
+                yield signup
+            if newest is None:
+                break
+            after = rest.get('meta', {}).get('after')
+            if after is None:
+                after = newest
+
+    def stream(self, name, **kwargs):
+        path, params, key = self._stream_request(name, kwargs)
+        items = self._stream(path, params=params, endpoint=name, key=key)
+        model = self._stream_model(name)
+        return items if model is None else _map_async(model, items)
+
+    async def _stream(
+        self, path, params=None, endpoint=None, key=None, rest=None
+    ):
+        response = await self._request(
+            'get', path, params=params, endpoint=endpoint, stream=True
+        )
+        parser = _ArrayParser(key)
+        decoder = codecs.getincrementaldecoder(
+            response.charset or 'utf-8'
+        )()
+        try:
+            async for chunk in response.content.iter_chunked(
+                _STREAM_CHUNK_SIZE
+            ):
+                for item in parser.feed(decoder.decode(chunk)):
+                    yield item
+            for item in parser.close():
+                yield item
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            raise EnsekError(exc, response=None) from exc
+        finally:
+            response.release()
+        if rest is not None:
+            rest.update(parser.rest)
+
+    def get_many(self, name, params, *, concurrency=100):
+        return self._run_many(
+            self._bulk_method(name), params, concurrency=concurrency
+        )
+
+    def update_many_account_attributes(self, params, *, concurrency=100):
+        return self._run_many(
+            self.update_account_attributes, params, concurrency=concurrency
+        )
+
+    async def _run_many(self, method, params, *, concurrency):
+        if self._limit:
+            concurrency = min(concurrency, self._limit)
+        concurrency = max(1, concurrency)
+        params = iter(params)
+        pending = {}
+
+        def submit(count):
+            for kwargs in itertools.islice(params, count):
+                pending[asyncio.ensure_future(method(**kwargs))] = kwargs
+
+        submit(concurrency)
+        try:
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    kwargs = pending.pop(task)
+                    try:
+                        item = BulkResult(kwargs, task.result(), None)
+                    except _BULK_ERRORS as exc:
+                        item = BulkResult(kwargs, None, exc)
+                    yield item
+                submit(len(done))
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def get_account_view(
+        self, account_id, include=DEFAULT_ACCOUNT_VIEW, *, concurrency=100,
+    ):
+        builder = _AccountViewBuilder(account_id, include)
+        if self._limit:
+            concurrency = min(concurrency, self._limit)
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        pending = {}
+
+        async def call(name, kwargs):
+            async with semaphore:
+                return await getattr(self, name)(**kwargs)
+
+        def submit(requests):
+            for key, name, kwargs in requests:
+                pending[asyncio.ensure_future(call(name, kwargs))] = key
+
+        submit(builder.requests())
+        try:
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    key = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except _BULK_ERRORS as exc:
+                        builder.fail(key, exc)
+                    else:
+                        submit(builder.add(key, result))
+        finally:
+            for task in pending:
+                task.cancel()
+        return builder.build()
+
+    async def create_meter_reading(
+        self, *, account_id, meter_point_id, register_id, value, timestamp,
+        source=None,
+    ):
+        path, body = self._meter_reading_request(
+            account_id=account_id, meter_point_id=meter_point_id,
+            register_id=register_id, value=value, timestamp=timestamp,
+            source=source,
+        )
+        try:
+            return await self._post(
+                path=path, body=body, endpoint='create_meter_reading'
+            )
+        finally:
+            self._invalidate_cache_for(
+                account_id=account_id, meter_point_id=meter_point_id,
+            )
+
+    async def create_meter_readings(
+        self, account_id, readings, *, batch_size=METER_READINGS_BATCH_SIZE
+    ):
+        readings = iter(readings)
+        results = []
+        while True:
+            batch = list(itertools.islice(readings, batch_size))
+            if not batch:
+                return results
+            results.extend(
+                await self._submit_meter_readings(account_id, batch)
+            )
+
+    async def _submit_meter_readings(self, account_id, readings):
+        invalid = self._invalid_readings(readings)
+        if not invalid:
+            return await self._post_meter_readings(account_id, readings)
+        valid = [
+            reading for index, reading in enumerate(readings)
+            if index not in invalid
+        ]
+        return self._merge_invalid_readings(
+            readings, invalid,
+            await self._post_meter_readings(account_id, valid)
+            if valid else [],
+        )
+
+    async def _post_meter_readings(self, account_id, readings):
+        path, body = self._meter_readings_request(account_id, readings)
+        try:
+            result = await self._post(
+                path=path, body=body, endpoint='create_meter_reading'
+            )
+        except _RejectedError as exc:
+            if len(readings) == 1:
+                return [BulkResult(readings[0], None, exc)]
+            middle = len(readings) // 2
+            return (
+                await self._post_meter_readings(
+                    account_id, readings[:middle]
+                ) +
+                await self._post_meter_readings(
+                    account_id, readings[middle:]
+                )
+            )
+        except _BULK_ERRORS as exc:
+            return [BulkResult(reading, None, exc) for reading in readings]
+        finally:
+            self._invalidate_cache_for_readings(account_id, readings)
+        return [BulkResult(reading, result, None) for reading in readings]
+
+    async def update_account_attribute(
+        self, *, account_id, name, value, type
+    ):
+        path, body = self._account_attribute_request(
+            account_id=account_id, name=name, value=value, type=type,
+        )
+        await self._put_account_attributes(account_id, path, body)
+
+    async def update_account_attributes(
+        self, account_id, updated=(), deleted=()
+    ):
+        path, body = self._account_attributes_request(
+            account_id, updated=updated, deleted=deleted
+        )
+        await self._put_account_attributes(account_id, path, body)
+
+    async def sync_account_attributes(
+        self, account_id, desired, *, delete_missing=False
+    ):
+        changes = diff_account_attributes(
+            await self.get_account_attributes(account_id=account_id),
+            desired, delete_missing=delete_missing,
+        )
+        if changes.updated or changes.deleted:
+            await self.update_account_attributes(account_id, *changes)
+        return changes
+
+    async def _put_account_attributes(self, account_id, path, body):
+        try:
+            await self._put(
+                path=path, body=body, json_resp=False,
+                endpoint='update_account_attributes',
+            )
+        finally:
+            self._invalidate_cache_for(account_id=account_id)
+
+    async def _call_endpoint(self, name, kwargs):
+        return self._to_model(name, await self._endpoint_get(name, kwargs))
+
+    async def _cached_get(self, name, path, params, *, tags):
+        key = self._cache_key(name, path, params)
+        try:
+            return self._cache.get(key)
+        except KeyError:
+            pass
+        resp = await self._get(path, params=params, endpoint=name)
+        self._cache.set(name, key, resp, tags=tags)
+        return resp
+
+    def _get(self, path, params=None, endpoint=None):
+        if self._single_flight is None:
+            return self._request(
+                method='get', path=path, params=params, endpoint=endpoint
+            )
+        return self._single_flight.do(
+            self._flight_key(path, params),
+            lambda: self._request(
+                method='get', path=path, params=params, endpoint=endpoint
+            ),
+        )
+
+    def _post(self, *, path, body, endpoint=None):
+        return self._request(
+            method='post', path=path, body=body, endpoint=endpoint
+        )
+
+    def _put(self, *, path, body, json_resp=True, endpoint=None):
+        return self._request(
+            method='put', path=path, body=body, json_resp=json_resp,
+            endpoint=endpoint,
+        )
+
+    async def _request(
+        self, method, path, body=None, params=None, json_resp=True,
+        endpoint=None, stream=False,
+    ):
+        policy = self._retry_policy
+        if policy is None:
+            return await self._request_once(
+                method, path, body, params, json_resp, endpoint, stream
+            )
+        policy.record_request()
+        started_at = policy.clock()
+        attempt = 1
+        while True:
+            try:
+                return await self._request_once(
+                    method, path, body, params, json_resp, endpoint, stream,
+                    attempt=attempt,
+                )
+            except EnsekError as exc:
+                wait = self._retry_wait(
+                    exc, method=method, path=path, attempt=attempt,
+                    started_at=started_at,
+                )
+                if wait is None:
+                    raise
+            await asyncio.sleep(wait)
+            attempt += 1
+
+    async def _request_once(
+        self, method, path, body, params, json_resp, endpoint, stream=False,
+        attempt=1,
+    ):
+        if self._instrumentation is None:
+            return await self._attempt(
+                method, path, body, params, json_resp, endpoint, stream
+            )
+        timing = _Timing(self._instrumentation.clock)
+        try:
+            return await self._attempt(
+                method, path, body, params, json_resp, endpoint, stream,
+                timing=timing,
+            )
+        except Exception as exc:
+            timing.error = exc
+            raise
+        finally:
+            self._instrumentation.emit(timing.record(
+                endpoint=endpoint, method=method, path=path, attempt=attempt,
+            ))
+
+    async def _attempt(
+        self, method, path, body, params, json_resp, endpoint, stream,
+        timing=None,
+    ):
+        url = self._path_to_full_url(path)
+        if params:
+            # Match requests' encoding of query params, which aiohttp is
+            # stricter about (e.g. it rejects booleans)
+            params = {
+                key: str(val) for key, val in params.items()
+                if val is not None
+            }
+        with self._circuit(endpoint, url):
+            return await self._send(
+                method, url, body, params, json_resp, stream, timing
+            )
+
+    async def _send(
+        self, method, url, body, params, json_resp, stream, timing=None
+    ):
+        # With `stream`, a successful response is returned unread, and the
+        # caller must release it
+        try:
+            if timing is not None:
+                timing.send_start = timing.clock()
+            response = await self._get_session().request(
+                method, url, json=body, params=params,
+                trace_request_ctx=timing,
+            )
+            if timing is not None:
+                timing.headers_at = timing.clock()
+                timing.status = response.status
+            if stream and response.ok:
+                return response
+            async with response:
+                if not response.ok:
+                    raise self._bad_response_error(
+                        status_code=response.status, url=response.url,
+                        text=await response.text(), response=response,
+                    )
+                if timing is not None:
+                    # Read the body first, so decoding is timed on its own
+                    timing.bytes = len(await response.read())
+                    timing.body_at = timing.clock()
+                if json_resp:
+                    resp = await response.json(content_type=None)
+                else:
+                    resp = await response.text()
+                if timing is not None:
+                    timing.decoded_at = timing.clock()
+                return resp
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            raise EnsekError(exc, response=None) from exc
+
+
+def _connect_trace_config():
+    # Times how long each instrumented request spends opening a connection
+    # (DNS included), from the `_Timing` passed as its trace context
+    async def on_create_start(session, context, params):
+        timing = context.trace_request_ctx
+        if timing is not None:
+            timing.connect_start = timing.clock()
+
+    async def on_create_end(session, context, params):
+        timing = context.trace_request_ctx
+        if timing is not None:
+            timing.connect = timing.clock() - timing.connect_start
+
+    async def on_reuse(session, context, params):
+        timing = context.trace_request_ctx
+        if timing is not None:
+            timing.connect = 0
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_start.append(on_create_start)
+    trace_config.on_connection_create_end.append(on_create_end)
+    trace_config.on_connection_reuseconn.append(on_reuse)
+    return trace_config
+
+
+class _AsyncSingleFlight:
+    # Coroutines making the same call at the same time share one task.
+    # Callers are shielded from each other: cancelling one leaves the
+    # request running for the rest. Once a task is shared, every caller gets
+    # its own copy of the result.
+
+    def __init__(self, counters):
+        self._counters = counters
+        # Key -> [task, number of followers]
+        self._tasks = {}
+
+    async def do(self, key, func):
+        call = self._tasks.get(key)
+        leader = call is None
+        if leader:
+            task = asyncio.ensure_future(func())
+            call = self._tasks[key] = [task, 0]
+            task.add_done_callback(lambda _: self._finish(key, task))
+        else:
+            call[1] += 1
+            self._counters.incr('coalesced')
+        result = await asyncio.shield(call[0])
+        # The task is out of `_tasks` by now, so no more followers can join
+        return deepcopy(result) if call[1] else result
+
+    def _finish(self, key, task):
+        call = self._tasks.get(key)
+        if call is not None and call[0] is task:
+            del self._tasks[key]
+        # Retrieve the exception, in case every caller was cancelled
+        if not task.cancelled():
+            task.exception()
+
+
+async def _map_async(func, items):
+    async for item in items:
+        yield func(item)
@@ -0,0 +1,170 @@
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from .client import EnsekError, CircuitOpenError
+
+__all__ = ['CircuitBreaker']
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class _Circuit:
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trials = 0
+
+
+class CircuitBreaker:
+    # Fails calls fast while ENSEK is down, instead of letting each one wait
+    # for its own connection error or 5xx.
+    #
+    # There is a circuit per `ENDPOINTS` name (`per='endpoint'`) or per API
+    # host (`per='host'`). A circuit opens after `failure_threshold`
+    # consecutive failures, and while it is open calls raise
+    # `CircuitOpenError` without being sent. After `recovery_time` seconds it
+    # goes half-open and lets `half_open_max_calls` calls through at once:
+    # a success closes it again, a failure re-opens it.
+    #
+    # Only connection errors and 5xx responses count as failures; any other
+    # answer from the server shows that it is up.
+
+    def __init__(
+        self, *, failure_threshold=5, recovery_time=30, half_open_max_calls=1,
+        per='endpoint', clock=time.monotonic,
+    ):
+        if failure_threshold < 1:
+            raise ValueError('failure_threshold must be at least 1')
+        if per not in ('endpoint', 'host'):
+            raise ValueError("per must be 'endpoint' or 'host'")
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.half_open_max_calls = half_open_max_calls
+        self.per = per
+        self._clock = clock
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    @property
+    def states(self):
+        with self._lock:
+            return {
+                key: self._current_state(circuit)
+                for key, circuit in self._circuits.items()
+            }
+
+    def state(self, key):
+        with self._lock:
+            circuit = self._circuits.get(key)
+            return CLOSED if circuit is None else self._current_state(circuit)
+
+    def reset(self, key=None):
+        with self._lock:
+            if key is None:
+                self._circuits.clear()
+            else:
+                self._circuits.pop(key, None)
+
+    def key_for(self, *, endpoint, url):
+        # Calls that aren't in `ENDPOINTS` (e.g. signup pages) get a circuit
+        # for their path
+        parts = urlsplit(url)
+        if self.per == 'host':
+            return parts.netloc
+        return endpoint or parts.path
+
+    @contextmanager
+    def guard(self, key):
+        trial = self._before_call(key)
+        # `None` means the call was abandoned (e.g. cancelled) without an
+        # answer either way
+        failed = None
+        try:
+            yield
+            failed = False
+        except EnsekError as exc:
+            failed = _is_outage(exc)
+            raise
+        except Exception:
+            failed = False
+            raise
+        finally:
+            self._after_call(key, failed, trial=trial)
+
+    def _current_state(self, circuit):
+        if (
+            circuit.state == OPEN and
+            self._clock() - circuit.opened_at >= self.recovery_time
+        ):
+            circuit.state = HALF_OPEN
+            circuit.trials = 0
+        return circuit.state
+
+    def _before_call(self, key):
+        with self._lock:
+            circuit = self._circuits.setdefault(key, _Circuit())
+            state = self._current_state(circuit)
+            if state == CLOSED:
+                return False
+            if (
+                state == HALF_OPEN and
+                circuit.trials < self.half_open_max_calls
+            ):
+                circuit.trials += 1
+                return True
+            retry_in = max(
+                0, circuit.opened_at + self.recovery_time - self._clock()
+            )
+        raise CircuitOpenError(
+            f'Circuit for {key} is {state}', key=key, retry_in=retry_in
+        )
+
+    def _after_call(self, key, failed, *, trial):
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is None:
+                # Reset while the call was in flight
+                return
+            if trial:
+                if circuit.state != HALF_OPEN:
+                    return
+                circuit.trials -= 1
+                if failed:
+                    self._open(circuit)
+                elif failed is not None:
+                    self._close(circuit)
+            elif circuit.state == CLOSED and failed is not None:
+                # Calls sent before the circuit opened don't affect it later
+                if not failed:
+                    circuit.failures = 0
+                    return
+                circuit.failures += 1
+                if circuit.failures >= self.failure_threshold:
+                    self._open(circuit)
+
+    def _open(self, circuit):
+        circuit.state = OPEN
+        circuit.opened_at = self._clock()
+        circuit.trials = 0
+
+    def _close(self, circuit):
+        circuit.state = CLOSED
+        circuit.failures = 0
+        circuit.trials = 0
+
+
+def _is_outage(exc):
+    # `Ensek` errors carry a requests response and `AsyncEnsek` ones an
+    # aiohttp one; either way there is none for connection errors
+    if exc.response is None:
+        return True
+    status = getattr(
+        exc.response, 'status_code', getattr(exc.response, 'status', None)
+    )
+    return status is None or status >= 500
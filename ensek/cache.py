@@ -0,0 +1,357 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from copy import deepcopy
+
+__all__ = [
+    'CacheStats', 'ResponseCache', 'CacheBackend', 'MemoryCacheBackend',
+    'SqliteCacheBackend',
+]
+
+CacheStats = namedtuple('CacheStats', 'hits misses evictions')
+
+
+class ResponseCache:
+    # Cache for `get_*` responses.
+    #
+    # `ttls` maps `ENDPOINTS` names to how many seconds their responses stay
+    # fresh (`None` never expires). Endpoints that aren't listed are never
+    # cached. Entries are stored in `backend`, an in-process LRU by default.
+    # They carry tags so related ones can be dropped together, e.g.
+    # everything cached for an account once it's written to.
+
+    def __init__(self, ttls, *, backend=None, maxsize=1024, clock=time.time):
+        self._ttls = dict(ttls)
+        if backend is None:
+            backend = MemoryCacheBackend(maxsize=maxsize)
+        self._backend = backend
+        # Expiry times are shared with other processes when the backend is,
+        # so they are based on wall-clock time
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def endpoints(self):
+        return frozenset(self._ttls)
+
+    @property
+    def backend(self):
+        return self._backend
+
+    @property
+    def stats(self):
+        with self._lock:
+            hits, misses = self._hits, self._misses
+        return CacheStats(hits, misses, self._backend.evictions)
+
+    def __len__(self):
+        return len(self._backend)
+
+    def caches(self, name):
+        return name in self._ttls
+
+    def get(self, key):
+        try:
+            value = self._backend.get(key, now=self._clock())
+        except KeyError:
+            with self._lock:
+                self._misses += 1
+            raise
+        with self._lock:
+            self._hits += 1
+        return value
+
+    def set(self, name, key, value, tags=()):
+        ttl = self._ttls[name]
+        expires_at = None if ttl is None else self._clock() + ttl
+        tags = frozenset(tags) | {f'endpoint={name}'}
+        self._backend.set(key, value, expires_at=expires_at, tags=tags)
+
+    def invalidate(self, key):
+        self._backend.delete(key)
+
+    def invalidate_tags(self, tags):
+        self._backend.delete_tags(tags)
+
+    def clear(self):
+        self._backend.clear()
+
+
+class CacheBackend:
+    # Storage behind `ResponseCache`. Keys and tags are strings; values are
+    # JSON-compatible API responses. `get` raises `KeyError` for missing and
+    # expired entries, and `evictions` counts entries dropped for space.
+
+    evictions = 0
+
+    def get(self, key, *, now):
+        raise NotImplementedError
+
+    def set(self, key, value, *, expires_at, tags):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def delete_tags(self, tags):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryCacheBackend(CacheBackend):
+
+    def __init__(self, *, maxsize=1024):
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        self._keys_by_tag = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key, *, now):
+        with self._lock:
+            expires_at, tags, value = self._entries[key]
+            if expires_at is not None and expires_at <= now:
+                self._remove(key)
+                raise KeyError(key)
+            self._entries.move_to_end(key)
+        # Callers get their own copy, so they can't change the cached one
+        return deepcopy(value)
+
+    def set(self, key, value, *, expires_at, tags):
+        value = deepcopy(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, tags, value)
+            for tag in tags:
+                self._keys_by_tag.setdefault(tag, set()).add(key)
+            while len(self._entries) > self._maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def delete_tags(self, tags):
+        with self._lock:
+            for tag in tags:
+                for key in tuple(self._keys_by_tag.get(tag, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_tag.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        _, tags, _ = self._entries.pop(key)
+        for tag in tags:
+            keys = self._keys_by_tag[tag]
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_tag[tag]
+
+
+class SqliteCacheBackend(CacheBackend):
+    # On-disk backend that several processes on one host can share by
+    # pointing at the same file. SQLite's locking keeps writers apart and WAL
+    # mode lets readers carry on while a write is in progress.
+
+    _SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            expires_at REAL,
+            accessed_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS entries_accessed_at
+            ON entries (accessed_at);
+        CREATE TABLE IF NOT EXISTS tags (
+            tag TEXT NOT NULL,
+            key TEXT NOT NULL,
+            PRIMARY KEY (tag, key)
+        );
+        CREATE INDEX IF NOT EXISTS tags_key ON tags (key);
+    '''
+
+    def __init__(self, path, *, maxsize=None, timeout=30):
+        self._maxsize = maxsize
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(path), timeout=timeout, isolation_level=None,
+            check_same_thread=False,
+        )
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(self._SCHEMA)
+        self.evictions = 0
+
+    def get(self, key, *, now):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, expires_at FROM entries WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                raise KeyError(key)
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._delete_expired(key, now=now)
+                raise KeyError(key)
+            self._conn.execute(
+                'UPDATE entries SET accessed_at = ? WHERE key = ?',
+                (time.time(), key),
+            )
+        return json.loads(value)
+
+    def set(self, key, value, *, expires_at, tags):
+        value = json.dumps(value)
+        with self._lock, self._transaction():
+            self._delete_keys([key])
+            self._conn.execute(
+                'INSERT INTO entries (key, value, expires_at, accessed_at) '
+                'VALUES (?, ?, ?, ?)',
+                (key, value, expires_at, time.time()),
+            )
+            self._conn.executemany(
+                'INSERT INTO tags (tag, key) VALUES (?, ?)',
+                [(tag, key) for tag in tags],
+            )
+            if self._maxsize is not None:
+                self._evict()
+
+    def delete(self, key):
+        with self._lock, self._transaction():
+            self._delete_keys([key])
+
+    def delete_tags(self, tags):
+        tags = list(tags)
+        if not tags:
+            return
+        placeholders = ', '.join('?' * len(tags))
+        with self._lock, self._transaction():
+            keys = [
+                key for key, in self._conn.execute(
+                    f'SELECT DISTINCT key FROM tags '
+                    f'WHERE tag IN ({placeholders})',
+                    tags,
+                )
+            ]
+            self._delete_keys(keys)
+
+    def clear(self):
+        with self._lock, self._transaction():
+            self._conn.execute('DELETE FROM entries')
+            self._conn.execute('DELETE FROM tags')
+
+    def __len__(self):
+        with self._lock:
+            count, = self._conn.execute(
+                'SELECT COUNT(*) FROM entries'
+            ).fetchone()
+        return count
+
+    def close(self):
+        self._conn.close()
+
+    def _transaction(self):
+        return _ImmediateTransaction(self._conn)
+
+    def _delete_keys(self, keys):
+        self._conn.executemany(
+            'DELETE FROM entries WHERE key = ?', [(key,) for key in keys]
+        )
+        self._conn.executemany(
+            'DELETE FROM tags WHERE key = ?', [(key,) for key in keys]
+        )
+
+    def _delete_expired(self, key, *, now):
+        # Another process may have refreshed the entry since it was read
+        with self._transaction():
+            deleted = self._conn.execute(
+                'DELETE FROM entries WHERE key = ? AND expires_at <= ?',
+                (key, now),
+            ).rowcount
+            if deleted:
+                self._conn.execute('DELETE FROM tags WHERE key = ?', (key,))
+
+    def _evict(self):
+        count, = self._conn.execute('SELECT COUNT(*) FROM entries').fetchone()
+        if count <= self._maxsize:
+            return
+        keys = [
+            key for key, in self._conn.execute(
+                'SELECT key FROM entries ORDER BY accessed_at LIMIT ?',
+                (count - self._maxsize,),
+            )
+        ]
+        self._delete_keys(keys)
+        self.evictions += len(keys)
+
+
+class _ImmediateTransaction:
+    # Takes the write lock up front, so concurrent processes queue on
+    # SQLite's busy timeout instead of failing to upgrade a read lock
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __enter__(self):
+        self._conn.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self._conn.execute('COMMIT')
+        else:
+            self._conn.execute('ROLLBACK')
+
+
+_Validated = namedtuple('_Validated', 'headers body size')
+
+
+class _ValidatorStore:
+    # Remembers the ETag/Last-Modified validators and raw body of recent
+    # GET responses, so later requests for the same URL can be made
+    # conditional and a 304 answered from the stored body
+
+    def __init__(self, *, maxsize):
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            validated = self._entries.get(key)
+            if validated is not None:
+                self._entries.move_to_end(key)
+            return validated
+
+    def put(self, key, *, etag, last_modified, body, size):
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        with self._lock:
+            if not headers:
+                self._entries.pop(key, None)
+                return
+            self._entries[key] = _Validated(headers, body, size)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
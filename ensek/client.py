@@ -1,15 +1,32 @@
+import codecs
+import itertools
+import json
 import logging
-from urllib.parse import urljoin
-from http.client import NOT_FOUND, INTERNAL_SERVER_ERROR, BAD_REQUEST
+import threading
+from collections import Counter, deque, namedtuple
+from contextlib import contextmanager
+from concurrent.futures import (
+    Future, ThreadPoolExecutor, FIRST_COMPLETED, wait,
+)
+from copy import deepcopy
+from urllib.parse import urljoin, urlencode
+from http.client import (
+    NOT_FOUND, INTERNAL_SERVER_ERROR, BAD_REQUEST, NOT_MODIFIED,
+    TOO_MANY_REQUESTS, SERVICE_UNAVAILABLE,
+)
 from string import Template
 
-import stringcase
 import requests
+from requests.adapters import HTTPAdapter, DEFAULT_POOLSIZE
 from requests.exceptions import RequestException
-from functools import wraps
-from tenacity import (
-    retry, before_log, wait_fixed, stop_after_attempt, retry_if_exception_type
-)
+
+from .cache import _ValidatorStore
+from .instrument import _Timing
+from .jsonstream import _iter_json_array
+from .models import ENDPOINT_MODELS, Signup
+from .postcodes import normalise_postcode
+from .retry import RetryPolicy
+from .router import _compile_routes
 
 logger = logging.getLogger(__name__)
 
@@ -21,29 +38,222 @@ class EnsekError(Exception):
         super().__init__(self, message, response)
 
 
-def _retry_on_ensek_error(func):
-    def decorator(*args, **kwargs):
-        client = args[0]
-        max_retries = client._retry_count
-        retry_wait = client._retry_wait
-        if max_retries:
-            @retry(
-                stop=stop_after_attempt(max_retries),
-                wait=wait_fixed(retry_wait),
-                before=before_log(logging, logging.INFO),
-                retry=retry_if_exception_type(EnsekError),
-                reraise=True,
-            )
-            @wraps(func)
-            def wrap():
-                return func(*args, **kwargs)
-            return wrap()
-        else:
-            return func(*args, **kwargs)
-    return decorator
+class CircuitOpenError(EnsekError):
+    # Raised without contacting ENSEK while the circuit for a call is open.
+    # `retry_in` is how many seconds until it lets a trial call through.
+    def __init__(self, message, *, key, retry_in):
+        super().__init__(message, response=None)
+        self.key = key
+        self.retry_in = retry_in
+
+
+class _RejectedError(ValueError):
+    # ENSEK refused a request (a 4xx other than 404 and 429), as opposed to
+    # a response that couldn't be decoded
+    pass
+
+
+# One item of `get_many` output: the kwargs the endpoint was called with,
+# and either its result or the error it raised
+BulkResult = namedtuple('BulkResult', 'params result error')
+
+# What `sync_account_attributes` changed: the attribute dicts it updated and
+# the names of those it deleted
+AttributeChanges = namedtuple('AttributeChanges', 'updated deleted')
+
+# Parts of `get_account_view` and the `get_*` endpoints they come from.
+# 'readings' are fetched for each meter point in 'meter_points'.
+ACCOUNT_VIEW_PARTS = {
+    'account': 'get_account',
+    'settings': 'get_account_settings',
+    'meter_points': 'get_meter_points',
+    'tariffs': 'get_account_tariffs',
+    'live_balances': 'get_live_balances_detailed',
+    'attributes': 'get_account_attributes',
+    'readings': 'get_meter_point_readings',
+}
+
+# What `get_account_view` fetched: each part's result, or `None` if it
+# wasn't included or failed, with `readings` mapping meter point ids to
+# their readings. `errors` maps failed parts to the error they raised, and
+# ('readings', meter point id) to that of a meter point's readings.
+AccountView = namedtuple(
+    'AccountView', ['account_id', *ACCOUNT_VIEW_PARTS, 'errors'],
+)
+
+# Parts `get_account_view` fetches by default: all but the readings, which
+# can run to thousands per meter point
+DEFAULT_ACCOUNT_VIEW = tuple(
+    part for part in ACCOUNT_VIEW_PARTS if part != 'readings'
+)
 
+# Errors that only affect a single item of a `get_many` batch
+_BULK_ERRORS = (LookupError, ValueError, EnsekError)
+
+_EXHAUSTED = object()
+
+# Bytes read from the socket at a time when streaming a response
+_STREAM_CHUNK_SIZE = 64 * 1024
+
+# Most readings sent in one `create_meter_readings` POST
+METER_READINGS_BATCH_SIZE = 100
+
+
+class _Counters:
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counts[name] += value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+class _SingleFlight:
+    # Lets threads making the same call at the same time share it: the
+    # first one for a key makes the call, and the others wait for its
+    # result or exception. Once a call is shared, every caller gets its own
+    # copy of the result, so they can't see each other's changes.
+
+    def __init__(self, counters):
+        self._counters = counters
+        # Key -> [future, number of followers]
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = [Future(), 0]
+            else:
+                call[1] += 1
+        future = call[0]
+        if not leader:
+            self._counters.incr('coalesced')
+            return deepcopy(future.result())
+        try:
+            try:
+                result = func()
+            finally:
+                # Calls starting from now on make a new request
+                with self._lock:
+                    del self._calls[key]
+                    followers = call[1]
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        future.set_result(result)
+        return deepcopy(result) if followers else result
 
-class Ensek:
+
+def diff_account_attributes(current, desired, *, delete_missing=False):
+    # Compares `get_account_attributes` output with the attributes wanted
+    # (dicts with `name`, `value` and `type`). Attributes that are missing
+    # or differ are updated; with `delete_missing`, ones that aren't wanted
+    # are deleted.
+    current = {attribute['name']: attribute for attribute in current}
+    desired = list(desired)
+    updated = [
+        attribute for attribute in desired
+        if attribute['name'] not in current or (
+            current[attribute['name']]['value'],
+            current[attribute['name']]['type'],
+        ) != (attribute['value'], attribute['type'])
+    ]
+    deleted = []
+    if delete_missing:
+        wanted = {attribute['name'] for attribute in desired}
+        deleted = [name for name in current if name not in wanted]
+    return AttributeChanges(updated, deleted)
+
+
+class _AccountViewBuilder:
+    # Collects the results of `get_account_view`'s requests as they complete
+    # and works out the requests that follow from them. Requests are
+    # (key, endpoint name, kwargs), keyed by part or by ('readings', meter
+    # point id).
+
+    def __init__(self, account_id, include):
+        include = set(include)
+        unknown = include - set(ACCOUNT_VIEW_PARTS)
+        if unknown:
+            raise ValueError(f'Unknown account view parts: {sorted(unknown)}')
+        self._account_id = account_id
+        self._include = include
+        self._parts = dict.fromkeys(ACCOUNT_VIEW_PARTS)
+        self._errors = {}
+
+    def requests(self):
+        parts = set(self._include)
+        if 'readings' in parts:
+            parts.remove('readings')
+            parts.add('meter_points')
+        return [
+            (part, name, {'account_id': self._account_id})
+            for part, name in ACCOUNT_VIEW_PARTS.items() if part in parts
+        ]
+
+    def add(self, key, result):
+        # Returns the requests that follow from `result`
+        if isinstance(key, tuple):
+            self._parts['readings'][key[1]] = result
+            return []
+        self._parts[key] = result
+        if key != 'meter_points' or 'readings' not in self._include:
+            return []
+        self._parts['readings'] = {}
+        meter_point_ids = [
+            meter_point['id'] if isinstance(meter_point, dict)
+            else meter_point.id
+            for meter_point in result
+        ]
+        return [
+            (
+                ('readings', meter_point_id), 'get_meter_point_readings',
+                {'meter_point_id': meter_point_id},
+            )
+            for meter_point_id in meter_point_ids
+        ]
+
+    def fail(self, key, exc):
+        self._errors[key] = exc
+
+    def build(self):
+        return AccountView(
+            self._account_id, **self._parts, errors=self._errors
+        )
+
+
+def _prefetch(iterator, depth):
+    # Pull up to `depth` items from `iterator` ahead of the consumer. A single
+    # worker keeps the calls to `next` in order, which matters when each item
+    # depends on the previous one (e.g. cursor pagination).
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        ahead = deque(
+            executor.submit(next, iterator, _EXHAUSTED) for _ in range(depth)
+        )
+        try:
+            while True:
+                item = ahead.popleft().result()
+                if item is _EXHAUSTED:
+                    break
+                ahead.append(executor.submit(next, iterator, _EXHAUSTED))
+                yield item
+        finally:
+            for future in ahead:
+                future.cancel()
+
+
+class _BaseEnsek:
+    # Transport-agnostic parts of the client, shared by `Ensek` and
+    # `ensek.aio.AsyncEnsek`
 
     ENDPOINTS = {
         'get_account': Template('/accounts/$account_id'),
@@ -79,140 +289,912 @@ class Ensek:
         ),
     }
 
-    def __init__(self, *, api_url, api_key, retry_count=0, retry_wait=0):
+    # Optional query params of each `get_*` endpoint, as snake_case
+    # arguments. Other arguments that aren't in the endpoint's template are
+    # rejected with a `TypeError`.
+    QUERY_PARAMS = {
+        'get_account_tariffs': ('include_history',),
+    }
+
+    # Functions applied to `get_*` arguments before they are sent, so that
+    # equivalent values share requests and cache entries
+    ARGUMENT_CONVERTERS = {
+        'postcode': normalise_postcode,
+    }
+
+    # Members holding the array to stream, for `get_*` endpoints that
+    # return an object rather than an array
+    STREAMED_ARRAYS = {
+        'get_live_balances_detailed': 'Charges',
+    }
+
+    def __init__(
+        self, *, api_url, api_key, retry_count=0, retry_wait=0,
+        retry_policy=None, cache=None, circuit_breaker=None, models=False,
+        instrumentation=None,
+    ):
         self._api_url = api_url.rstrip('/')
         self._api_key = api_key
-        self._resource_path = None
         self._headers = {'Authorization': f'Bearer {self._api_key}'}
 
         if bool(retry_count) != bool(retry_wait):
             raise ValueError(
                 'retry_count and retry_wait must have the same truth value'
             )
+        elif retry_count and retry_policy is not None:
+            raise ValueError(
+                'retry_policy cannot be combined with retry_count/retry_wait'
+            )
+        elif retry_count:
+            # As before there was `RetryPolicy`: a fixed wait, for every
+            # method and without a budget
+            retry_policy = RetryPolicy(
+                max_attempts=retry_count, base_wait=retry_wait,
+                max_wait=retry_wait, jitter=False, budget_ratio=None,
+                retry_non_idempotent=True,
+            )
+        self._retry_policy = retry_policy
+
+        if cache is not None:
+            unknown = cache.endpoints - {
+                name for name in self.ENDPOINTS if name.startswith('get_')
+            }
+            if unknown:
+                raise ValueError(
+                    f'Cannot cache unknown endpoints: {sorted(unknown)}'
+                )
+        self._cache = cache
+        self._circuit_breaker = circuit_breaker
+        # Return `ensek.models` objects instead of dicts where there are some
+        self._models = models
+        self._counters = _Counters()
+        # `Instrumentation` to report every request to
+        self._instrumentation = instrumentation
+
+    @property
+    def metrics(self):
+        return self._counters.snapshot()
+
+    @property
+    def circuit_states(self):
+        # e.g. {'get_account': 'open'}, for health checks. Circuits that
+        # haven't been used yet are closed and not listed.
+        if self._circuit_breaker is None:
+            return {}
+        return self._circuit_breaker.states
+
+    def invalidate_cache(self, name=None, **kwargs):
+        # Drop one call's entry (name and kwargs), everything cached for an
+        # endpoint (name only), for some ids (kwargs only), or everything
+        if self._cache is None:
+            return
+        if name is not None and kwargs:
+            path, params = self._endpoint_request(name, **kwargs)
+            self._cache.invalidate(self._cache_key(name, path, params))
+        elif name is not None:
+            self._cache.invalidate_tags({f'endpoint={name}'})
+        elif kwargs:
+            self._cache.invalidate_tags(self._cache_tags(kwargs))
         else:
-            self._retry_count = retry_count
-            self._retry_wait = retry_wait
+            self._cache.clear()
 
-    def get_all_account_ids(self):
+    def _cache_key(self, name, path, params):
+        # Keys must mean the same thing to every process sharing a cache
+        # backend, so they spell out the template, path and query
+        template = self._routes[name].template
+        query = urlencode(sorted((params or {}).items()))
+        return f'{template} {path} {query}'
 
-        def _get_completed_signups(after=None):
-            if after is not None:
-                return self._get(f'/SignUps/Completed?after={after}')
-            else:
-                return self._get('/SignUps/Completed')
+    @staticmethod
+    def _flight_key(path, params):
+        return path, urlencode(sorted((params or {}).items()))
 
-        ids = []
-        last_id = None
-        while True:
-            resp = _get_completed_signups(after=last_id)
-            account_ids = tuple(r['accountId'] for r in resp['results'])
-            if not account_ids:
-                break
-            last_id = max(account_ids)
-            ids.extend(account_ids)
-        return set(ids)
+    def _cache_tags(self, kwargs):
+        # Cached responses are tagged with the ids in their path, so writes
+        # can drop everything cached for an account or meter point. Values
+        # are converted as they are for requests (e.g. postcodes normalised),
+        # so any spelling finds the tag.
+        converters = self.ARGUMENT_CONVERTERS
+        return {
+            f'{key}={converters[key](val) if key in converters else val}'
+            for key, val in kwargs.items()
+        }
 
-    def create_meter_reading(
+    def _invalidate_cache_for(self, **kwargs):
+        if self._cache is not None:
+            self._cache.invalidate_tags(self._cache_tags(kwargs))
+
+    @staticmethod
+    def _completed_signups_path(after=None):
+        if after is not None:
+            return f'/SignUps/Completed?after={after}'
+        return '/SignUps/Completed'
+
+    @staticmethod
+    def _completed_signups_cursor(resp):
+        after = resp.get('meta', {}).get('after')
+        if after is None:
+            after = max(signup['accountId'] for signup in resp['results'])
+        return after
+
+    def _meter_reading_request(
         self, *, account_id, meter_point_id, register_id, value, timestamp,
         source=None,
     ):
-        path = self.ENDPOINTS['create_meter_reading'].substitute(
+        return self._meter_readings_request(account_id, [{
+            'meter_point_id': meter_point_id,
+            'register_id': register_id,
+            'value': value,
+            'timestamp': timestamp,
+            'source': source,
+        }])
+
+    def _meter_readings_request(self, account_id, readings):
+        # Readings are dicts of `create_meter_reading` kwargs. Registers read
+        # on the same meter point at the same time share one body entry.
+        path = self._routes['create_meter_reading'].path(
             account_id=account_id
         )
-        body = [
-            {
-                'meterPointId': int(meter_point_id),
-                'dateTime': timestamp.isoformat(),
-                'meterReadingSource': source,
-                'readings': [{
-                    'registerId': int(register_id),
-                    'value': float(value),
-                }],
-            }
+        entries = {}
+        for reading in readings:
+            meter_point_id, timestamp, source, register_id, value = (
+                self._convert_reading(reading)
+            )
+            entry = entries.get((meter_point_id, timestamp, source))
+            if entry is None:
+                entry = entries[meter_point_id, timestamp, source] = {
+                    'meterPointId': meter_point_id,
+                    'dateTime': timestamp,
+                    'meterReadingSource': source,
+                    'readings': [],
+                }
+            entry['readings'].append({
+                'registerId': register_id,
+                'value': value,
+            })
+        return path, list(entries.values())
+
+    @staticmethod
+    def _convert_reading(reading):
+        # A reading's values as they are sent, or `ValueError` if it can't
+        # be sent at all
+        try:
+            return (
+                int(reading['meter_point_id']),
+                reading['timestamp'].isoformat(),
+                reading.get('source'),
+                int(reading['register_id']),
+                float(reading['value']),
+            )
+        except (KeyError, TypeError, ValueError, AttributeError) as exc:
+            raise ValueError(f'Invalid meter reading: {exc!r}') from exc
+
+    def _invalid_readings(self, readings):
+        # Index -> error of the readings that can't be sent, so bulk calls
+        # report them rather than failing the whole batch
+        invalid = {}
+        for index, reading in enumerate(readings):
+            try:
+                self._convert_reading(reading)
+            except ValueError as exc:
+                invalid[index] = exc
+        return invalid
+
+    @staticmethod
+    def _merge_invalid_readings(readings, invalid, results):
+        # `results` are those of the valid readings, in order
+        results = iter(results)
+        return [
+            BulkResult(reading, None, invalid[index]) if index in invalid
+            else next(results)
+            for index, reading in enumerate(readings)
         ]
-        return self._post(path=path, body=body)
 
-    def update_account_attribute(self, *, account_id, name, value, type):
-        path = self.ENDPOINTS['update_account_attributes'].substitute(
+    def _invalidate_cache_for_readings(self, account_id, readings):
+        if self._cache is not None:
+            tags = self._cache_tags({'account_id': account_id})
+            for reading in readings:
+                tags |= self._cache_tags(
+                    {'meter_point_id': reading['meter_point_id']}
+                )
+            self._cache.invalidate_tags(tags)
+
+    def _account_attribute_request(self, *, account_id, name, value, type):
+        return self._account_attributes_request(
+            account_id, updated=[{'name': name, 'value': value, 'type': type}]
+        )
+
+    def _account_attributes_request(self, account_id, updated=(), deleted=()):
+        # `updated` holds attribute dicts (`name`, `value` and `type`) and
+        # `deleted` attribute names
+        path = self._routes['update_account_attributes'].path(
             account_id=account_id
         )
         body = {
-            'updatedAttributes': [{
-                'accountId': account_id,
-                'name': name,
-                'value': value,
-                'type': type,
-            }],
-            'deletedAttributes': []
+            'updatedAttributes': [
+                {
+                    'accountId': account_id,
+                    'name': attribute['name'],
+                    'value': attribute['value'],
+                    'type': attribute['type'],
+                }
+                for attribute in updated
+            ],
+            'deletedAttributes': [
+                {'accountId': account_id, 'name': name} for name in deleted
+            ],
         }
-        self._put(path=path, body=body, json_resp=False)
+        return path, body
 
-    def _path_to_full_url(self, path):
-        return urljoin(self._api_url, path.lstrip('/'))
+    def _endpoint_get(self, name, kwargs):
+        path, params = self._endpoint_request(name, **kwargs)
+        if self._cache is not None and self._cache.caches(name):
+            placeholders = self._routes[name].placeholders
+            return self._cached_get(
+                name, path, params, tags=self._cache_tags({
+                    key: val for key, val in kwargs.items()
+                    if key in placeholders
+                }),
+            )
+        return self._get(path, params=params, endpoint=name)
 
-    def _get(self, path, params=None):
-        return self._request(method='get', path=path, params=params)
+    def _to_model(self, name, resp):
+        # Responses are cached and revalidated as plain JSON, and only
+        # turned into models on their way out
+        model = ENDPOINT_MODELS.get(name) if self._models else None
+        if model is None:
+            return resp
+        if isinstance(resp, list):
+            return [model(item) for item in resp]
+        return model(resp)
 
-    def _post(self, *, path, body):
-        return self._request(method='post', path=path, body=body)
+    def _stream_model(self, name):
+        if self._models and name not in self.STREAMED_ARRAYS:
+            return ENDPOINT_MODELS.get(name)
+        return None
 
-    def _put(self, *, path, body, json_resp=True):
-        return self._request(
-            method='put', path=path, body=body, json_resp=json_resp
+    def _stream_request(self, name, kwargs):
+        self._bulk_method(name)
+        path, params = self._endpoint_request(name, **kwargs)
+        return path, params, self.STREAMED_ARRAYS.get(name)
+
+    def _bulk_method(self, name):
+        if not name.startswith('get_') or name not in self.ENDPOINTS:
+            raise ValueError(f'{name} is not a get_* endpoint')
+        return getattr(self, name)
+
+    def _retry_wait(self, exc, *, method, path, attempt, started_at):
+        if isinstance(exc, CircuitOpenError):
+            return None
+        wait = self._retry_policy.next_wait(
+            method=method, attempt=attempt, started_at=started_at
         )
+        if wait is not None:
+            logger.info(
+                'Retrying %s %s in %.2fs after attempt %d failed: %s',
+                method.upper(), path, wait, attempt, exc.message,
+            )
+            self._counters.incr('retries')
+        return wait
 
-    @_retry_on_ensek_error
-    def _request(self, method, path, body=None, params=None, json_resp=True):
-        url = self._path_to_full_url(path)
+    def _path_to_full_url(self, path):
+        return urljoin(self._api_url, path.lstrip('/'))
+
+    @contextmanager
+    def _circuit(self, endpoint, url):
+        breaker = self._circuit_breaker
+        if breaker is None:
+            yield
+            return
+        key = breaker.key_for(endpoint=endpoint, url=url)
         try:
-            response = getattr(requests, method)(
-                url, headers=self._headers, json=body, params=params
-            )
-        except RequestException as exc:
-            raise EnsekError(exc, response=None) from exc
-        if not response.ok:
-            self._handle_bad_response(response)
-        if json_resp:
-            return response.json()
-        return response.text
+            with breaker.guard(key):
+                yield
+        except CircuitOpenError:
+            self._counters.incr('circuit_rejected')
+            raise
 
     @staticmethod
-    def _handle_bad_response(response):
-        msg = f'{response.status_code} {response.request.url}'
-        if response.status_code == NOT_FOUND:
-            raise LookupError(msg)
+    def _bad_response_error(*, status_code, url, text, response):
+        msg = f'{status_code} {url}'
+        if status_code == NOT_FOUND:
+            return LookupError(msg)
+        elif status_code == TOO_MANY_REQUESTS:
+            # Throttling is transient, so it is retried like a server error
+            return EnsekError(f'{msg}: {text}', response=response)
         elif (
-            response.status_code >= BAD_REQUEST and
-            response.status_code < INTERNAL_SERVER_ERROR
+            status_code >= BAD_REQUEST and
+            status_code < INTERNAL_SERVER_ERROR
         ):
-            raise ValueError(msg)
+            return _RejectedError(msg)
         else:
-            msg = f'{msg}: {response.text}'
-            raise EnsekError(msg, response=response)
+            msg = f'{msg}: {text}'
+            return EnsekError(msg, response=response)
 
-    def __getattr__(self, name):
-        if name.startswith('get_'):
-            try:
-                self._resource_path = self.ENDPOINTS[name]
-            except KeyError:
-                return self.__dict__[name]
-        else:
-            # If the client method doesn't have `get_` prefix, assume it's
-            # defined on the class
-            return self.__dict__[name]
+    def _endpoint_request(self, name, **kwargs):
+        return self._routes[name].build(kwargs)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if any(
+            attr in vars(cls)
+            for attr in ('ENDPOINTS', 'QUERY_PARAMS', 'ARGUMENT_CONVERTERS')
+        ):
+            _add_endpoint_methods(cls)
+
+
+def _endpoint_method(name):
+    # Each `get_*` endpoint is a plain method bound to its own template, so
+    # calls on a shared client never depend on state left by another call
+    def method(self, **kwargs):
+        return self._call_endpoint(name, kwargs)
+    method.__name__ = method.__qualname__ = name
+    return method
+
+
+def _add_endpoint_methods(cls):
+    # `ENDPOINTS` are compiled once per class, rather than parsed per call
+    cls._routes = _compile_routes(
+        cls.ENDPOINTS, cls.QUERY_PARAMS, cls.ARGUMENT_CONVERTERS
+    )
+    for name in cls.ENDPOINTS:
+        if name.startswith('get_') and name not in vars(cls):
+            setattr(cls, name, _endpoint_method(name))
+
+
+_add_endpoint_methods(_BaseEnsek)
+
+
+class Ensek(_BaseEnsek):
+
+    def __init__(
+        self, *, api_url, api_key, retry_count=0, retry_wait=0,
+        retry_policy=None, pool_connections=DEFAULT_POOLSIZE,
+        pool_maxsize=DEFAULT_POOLSIZE, keep_alive=True, timeout=None,
+        cache=None, conditional_requests=False, conditional_maxsize=256,
+        rate_limiter=None, circuit_breaker=None, models=False,
+        coalesce=False, instrumentation=None,
+    ):
+        super().__init__(
+            api_url=api_url, api_key=api_key, retry_count=retry_count,
+            retry_wait=retry_wait, retry_policy=retry_policy, cache=cache,
+            circuit_breaker=circuit_breaker, models=models,
+            instrumentation=instrumentation,
+        )
+        # Share identical GETs that are in flight at the same time
+        self._single_flight = (
+            _SingleFlight(self._counters) if coalesce else None
+        )
+        if not keep_alive:
+            self._headers['Connection'] = 'close'
+        # Remember ETag/Last-Modified of GET responses and revalidate them,
+        # so unchanged resources come back as a bodyless 304
+        self._validators = (
+            _ValidatorStore(maxsize=conditional_maxsize)
+            if conditional_requests else None
+        )
+        self._rate_limiter = rate_limiter
+        # Either a single number or a (connect, read) tuple, as accepted
+        # by requests
+        self._timeout = timeout
+        self._pool_maxsize = pool_maxsize
+        self._session = self._build_session(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize
+        )
+
+    @staticmethod
+    def _build_session(*, pool_connections, pool_maxsize):
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def close(self):
+        self._session.close()
+
+    def __enter__(self):
         return self
 
-    def __call__(self, **kwargs):
-        path = self._resource_path
-        self._resource_path = None
-        path_kwargs = {}
-        params = {}
-        for key, val in kwargs.items():
-            if f'${key}' in path.template:
-                path_kwargs[key] = val
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_all_account_ids(self):
+        return {
+            signup['accountId'] for signup in self._iter_completed_signups()
+        }
+
+    def iter_completed_signups(self, after=None, prefetch=0, stream=False):
+        # Pages are keyed on account id, so passing the `accountId` of the
+        # last processed signup as `after` resumes from the next one.
+        # With `prefetch`, up to that many pages are fetched in the
+        # background while the caller works through the current one.
+        # With `stream`, each page's signups are yielded as they are read.
+        if stream:
+            if prefetch:
+                raise ValueError('prefetch cannot be combined with stream')
+            signups = self._stream_completed_signups(after=after)
+        else:
+            signups = self._iter_completed_signups(
+                after=after, prefetch=prefetch
+            )
+        return map(Signup, signups) if self._models else signups
+
+    def _iter_completed_signups(self, after=None, prefetch=0):
+        pages = self._iter_completed_signup_pages(after=after)
+        if prefetch:
+            pages = _prefetch(pages, prefetch)
+        for signups, _ in pages:
+            yield from signups
+
+    def _iter_completed_signup_pages(self, after=None):
+        # Yields each page's signups with the cursor that resumes after it
+        while True:
+            resp = self._get(self._completed_signups_path(after=after))
+            signups = resp['results']
+            if not signups:
+                break
+            after = self._completed_signups_cursor(resp)
+            yield signups, after
+
+    def _stream_completed_signups(self, after=None):
+        while True:
+            # The page's other members (e.g. `meta`) are only known once
+            # its results have been read
+            rest = {}
+            newest = None
+            for signup in self._stream(
+                self._completed_signups_path(after=after), key='results',
+                rest=rest,
+            ):
+                if newest is None or signup['accountId'] > newest:
+                    newest = signup['accountId']
+                yield signup
+            if newest is None:
+                break
+            after = rest.get('meta', {}).get('after')
+            if after is None:
+                after = newest
+
+    def stream(self, name, **kwargs):
+        # Yields the items of the array returned by the `get_*` endpoint
+        # `name` as they are read off the socket, so memory use stays flat
+        # however big the response is. Streamed responses aren't cached.
+        path, params, key = self._stream_request(name, kwargs)
+        items = self._stream(path, params=params, endpoint=name, key=key)
+        model = self._stream_model(name)
+        return items if model is None else map(model, items)
+
+    def _stream(self, path, params=None, endpoint=None, key=None, rest=None):
+        response = self._request(
+            'get', path, params=params, endpoint=endpoint, stream=True
+        )
+        with response:
+            decoder = codecs.getincrementaldecoder(
+                response.encoding or 'utf-8'
+            )()
+            chunks = (
+                decoder.decode(chunk)
+                for chunk in response.iter_content(_STREAM_CHUNK_SIZE)
+            )
+            try:
+                yield from _iter_json_array(chunks, key=key, rest=rest)
+            except RequestException as exc:
+                raise EnsekError(exc, response=None) from exc
+
+    def get_many(self, name, params, *, concurrency=DEFAULT_POOLSIZE):
+        return self._run_many(
+            self._bulk_method(name), params, concurrency=concurrency
+        )
+
+    def update_many_account_attributes(
+        self, params, *, concurrency=DEFAULT_POOLSIZE
+    ):
+        # `params` are dicts of `update_account_attributes` kwargs, e.g. one
+        # per account. Yields a `BulkResult` per dict as it completes.
+        return self._run_many(
+            self.update_account_attributes, params, concurrency=concurrency
+        )
+
+    def _run_many(self, method, params, *, concurrency):
+        # Concurrency is capped at the connection pool size, as extra
+        # workers would only queue for (or churn) connections
+        concurrency = max(1, min(concurrency, self._pool_maxsize))
+        params = iter(params)
+        pending = {}
+
+        def submit(count):
+            for kwargs in itertools.islice(params, count):
+                pending[executor.submit(method, **kwargs)] = kwargs
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            submit(concurrency)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kwargs = pending.pop(future)
+                    try:
+                        item = BulkResult(kwargs, future.result(), None)
+                    except _BULK_ERRORS as exc:
+                        item = BulkResult(kwargs, None, exc)
+                    yield item
+                submit(len(done))
+
+    def get_account_view(
+        self, account_id, include=DEFAULT_ACCOUNT_VIEW, *,
+        concurrency=DEFAULT_POOLSIZE,
+    ):
+        # Fetches the `ACCOUNT_VIEW_PARTS` in `include` concurrently, and
+        # each meter point's readings as soon as the meter points arrive.
+        # Returns an `AccountView`; a part failing with a `get_many` error
+        # leaves the others in place.
+        builder = _AccountViewBuilder(account_id, include)
+        concurrency = max(1, min(concurrency, self._pool_maxsize))
+        pending = {}
+
+        def submit(requests):
+            for key, name, kwargs in requests:
+                future = executor.submit(getattr(self, name), **kwargs)
+                pending[future] = key
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            submit(builder.requests())
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except _BULK_ERRORS as exc:
+                        builder.fail(key, exc)
+                    else:
+                        submit(builder.add(key, result))
+        return builder.build()
+
+    def create_meter_reading(
+        self, *, account_id, meter_point_id, register_id, value, timestamp,
+        source=None,
+    ):
+        path, body = self._meter_reading_request(
+            account_id=account_id, meter_point_id=meter_point_id,
+            register_id=register_id, value=value, timestamp=timestamp,
+            source=source,
+        )
+        try:
+            return self._post(
+                path=path, body=body, endpoint='create_meter_reading'
+            )
+        finally:
+            self._invalidate_cache_for(
+                account_id=account_id, meter_point_id=meter_point_id,
+            )
+
+    def create_meter_readings(
+        self, account_id, readings, *, batch_size=METER_READINGS_BATCH_SIZE
+    ):
+        # Submits many readings (dicts of `create_meter_reading` kwargs) in
+        # POSTs of up to `batch_size` readings, in order. Returns a
+        # `BulkResult` per reading.
+        readings = iter(readings)
+        results = []
+        while True:
+            batch = list(itertools.islice(readings, batch_size))
+            if not batch:
+                return results
+            results.extend(self._submit_meter_readings(account_id, batch))
+
+    def submit_meter_readings(
+        self, readings, *, batch_size=METER_READINGS_BATCH_SIZE,
+        concurrency=DEFAULT_POOLSIZE,
+    ):
+        # Cross-account version of `create_meter_readings`: readings also
+        # carry their `account_id`, and are grouped into per-account batches
+        # that are sent as they fill up, several accounts at a time. An
+        # account's batches are sent one at a time and in order, as ENSEK
+        # checks each reading against the previous ones. Yields a
+        # `BulkResult` per reading as its batch completes.
+        concurrency = max(1, min(concurrency, self._pool_maxsize))
+        buffers = {}
+        ready = deque()
+        pending = {}
+
+        def submit():
+            # Start the oldest batches of accounts with none in flight
+            busy = set(pending.values())
+            skipped = []
+            while ready and len(pending) < concurrency:
+                account_id, batch = ready.popleft()
+                if account_id in busy:
+                    skipped.append((account_id, batch))
+                    continue
+                busy.add(account_id)
+                future = executor.submit(
+                    self._submit_meter_readings, account_id, batch
+                )
+                pending[future] = account_id
+            ready.extendleft(reversed(skipped))
+
+        def collect(timeout=None):
+            done, _ = wait(
+                pending, timeout=timeout, return_when=FIRST_COMPLETED
+            )
+            for future in done:
+                del pending[future]
+                yield from future.result()
+            submit()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for reading in readings:
+                account_id = reading['account_id']
+                buffer = buffers.setdefault(account_id, [])
+                buffer.append(reading)
+                if len(buffer) < batch_size:
+                    continue
+                ready.append((account_id, buffers.pop(account_id)))
+                submit()
+                yield from collect(timeout=0)
+                # Don't read further ahead than the workers can keep up with
+                while len(ready) >= concurrency:
+                    yield from collect()
+            ready.extend(buffers.items())
+            submit()
+            while pending:
+                yield from collect()
+
+    def _submit_meter_readings(self, account_id, readings):
+        invalid = self._invalid_readings(readings)
+        if not invalid:
+            return self._post_meter_readings(account_id, readings)
+        valid = [
+            reading for index, reading in enumerate(readings)
+            if index not in invalid
+        ]
+        return self._merge_invalid_readings(
+            readings, invalid,
+            self._post_meter_readings(account_id, valid) if valid else [],
+        )
+
+    def _post_meter_readings(self, account_id, readings):
+        path, body = self._meter_readings_request(account_id, readings)
+        try:
+            result = self._post(
+                path=path, body=body, endpoint='create_meter_reading'
+            )
+        except _RejectedError as exc:
+            if len(readings) == 1:
+                return [BulkResult(readings[0], None, exc)]
+            # ENSEK rejects the whole batch for one bad reading, so split it
+            # to find out which ones were at fault
+            middle = len(readings) // 2
+            return (
+                self._post_meter_readings(account_id, readings[:middle]) +
+                self._post_meter_readings(account_id, readings[middle:])
+            )
+        except _BULK_ERRORS as exc:
+            return [BulkResult(reading, None, exc) for reading in readings]
+        finally:
+            self._invalidate_cache_for_readings(account_id, readings)
+        return [BulkResult(reading, result, None) for reading in readings]
+
+    def update_account_attribute(
+        self, *, account_id, name, value, type
+    ):
+        path, body = self._account_attribute_request(
+            account_id=account_id, name=name, value=value, type=type,
+        )
+        self._put_account_attributes(account_id, path, body)
+
+    def update_account_attributes(self, account_id, updated=(), deleted=()):
+        path, body = self._account_attributes_request(
+            account_id, updated=updated, deleted=deleted
+        )
+        self._put_account_attributes(account_id, path, body)
+
+    def sync_account_attributes(
+        self, account_id, desired, *, delete_missing=False
+    ):
+        # Brings an account's attributes in line with `desired`, sending
+        # only what differs. Returns the `AttributeChanges` that were made.
+        changes = diff_account_attributes(
+            self.get_account_attributes(account_id=account_id), desired,
+            delete_missing=delete_missing,
+        )
+        if changes.updated or changes.deleted:
+            self.update_account_attributes(account_id, *changes)
+        return changes
+
+    def _put_account_attributes(self, account_id, path, body):
+        try:
+            self._put(
+                path=path, body=body, json_resp=False,
+                endpoint='update_account_attributes',
+            )
+        finally:
+            self._invalidate_cache_for(account_id=account_id)
+
+    def _call_endpoint(self, name, kwargs):
+        return self._to_model(name, self._endpoint_get(name, kwargs))
+
+    def _cached_get(self, name, path, params, *, tags):
+        key = self._cache_key(name, path, params)
+        try:
+            return self._cache.get(key)
+        except KeyError:
+            pass
+        resp = self._get(path, params=params, endpoint=name)
+        self._cache.set(name, key, resp, tags=tags)
+        return resp
+
+    def _get(self, path, params=None, endpoint=None):
+        if self._single_flight is None:
+            return self._request(
+                method='get', path=path, params=params, endpoint=endpoint
+            )
+        return self._single_flight.do(
+            self._flight_key(path, params),
+            lambda: self._request(
+                method='get', path=path, params=params, endpoint=endpoint
+            ),
+        )
+
+    def _post(self, *, path, body, endpoint=None):
+        return self._request(
+            method='post', path=path, body=body, endpoint=endpoint
+        )
+
+    def _put(self, *, path, body, json_resp=True, endpoint=None):
+        return self._request(
+            method='put', path=path, body=body, json_resp=json_resp,
+            endpoint=endpoint,
+        )
+
+    def _request(
+        self, method, path, body=None, params=None, json_resp=True,
+        endpoint=None, stream=False,
+    ):
+        # With `stream`, the response is returned unread once its status has
+        # been checked
+        policy = self._retry_policy
+        if policy is None:
+            return self._request_once(
+                method, path, body, params, json_resp, endpoint, stream
+            )
+        policy.record_request()
+        started_at = policy.clock()
+        attempt = 1
+        while True:
+            try:
+                return self._request_once(
+                    method, path, body, params, json_resp, endpoint, stream,
+                    attempt=attempt,
+                )
+            except EnsekError as exc:
+                wait = self._retry_wait(
+                    exc, method=method, path=path, attempt=attempt,
+                    started_at=started_at,
+                )
+                if wait is None:
+                    raise
+            policy.sleep(wait)
+            attempt += 1
+
+    def _request_once(
+        self, method, path, body, params, json_resp, endpoint, stream=False,
+        attempt=1,
+    ):
+        if self._instrumentation is None:
+            return self._attempt(
+                method, path, body, params, json_resp, endpoint, stream
+            )
+        timing = _Timing(self._instrumentation.clock)
+        try:
+            return self._attempt(
+                method, path, body, params, json_resp, endpoint, stream,
+                timing=timing,
+            )
+        except Exception as exc:
+            timing.error = exc
+            raise
+        finally:
+            self._instrumentation.emit(timing.record(
+                endpoint=endpoint, method=method, path=path, attempt=attempt,
+            ))
+
+    def _attempt(
+        self, method, path, body, params, json_resp, endpoint, stream,
+        timing=None,
+    ):
+        url = self._path_to_full_url(path)
+        headers = self._headers
+        validated = None
+        if (
+            method == 'get' and json_resp and not stream and
+            self._validators is not None
+        ):
+            validator_key = (url, urlencode(sorted((params or {}).items())))
+            validated = self._validators.get(validator_key)
+            if validated is not None:
+                headers = {**headers, **validated.headers}
+        with self._circuit(endpoint, url):
+            response = self._limited_send(
+                method, url, headers, body, params, stream, timing
+            )
+            if timing is not None:
+                # requests has read the body unless streaming, and
+                # `elapsed` runs until the headers were parsed
+                timing.status = response.status_code
+                timing.headers_at = (
+                    timing.send_start + response.elapsed.total_seconds()
+                )
+                if not stream:
+                    timing.body_at = timing.clock()
+                    timing.bytes = len(response.content)
+            if validated is not None and (
+                response.status_code == NOT_MODIFIED
+            ):
+                self._counters.incr('not_modified')
+                self._counters.incr('bytes_saved', validated.size)
+                # Decoded afresh, so callers never share a mutable body
+                return json.loads(validated.body)
+            if not response.ok:
+                try:
+                    self._handle_bad_response(response)
+                finally:
+                    if stream:
+                        # Hands the connection back to the pool now, not
+                        # when the response is garbage collected
+                        response.close()
+        if stream:
+            return response
+        if not json_resp:
+            return response.text
+        resp = response.json()
+        if timing is not None:
+            timing.decoded_at = timing.clock()
+        if method == 'get' and self._validators is not None:
+            self._validators.put(
+                validator_key,
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified'),
+                body=response.content,
+                size=len(response.content),
+            )
+        return resp
+
+    def _limited_send(
+        self, method, url, headers, body, params, stream, timing=None
+    ):
+        args = (method, url, headers, body, params, stream)
+        try:
+            if self._rate_limiter is None:
+                if timing is not None:
+                    timing.send_start = timing.clock()
+                response = self._send(*args)
             else:
-                # API query params are in camelCase
-                key = stringcase.camelcase(key)
-                params[key] = val
-        path = path.substitute(**kwargs)
-        return self._get(path, params=params)
+                with self._rate_limiter.limit():
+                    if timing is not None:
+                        timing.send_start = timing.clock()
+                    response = self._send(*args)
+        except RequestException as exc:
+            raise EnsekError(exc, response=None) from exc
+        if (
+            self._rate_limiter is not None and
+            response.status_code in (TOO_MANY_REQUESTS, SERVICE_UNAVAILABLE)
+        ):
+            self._counters.incr('throttled')
+            self._rate_limiter.defer_for_response(response.headers)
+        return response
+
+    def _send(self, method, url, headers, body, params, stream):
+        return self._session.request(
+            method, url, headers=headers, json=body, params=params,
+            timeout=self._timeout, stream=stream,
+        )
+
+    def _handle_bad_response(self, response):
+        raise self._bad_response_error(
+            status_code=response.status_code, url=response.request.url,
+            text=response.text, response=response,
+        )
@@ -0,0 +1,286 @@
+import bisect
+import logging
+import threading
+import time
+from collections import Counter, namedtuple
+from urllib.parse import urlsplit
+
+__all__ = [
+    'Instrumentation', 'RequestRecord', 'LatencyHistogram',
+    'OpenTelemetryHook', 'prometheus_text', 'DEFAULT_BUCKETS',
+]
+
+logger = logging.getLogger(__name__)
+
+# One HTTP request (each retry is a request of its own):
+#
+# - `endpoint`: `ENDPOINTS` name, or the path for calls outside it (e.g.
+#   signup pages)
+# - `status`: HTTP status, `None` if no response was received
+# - `bytes`: size of the response body, `None` when streamed
+# - `attempt`: 1 for the first try, 2 for the first retry and so on
+# - `started_at`: wall clock time the request started
+# - durations in seconds: `duration` end to end, `queued` waiting for the
+#   rate limiter, `connect` opening a connection (0 for a reused one),
+#   `wait` for the response headers, `transfer` reading the body and
+#   `decode` parsing the JSON. A phase that didn't happen, or can't be
+#   measured (`connect` with `Ensek`, whose `wait` includes it), is `None`.
+# - `error`: the exception raised, if any
+RequestRecord = namedtuple(
+    'RequestRecord',
+    'endpoint method path status bytes attempt started_at duration queued '
+    'connect wait transfer decode error',
+)
+
+# Upper bounds, in seconds, of the `LatencyHistogram` buckets
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30,
+)
+
+
+class Instrumentation:
+    # Passes a `RequestRecord` for every request a client makes to each of
+    # its hooks. Hooks are called in the thread (or event loop) that made
+    # the request, so they should be quick; one that raises is logged and
+    # otherwise ignored. One instance can be shared by several clients.
+
+    def __init__(self, hooks=(), *, clock=time.perf_counter):
+        self.clock = clock
+        self._hooks = list(hooks)
+
+    def subscribe(self, hook):
+        self._hooks.append(hook)
+        return hook
+
+    def unsubscribe(self, hook):
+        self._hooks.remove(hook)
+
+    def emit(self, record):
+        for hook in list(self._hooks):
+            try:
+                hook(record)
+            except Exception:
+                logger.exception('Instrumentation hook %r failed', hook)
+
+
+def _between(start, end):
+    if start is None or end is None:
+        return None
+    return end - start
+
+
+class _Timing:
+    # Timestamps of one request's phases, filled in by the client as it
+    # goes and turned into a `RequestRecord` at the end
+
+    __slots__ = (
+        'clock', 'started_at', 'start', 'send_start', 'headers_at',
+        'body_at', 'decoded_at', 'connect_start', 'connect', 'status',
+        'bytes', 'error',
+    )
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.started_at = time.time()
+        self.start = clock()
+        self.send_start = self.headers_at = self.body_at = None
+        self.decoded_at = self.connect_start = self.connect = None
+        self.status = self.bytes = self.error = None
+
+    def record(self, *, endpoint, method, path, attempt):
+        wait = _between(self.send_start, self.headers_at)
+        if wait is not None and self.connect:
+            wait -= self.connect
+        return RequestRecord(
+            endpoint=endpoint or urlsplit(path).path,
+            method=method.upper(),
+            path=path,
+            status=self.status,
+            bytes=self.bytes,
+            attempt=attempt,
+            started_at=self.started_at,
+            duration=self.clock() - self.start,
+            queued=_between(self.start, self.send_start),
+            connect=self.connect,
+            wait=wait,
+            transfer=_between(self.headers_at, self.body_at),
+            decode=_between(self.body_at, self.decoded_at),
+            error=self.error,
+        )
+
+
+class _Series:
+
+    def __init__(self, size):
+        self.buckets = [0] * size
+        self.count = 0
+        self.sum = 0
+        self.statuses = Counter()
+        self.bytes = 0
+
+
+class LatencyHistogram:
+    # Hook that counts request durations per endpoint into buckets with the
+    # given upper bounds (plus one for anything slower), along with the
+    # number of responses per status and bytes received. `field` picks
+    # another `RequestRecord` duration to measure, e.g. 'wait'.
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, *, field='duration'):
+        self.bounds = tuple(sorted(buckets))
+        self.field = field
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        value = getattr(record, self.field)
+        status = 'error' if record.status is None else str(record.status)
+        with self._lock:
+            series = self._series.get(record.endpoint)
+            if series is None:
+                series = self._series[record.endpoint] = _Series(
+                    len(self.bounds) + 1
+                )
+            series.statuses[status] += 1
+            series.bytes += record.bytes or 0
+            if value is not None:
+                series.buckets[bisect.bisect_left(self.bounds, value)] += 1
+                series.count += 1
+                series.sum += value
+
+    @property
+    def endpoints(self):
+        with self._lock:
+            return sorted(self._series)
+
+    def percentile(self, endpoint, percent):
+        # Estimated by interpolating within the bucket the percentile falls
+        # in, as Prometheus' `histogram_quantile` does. Values past the last
+        # bound are reported as that bound.
+        with self._lock:
+            series = self._series.get(endpoint)
+            if series is None or not series.count:
+                return None
+            buckets = list(series.buckets)
+            count = series.count
+        rank = percent / 100 * count
+        seen = 0
+        for index, bucket in enumerate(buckets):
+            if bucket and seen + bucket >= rank:
+                if index == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[index - 1] if index else 0
+                upper = self.bounds[index]
+                return lower + (upper - lower) * (rank - seen) / bucket
+            seen += bucket
+        return self.bounds[-1]
+
+    def summary(self, percents=(50, 90, 99)):
+        # e.g. {'get_account': {'count': 10, 'mean': 0.12, 'p50': 0.1, ...}}
+        summary = {}
+        for endpoint in self.endpoints:
+            with self._lock:
+                series = self._series[endpoint]
+                count, total = series.count, series.sum
+            summary[endpoint] = {
+                'count': count,
+                'mean': total / count if count else None,
+                **{
+                    f'p{percent}': self.percentile(endpoint, percent)
+                    for percent in percents
+                },
+            }
+        return summary
+
+    def snapshot(self):
+        # Copies of the series, for exporters
+        with self._lock:
+            return {
+                endpoint: (
+                    list(series.buckets), series.count, series.sum,
+                    dict(series.statuses), series.bytes,
+                )
+                for endpoint, series in sorted(self._series.items())
+            }
+
+
+def _label(value):
+    value = str(value).replace('\\', r'\\').replace('"', r'\"')
+    return value.replace('\n', r'\n')
+
+
+def prometheus_text(histogram, *, prefix='ensek'):
+    # `LatencyHistogram` in the Prometheus text exposition format, to serve
+    # from a /metrics endpoint
+    name = f'{prefix}_request_{histogram.field}_seconds'
+    lines = [
+        f'# HELP {name} ENSEK API request {histogram.field} in seconds.',
+        f'# TYPE {name} histogram',
+    ]
+    snapshot = histogram.snapshot()
+    for endpoint, (buckets, count, total, _, _) in snapshot.items():
+        label = f'endpoint="{_label(endpoint)}"'
+        cumulative = 0
+        bounds = [repr(float(bound)) for bound in histogram.bounds]
+        for bound, bucket in zip(bounds + ['+Inf'], buckets):
+            cumulative += bucket
+            lines.append(f'{name}_bucket{{{label},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{label}}} {total!r}')
+        lines.append(f'{name}_count{{{label}}} {count}')
+    lines += [
+        f'# HELP {prefix}_requests_total ENSEK API requests by status.',
+        f'# TYPE {prefix}_requests_total counter',
+    ]
+    for endpoint, (_, _, _, statuses, _) in snapshot.items():
+        for status, count in sorted(statuses.items()):
+            lines.append(
+                f'{prefix}_requests_total{{endpoint="{_label(endpoint)}",'
+                f'status="{status}"}} {count}'
+            )
+    lines += [
+        f'# HELP {prefix}_response_bytes_total ENSEK API response bytes.',
+        f'# TYPE {prefix}_response_bytes_total counter',
+    ]
+    for endpoint, (_, _, _, _, size) in snapshot.items():
+        lines.append(
+            f'{prefix}_response_bytes_total{{endpoint="{_label(endpoint)}"}} '
+            f'{size}'
+        )
+    return '\n'.join(lines) + '\n'
+
+
+_PHASES = ('queued', 'connect', 'wait', 'transfer', 'decode')
+
+
+class OpenTelemetryHook:
+    # Hook that reports each request as a span through an OpenTelemetry
+    # `Tracer` (e.g. `opentelemetry.trace.get_tracer('ensek')`). Spans are
+    # started in the caller's context, so they join its trace. The phase
+    # durations are attributes, in seconds.
+
+    def __init__(self, tracer):
+        self._tracer = tracer
+
+    def __call__(self, record):
+        start = int(record.started_at * 1e9)
+        attributes = {
+            'http.request.method': record.method,
+            'http.response.status_code': record.status,
+            'url.path': record.path,
+            'ensek.endpoint': record.endpoint,
+            'ensek.attempt': record.attempt,
+            'ensek.response_bytes': record.bytes,
+            **{
+                f'ensek.{phase}': getattr(record, phase)
+                for phase in _PHASES
+            },
+        }
+        span = self._tracer.start_span(
+            f'ENSEK {record.method} {record.endpoint}', start_time=start,
+            attributes={
+                key: value for key, value in attributes.items()
+                if value is not None
+            },
+        )
+        if record.error is not None:
+            span.record_exception(record.error)
+        span.end(end_time=start + int(record.duration * 1e9))
@@ -0,0 +1,141 @@
+import json
+
+_WHITESPACE = ' \t\n\r'
+_NUMBER_CHARS = '0123456789+-.eE'
+_DECODER = json.JSONDecoder()
+
+# Yielded by the parsing generator when it needs more input
+_MORE = object()
+
+
+class _ArrayParser:
+    # Push parser that picks the items out of a JSON array as its text
+    # arrives, so only the unread tail of the document is held in memory.
+    #
+    # The array is either the whole document, or the `key` member of a
+    # top-level object; the object's other members end up in `rest`.
+    # `feed` returns the items completed by each chunk of text, and `close`
+    # any left once the document has ended.
+
+    def __init__(self, key=None):
+        self.key = key
+        self.rest = {}
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        # How much unread text to wait for before trying again, so a value
+        # spread over many chunks isn't re-decoded once per chunk
+        self._wanted = 0
+        self._parser = self._parse()
+
+    def feed(self, text):
+        self._buffer = self._buffer[self._pos:] + text
+        self._pos = 0
+        if len(self._buffer) < self._wanted:
+            return []
+        return self._run()
+
+    def close(self):
+        self._eof = True
+        items = self._run()
+        if self._parser is not None:
+            raise ValueError('JSON document ended early')
+        return items
+
+    def _run(self):
+        self._wanted = 0
+        items = []
+        try:
+            while True:
+                item = next(self._parser)
+                if item is _MORE:
+                    return items
+                items.append(item)
+        except StopIteration:
+            self._parser = None
+            return items
+
+    def _parse(self):
+        if self.key is not None:
+            yield from self._expect('{')
+            while True:
+                if (yield from self._peek()) == '}':
+                    raise ValueError(f'No {self.key!r} member in response')
+                name = yield from self._value()
+                yield from self._expect(':')
+                if name == self.key:
+                    break
+                self.rest[name] = yield from self._value()
+                if (yield from self._expect(',}')) == '}':
+                    raise ValueError(f'No {self.key!r} member in response')
+        yield from self._expect('[')
+        if (yield from self._peek()) == ']':
+            yield from self._expect(']')
+        else:
+            while True:
+                yield (yield from self._value())
+                if (yield from self._expect(',]')) == ']':
+                    break
+        if self.key is not None:
+            while (yield from self._expect(',}')) == ',':
+                name = yield from self._value()
+                yield from self._expect(':')
+                self.rest[name] = yield from self._value()
+        if (yield from self._peek()) != '':
+            raise ValueError('Extra data after JSON document')
+
+    def _peek(self):
+        # The next non-whitespace character, or '' at the end of the document
+        while True:
+            while (
+                self._pos < len(self._buffer) and
+                self._buffer[self._pos] in _WHITESPACE
+            ):
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if self._eof:
+                return ''
+            yield _MORE
+
+    def _expect(self, chars):
+        char = yield from self._peek()
+        if not char or char not in chars:
+            raise ValueError(
+                f'Expected one of {chars!r} at {char!r} in JSON document'
+            )
+        self._pos += 1
+        return char
+
+    def _value(self):
+        yield from self._peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+                self._wanted = 2 * (len(self._buffer) - self._pos)
+                yield _MORE
+                continue
+            # A number cut off by the end of a chunk (e.g. `1.` of `1.5`)
+            # decodes as a shorter one, so wait to see what follows it
+            if not self._eof and (
+                end == len(self._buffer) or self._buffer[end] in _NUMBER_CHARS
+            ):
+                yield _MORE
+                continue
+            self._pos = end
+            return value
+
+
+def _iter_json_array(chunks, key=None, rest=None):
+    # Yields the array items from an iterable of text chunks. If given,
+    # `rest` is updated with the enclosing object's other members once the
+    # document has been read.
+    parser = _ArrayParser(key)
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
+    if rest is not None:
+        rest.update(parser.rest)
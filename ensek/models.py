@@ -0,0 +1,279 @@
+import re
+from datetime import datetime, timedelta, timezone
+
+import stringcase
+
+__all__ = [
+    'Model', 'Signup', 'Account', 'Address', 'MeterPoint', 'Meter',
+    'Register', 'MeterPointAttribute', 'Reading', 'RegisterReading', 'Tariff',
+    'TariffRates', 'Rate', 'LiveBalances', 'LiveBalancesDetailed',
+    'ENDPOINT_MODELS', 'parse_datetime',
+]
+
+_DATETIME_RE = re.compile(
+    r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d+))?'
+    r'(Z|[+-]\d\d:\d\d)?$'
+)
+
+
+def parse_datetime(value):
+    # ENSEK timestamps have anything from 0 to 7 fractional digits, which
+    # `datetime.fromisoformat` only copes with from Python 3.11
+    match = _DATETIME_RE.match(value)
+    if match is None:
+        raise ValueError(f'Invalid datetime: {value!r}')
+    *parts, fraction, offset = match.groups()
+    microsecond = int((fraction or '0')[:6].ljust(6, '0'))
+    tzinfo = None
+    if offset == 'Z':
+        tzinfo = timezone.utc
+    elif offset:
+        sign = -1 if offset[0] == '-' else 1
+        tzinfo = timezone(sign * timedelta(
+            hours=int(offset[1:3]), minutes=int(offset[4:6])
+        ))
+    return datetime(*map(int, parts), microsecond, tzinfo=tzinfo)
+
+
+class _Field:
+    # Attribute of a model, read from a slot holding the raw JSON value.
+    # The value is converted on first access and the result kept in the
+    # slot; a bit in the model's `_parsed` records that it has been.
+
+    __slots__ = ('key', 'convert', 'bit', 'slot')
+
+    def __init__(self, key, convert, bit):
+        self.key = key
+        self.convert = convert
+        self.bit = bit
+        self.slot = None
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        value = self.slot.__get__(obj, cls)
+        if self.convert is None or obj._parsed & self.bit:
+            return value
+        if value is not None:
+            value = self.convert(value)
+            self.slot.__set__(obj, value)
+        obj._parsed |= self.bit
+        return value
+
+
+def _converter(spec):
+    # `[Model]` converts a list of objects into a tuple of models
+    if isinstance(spec, list):
+        item, = spec
+        return lambda values: tuple(item(value) for value in values)
+    return spec
+
+
+class _ModelMeta(type):
+
+    def __new__(cls, name, bases, namespace):
+        fields = {}
+        for bit, (key, spec) in enumerate(namespace.get('FIELDS', {}).items()):
+            fields[stringcase.snakecase(key)] = _Field(
+                key, _converter(spec), 1 << bit
+            )
+        namespace['__slots__'] = namespace.get('__slots__', ()) + tuple(
+            f'_{attr}' for attr in fields
+        )
+        namespace.update(fields)
+        model = super().__new__(cls, name, bases, namespace)
+        for attr, field in fields.items():
+            field.slot = getattr(model, f'_{attr}')
+        model._fields = tuple(fields.items())
+        model._keys = frozenset(field.key for field in fields.values())
+        return model
+
+
+class Model(metaclass=_ModelMeta):
+    # Compact, read-only view of an API object. `FIELDS` maps the API's
+    # keys to how their values are converted: `None` to keep them as they
+    # are, a callable (e.g. `parse_datetime` or another model) or a list of
+    # one to convert each item. Attributes are the snake_case keys, and
+    # values are only converted when first read, so nested objects that are
+    # never looked at are never turned into models. Keys that aren't in
+    # `FIELDS` are kept in `extra`.
+
+    __slots__ = ('_parsed', '_extra')
+    FIELDS = {}
+
+    def __init__(self, data):
+        self._parsed = 0
+        for _, field in self._fields:
+            field.slot.__set__(self, data.get(field.key))
+        extra = {
+            key: value for key, value in data.items()
+            if key not in self._keys
+        }
+        self._extra = extra or None
+
+    @property
+    def extra(self):
+        return dict(self._extra or {})
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(
+            getattr(self, attr) == getattr(other, attr)
+            for attr, _ in self._fields
+        ) and self._extra == other._extra
+
+    def __repr__(self):
+        values = ', '.join(
+            f'{attr}={getattr(self, attr)!r}' for attr, _ in self._fields
+        )
+        return f'{type(self).__name__}({values})'
+
+
+class Signup(Model):
+    FIELDS = {'accountId': None, 'createdDateTime': parse_datetime}
+
+
+class Address(Model):
+    FIELDS = {
+        'uprn': None,
+        'additionalInformation': None,
+        'subBuildingNameNumber': None,
+        'buildingNameNumber': None,
+        'dependentThoroughfare': None,
+        'thoroughfare': None,
+        'doubleDependentLocality': None,
+        'dependentLocality': None,
+        'locality': None,
+        'county': None,
+        'postcode': None,
+        'displayName': None,
+    }
+
+
+class Account(Model):
+    FIELDS = {
+        'id': None,
+        'siteAddress': Address,
+        'primaryContact': None,
+        'externalReference': None,
+    }
+
+
+class Register(Model):
+    FIELDS = {
+        'id': None,
+        'registerReference': None,
+        'tariffComponent': None,
+        'attributes': None,
+        'tpr': None,
+        'tprPeriodDescription': None,
+        'eacAq': None,
+    }
+
+
+class Meter(Model):
+    FIELDS = {
+        'meterId': None,
+        'meterSerialNumber': None,
+        'installedDate': parse_datetime,
+        'removedDate': parse_datetime,
+        'registers': [Register],
+        'attributes': None,
+    }
+
+
+class MeterPointAttribute(Model):
+    FIELDS = {
+        'attributeName': None,
+        'attributeValue': None,
+        'effectiveFromDate': parse_datetime,
+        'effectiveToDate': parse_datetime,
+        'attributeDescription': None,
+    }
+
+
+class MeterPoint(Model):
+    FIELDS = {
+        'id': None,
+        'meterPointNumber': None,
+        'meterPointType': None,
+        'associationStartDate': parse_datetime,
+        'associationEndDate': parse_datetime,
+        'supplyStartDate': parse_datetime,
+        'supplyEndDate': parse_datetime,
+        'isSmart': None,
+        'isSmartCommunicating': None,
+        'meters': [Meter],
+        'attributes': [MeterPointAttribute],
+    }
+
+
+class RegisterReading(Model):
+    FIELDS = {'id': None, 'registerId': None, 'value': None}
+
+
+class Reading(Model):
+    FIELDS = {
+        'id': None,
+        'readingType': None,
+        'meterPointId': None,
+        'dateTime': parse_datetime,
+        'createdDate': parse_datetime,
+        'readings': [RegisterReading],
+        'meterReadingSource': None,
+    }
+
+
+class Rate(Model):
+    FIELDS = {'name': None, 'rate': None, 'registers': None}
+
+
+class TariffRates(Model):
+    FIELDS = {'unitRates': [Rate], 'standingChargeRates': [Rate]}
+
+
+class Tariff(Model):
+    FIELDS = {
+        'tariffName': None,
+        'startDate': parse_datetime,
+        'endDate': parse_datetime,
+        'Electricity': TariffRates,
+        'Gas': TariffRates,
+        'discounts': None,
+        'tariffType': None,
+        'exitFees': None,
+    }
+
+
+class LiveBalances(Model):
+    FIELDS = {
+        'pendingPayments': None,
+        'lastBill': None,
+        'unbilledCharges': None,
+        'estimatedCharges': None,
+        'standingCharges': None,
+        'discountCharges': None,
+        'cclCharges': None,
+        'total': None,
+        'lastUpdated': parse_datetime,
+        'newTransactions': None,
+        'currentBalance': None,
+        'lastTransactionBalance': None,
+    }
+
+
+class LiveBalancesDetailed(Model):
+    FIELDS = {'TotalCharges': None, 'Charges': None}
+
+
+# What `get_*` results are turned into with `models=True`. Endpoints that
+# return a list get a list of models.
+ENDPOINT_MODELS = {
+    'get_account': Account,
+    'get_meter_points': MeterPoint,
+    'get_meter_point_readings': Reading,
+    'get_account_tariffs': Tariff,
+    'get_live_balances': LiveBalances,
+    'get_live_balances_detailed': LiveBalancesDetailed,
+}
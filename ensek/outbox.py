@@ -0,0 +1,398 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+from .cache import _ImmediateTransaction
+from .client import EnsekError, METER_READINGS_BATCH_SIZE, _Counters
+from .models import parse_datetime
+
+__all__ = ['Outbox', 'OutboxEntry']
+
+logger = logging.getLogger(__name__)
+
+# A write waiting in (or given up on by) an `Outbox`. `kind` is 'reading'
+# or 'attribute' and `params` the `create_meter_reading` or
+# `update_account_attribute` kwargs.
+OutboxEntry = namedtuple(
+    'OutboxEntry', 'id key kind account_id params created_at attempts error',
+)
+
+_COLUMNS = (
+    'id, key, kind, account_id, params, created_at, attempts, error'
+)
+
+
+def _entry(row):
+    id_, key, kind, account_id, params, created_at, attempts, error = row
+    params = json.loads(params)
+    if kind == 'reading':
+        try:
+            params['timestamp'] = parse_datetime(params['timestamp'])
+        except (KeyError, TypeError, ValueError):
+            # Left as it is, so the reading fails on its own when it's sent
+            pass
+    return OutboxEntry(
+        id_, key, kind, account_id, params, created_at, attempts, error,
+    )
+
+
+class Outbox:
+    # Spools meter readings and account attribute updates to a SQLite file
+    # and returns straight away; `flush` (or the background flusher started
+    # with `start`) sends them through `client` (an `Ensek`). Writes still
+    # in the file when a process stops are sent by the next one to open it.
+    #
+    # - Readings are sent with `submit_meter_readings`, in order per
+    #   account, and attribute updates to an account are sent in one PUT,
+    #   `concurrency` accounts at a time.
+    # - An entry is deleted once ENSEK has accepted it, so delivery is at
+    #   least once: a write whose response was lost is sent again.
+    # - Server errors are retried after `retry_wait` seconds, doubling up to
+    #   `max_retry_wait`, and later writes for the account wait their turn.
+    #   4xx responses, and entries that fail `max_attempts` times, are kept
+    #   as failed (see `failed` and `requeue_failed`).
+    # - Each entry has an idempotency key (a random one unless given), and
+    #   spooling a key that's already waiting does nothing.
+
+    _SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            key TEXT NOT NULL UNIQUE,
+            kind TEXT NOT NULL,
+            account_id INTEGER NOT NULL,
+            params TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            due_at REAL NOT NULL,
+            failed INTEGER NOT NULL DEFAULT 0,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS entries_pending
+            ON entries (failed, id);
+        CREATE INDEX IF NOT EXISTS entries_due
+            ON entries (failed, due_at);
+    '''
+
+    def __init__(
+        self, client, path=':memory:', *,
+        batch_size=METER_READINGS_BATCH_SIZE, concurrency=4,
+        flush_interval=1, retry_wait=1, max_retry_wait=300, max_attempts=10,
+        timeout=30, clock=time.time,
+    ):
+        self._client = client
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.flush_interval = flush_interval
+        self.retry_wait = retry_wait
+        self.max_retry_wait = max_retry_wait
+        self.max_attempts = max_attempts
+        self._clock = clock
+        self._counters = _Counters()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(path), timeout=timeout, isolation_level=None,
+            check_same_thread=False,
+        )
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(self._SCHEMA)
+        # Writes spooled since the flusher last woke up
+        self._unflushed = 0
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._flusher = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.metrics['depth']
+
+    @property
+    def metrics(self):
+        # `depth`: entries waiting to be sent, `lag`: seconds the oldest of
+        # them has waited, `failed`: entries given up on, plus counts of
+        # entries `sent`, `retried` and `spooled` by this process
+        now = self._clock()
+        with self._lock:
+            depth, oldest = self._conn.execute(
+                'SELECT COUNT(*), MIN(created_at) FROM entries '
+                'WHERE failed = 0'
+            ).fetchone()
+            failed, = self._conn.execute(
+                'SELECT COUNT(*) FROM entries WHERE failed = 1'
+            ).fetchone()
+        return {
+            'sent': 0, 'retried': 0, 'spooled': 0,
+            **self._counters.snapshot(),
+            'depth': depth,
+            'lag': 0 if oldest is None else max(0, now - oldest),
+            'failed': failed,
+        }
+
+    def create_meter_reading(
+        self, *, account_id, meter_point_id, register_id, value, timestamp,
+        source=None, key=None,
+    ):
+        # Writes that could never be sent raise `ValueError` here, rather
+        # than failing when they're flushed
+        try:
+            params = {
+                'account_id': int(account_id),
+                'meter_point_id': int(meter_point_id),
+                'register_id': int(register_id),
+                'value': float(value),
+                'timestamp': timestamp.isoformat(),
+                'source': source,
+            }
+            parse_datetime(params['timestamp'])
+        except (TypeError, ValueError, AttributeError) as exc:
+            raise ValueError(f'Invalid meter reading: {exc!r}') from exc
+        return self._spool('reading', params['account_id'], params, key)
+
+    def update_account_attribute(
+        self, *, account_id, name, value, type, key=None,
+    ):
+        try:
+            account_id = int(account_id)
+        except (TypeError, ValueError) as exc:
+            raise ValueError(f'Invalid account id: {exc!r}') from exc
+        params = {
+            'account_id': account_id, 'name': name, 'value': value,
+            'type': type,
+        }
+        return self._spool('attribute', account_id, params, key)
+
+    def _spool(self, kind, account_id, params, key):
+        # Returns the entry's idempotency key
+        key = key or uuid.uuid4().hex
+        now = self._clock()
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT OR IGNORE INTO entries '
+                '(key, kind, account_id, params, created_at, due_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, kind, account_id, json.dumps(params), now, now),
+            )
+            if cursor.rowcount:
+                self._unflushed += 1
+                full = self._unflushed >= self.batch_size
+        if cursor.rowcount:
+            self._counters.incr('spooled')
+            if full:
+                self._wake.set()
+        return key
+
+    def failed(self):
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT {_COLUMNS} FROM entries WHERE failed = 1 ORDER BY id'
+            ).fetchall()
+        return [_entry(row) for row in rows]
+
+    def requeue_failed(self, keys=None):
+        # Sends the failed entries (or those with the given keys) again
+        now = self._clock()
+        with self._lock, _ImmediateTransaction(self._conn):
+            if keys is None:
+                keys = [
+                    key for key, in self._conn.execute(
+                        'SELECT key FROM entries WHERE failed = 1'
+                    )
+                ]
+            self._conn.executemany(
+                'UPDATE entries SET failed = 0, attempts = 0, due_at = ? '
+                'WHERE key = ? AND failed = 1',
+                [(now, key) for key in keys],
+            )
+        self._wake.set()
+
+    def start(self):
+        # Flushes in a background thread every `flush_interval` seconds, or
+        # as soon as `batch_size` writes have been spooled, until `close`
+        if self._flusher is None:
+            self._flusher = threading.Thread(
+                target=self._run, name='ensek-outbox', daemon=True,
+            )
+            self._flusher.start()
+        return self
+
+    def close(self, *, drain=False):
+        # Stops the flusher. With `drain`, keeps flushing until nothing is
+        # due; anything left stays in the file for the next process.
+        self._stopping.set()
+        self._wake.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        if drain:
+            while self.flush():
+                pass
+        with self._lock:
+            self._conn.close()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.clear()
+            with self._lock:
+                self._unflushed = 0
+            try:
+                sent = self.flush()
+            except Exception:
+                logger.exception('Flushing the outbox failed')
+                sent = 0
+            if not sent:
+                self._wake.wait(self.flush_interval)
+
+    def flush(self):
+        # Sends the entries that are due, up to `batch_size` per account of
+        # each kind. Returns how many were sent.
+        with self._flush_lock:
+            entries = self._due_entries()
+            if not entries:
+                return 0
+            sent = []
+            retry = []
+            failed = []
+            try:
+                self._send_readings(
+                    [entry for entry in entries if entry.kind == 'reading'],
+                    sent, retry, failed,
+                )
+                self._send_attributes(
+                    [entry for entry in entries if entry.kind == 'attribute'],
+                    sent, retry, failed,
+                )
+            finally:
+                # Entries ENSEK accepted are never sent again, even if
+                # sending the rest raised
+                self._finish(sent, retry, failed)
+            return len(sent)
+
+    def _due_entries(self):
+        # Accounts with an entry that isn't due yet are left out altogether,
+        # so writes to an account are never reordered, and one backing off
+        # doesn't fill the window and hold the other accounts up
+        now = self._clock()
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT {_COLUMNS} FROM entries WHERE failed = 0 '
+                'AND account_id NOT IN ('
+                'SELECT account_id FROM entries '
+                'WHERE failed = 0 AND due_at > ?'
+                ') ORDER BY id LIMIT ?',
+                (now, self.batch_size * max(1, self.concurrency) * 4),
+            ).fetchall()
+        taken = {}
+        entries = []
+        for row in rows:
+            entry = _entry(row)
+            group = entry.account_id, entry.kind
+            if taken.get(group, 0) >= self.batch_size:
+                continue
+            taken[group] = taken.get(group, 0) + 1
+            entries.append(entry)
+        return entries
+
+    def _send_readings(self, entries, sent, retry, failed):
+        # `BulkResult.params` is the reading dict that was passed in, which
+        # maps it back to its entry. Readings that can't be sent come back
+        # with a `ValueError` of their own.
+        readings = [
+            dict(entry.params, account_id=entry.account_id)
+            for entry in entries
+        ]
+        by_reading = {
+            id(reading): entry for reading, entry in zip(readings, entries)
+        }
+        for result in self._client.submit_meter_readings(
+            readings, batch_size=self.batch_size,
+            concurrency=self.concurrency,
+        ):
+            entry = by_reading[id(result.params)]
+            self._sort(entry, result.error, sent, retry, failed)
+
+    def _send_attributes(self, entries, sent, retry, failed):
+        by_account = {}
+        for entry in entries:
+            by_account.setdefault(entry.account_id, []).append(entry)
+        params = []
+        by_params = {}
+        for account_id, account_entries in by_account.items():
+            # Only the latest value of an attribute is sent
+            updated = {}
+            valid = []
+            for entry in account_entries:
+                try:
+                    updated[entry.params['name']] = {
+                        'name': entry.params['name'],
+                        'value': entry.params['value'],
+                        'type': entry.params['type'],
+                    }
+                except (KeyError, TypeError) as exc:
+                    failed.append((entry, ValueError(
+                        f'Invalid account attribute: {exc!r}'
+                    )))
+                    continue
+                valid.append(entry)
+            if not valid:
+                continue
+            kwargs = {
+                'account_id': account_id, 'updated': list(updated.values()),
+            }
+            params.append(kwargs)
+            by_params[id(kwargs)] = valid
+        for result in self._client.update_many_account_attributes(
+            params, concurrency=self.concurrency,
+        ):
+            for entry in by_params[id(result.params)]:
+                self._sort(entry, result.error, sent, retry, failed)
+
+    def _sort(self, entry, error, sent, retry, failed):
+        if error is None:
+            sent.append(entry)
+        elif (
+            isinstance(error, EnsekError) and
+            entry.attempts + 1 < self.max_attempts
+        ):
+            retry.append((entry, error))
+        else:
+            failed.append((entry, error))
+
+    def _finish(self, sent, retry, failed):
+        now = self._clock()
+        with self._lock, _ImmediateTransaction(self._conn):
+            self._conn.executemany(
+                'DELETE FROM entries WHERE id = ?',
+                [(entry.id,) for entry in sent],
+            )
+            self._conn.executemany(
+                'UPDATE entries SET attempts = attempts + 1, due_at = ?, '
+                'error = ? WHERE id = ?',
+                [
+                    (now + self._retry_wait(entry), str(error), entry.id)
+                    for entry, error in retry
+                ],
+            )
+            self._conn.executemany(
+                'UPDATE entries SET attempts = attempts + 1, failed = 1, '
+                'error = ? WHERE id = ?',
+                [(str(error), entry.id) for entry, error in failed],
+            )
+        self._counters.incr('sent', len(sent))
+        self._counters.incr('retried', len(retry))
+        for entry, error in failed:
+            logger.warning(
+                'Giving up on outbox %s %s after %d attempts: %s',
+                entry.kind, entry.key, entry.attempts + 1, error,
+            )
+
+    def _retry_wait(self, entry):
+        return min(self.max_retry_wait, self.retry_wait * 2 ** entry.attempts)
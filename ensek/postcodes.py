@@ -0,0 +1,197 @@
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import _ImmediateTransaction
+
+__all__ = ['PostcodeIndex', 'POSTCODE_LOOKUPS', 'normalise_postcode']
+
+logger = logging.getLogger(__name__)
+
+# What `PostcodeIndex` holds for a postcode, and the `get_*` endpoint each
+# comes from
+POSTCODE_LOOKUPS = {
+    'region_id': 'get_region_id_for_postcode',
+    'addresses': 'get_addresses_at_postcode',
+}
+
+# Postcodes `PostcodeIndex.warm` writes to SQLite in one transaction
+_WARM_BATCH_SIZE = 500
+
+_POSTCODE_RE = re.compile(r'[A-Z0-9]{2,4}[0-9][A-Z]{2}')
+_WHITESPACE = str.maketrans('', '', ' \t\n\r\f\v')
+
+
+def normalise_postcode(postcode):
+    # 'se1 4yu', ' SE14YU ' -> 'SE14YU', so spellings of a postcode share
+    # requests and cache entries
+    normalised = str(postcode).translate(_WHITESPACE).upper()
+    if not _POSTCODE_RE.fullmatch(normalised):
+        raise ValueError(f'Invalid postcode: {postcode!r}')
+    return normalised
+
+
+class PostcodeIndex:
+    # Local copy of the region id and addresses of postcodes, kept in a
+    # SQLite file and in memory, so lookups don't leave the process. A
+    # lookup that misses calls the API through `client` (an `Ensek`) and
+    # stores the answer. An entry older than `max_age` seconds is still
+    # returned, and refreshed in the background. Values are shared between
+    # lookups, so treat them as read-only.
+
+    _SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS postcodes (
+            lookup TEXT NOT NULL,
+            postcode TEXT NOT NULL,
+            value TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            PRIMARY KEY (lookup, postcode)
+        );
+    '''
+
+    def __init__(
+        self, client, path=':memory:', *, max_age=30 * 24 * 3600,
+        timeout=30, clock=time.time,
+    ):
+        self._client = client
+        self.max_age = max_age
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(path), timeout=timeout, isolation_level=None,
+            check_same_thread=False,
+        )
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(self._SCHEMA)
+        # Lookup name -> postcode -> (value, fetched_at)
+        self._entries = {lookup: {} for lookup in POSTCODE_LOOKUPS}
+        for lookup, postcode, value, fetched_at in self._conn.execute(
+            'SELECT lookup, postcode, value, fetched_at FROM postcodes'
+        ):
+            if lookup in self._entries:
+                self._entries[lookup][postcode] = (
+                    json.loads(value), fetched_at,
+                )
+        self._refreshing = set()
+        self._refresher = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(set().union(*self._entries.values()))
+
+    def close(self):
+        if self._refresher is not None:
+            self._refresher.shutdown(wait=True)
+        with self._lock:
+            self._conn.close()
+
+    def region_id(self, postcode):
+        return self._lookup('region_id', postcode)
+
+    def addresses(self, postcode):
+        return self._lookup('addresses', postcode)
+
+    def warm(
+        self, postcodes, *, lookups=tuple(POSTCODE_LOOKUPS), concurrency=10,
+        refresh=False,
+    ):
+        # Fetches the postcodes that aren't in the index yet (with
+        # `refresh`, all of them), up to `concurrency` requests at a time,
+        # storing them as they arrive. Returns the errors, keyed by
+        # `(lookup, postcode)`.
+        unknown = set(lookups) - set(POSTCODE_LOOKUPS)
+        if unknown:
+            raise ValueError(f'Unknown postcode lookups: {sorted(unknown)}')
+        errors = {}
+        wanted = {}
+        for postcode in postcodes:
+            try:
+                wanted[normalise_postcode(postcode)] = None
+            except ValueError as exc:
+                for lookup in lookups:
+                    errors[lookup, postcode] = exc
+        for lookup in lookups:
+            entries = self._entries[lookup]
+            batch = []
+            for item in self._client.get_many(
+                POSTCODE_LOOKUPS[lookup],
+                [
+                    {'postcode': postcode} for postcode in wanted
+                    if refresh or postcode not in entries
+                ],
+                concurrency=concurrency,
+            ):
+                postcode = item.params['postcode']
+                if item.error is not None:
+                    errors[lookup, postcode] = item.error
+                    continue
+                batch.append((postcode, item.result))
+                if len(batch) >= _WARM_BATCH_SIZE:
+                    self._store(lookup, batch)
+                    batch = []
+            if batch:
+                self._store(lookup, batch)
+        return errors
+
+    def _lookup(self, lookup, postcode):
+        postcode = normalise_postcode(postcode)
+        entry = self._entries[lookup].get(postcode)
+        if entry is None:
+            return self._fetch(lookup, postcode)
+        value, fetched_at = entry
+        if self._clock() - fetched_at > self.max_age:
+            self._refresh_later(lookup, postcode)
+        return value
+
+    def _fetch(self, lookup, postcode):
+        name = POSTCODE_LOOKUPS[lookup]
+        value = getattr(self._client, name)(postcode=postcode)
+        self._store(lookup, [(postcode, value)])
+        return value
+
+    def _store(self, lookup, values):
+        fetched_at = self._clock()
+        with self._lock, _ImmediateTransaction(self._conn):
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO postcodes '
+                '(lookup, postcode, value, fetched_at) VALUES (?, ?, ?, ?)',
+                [
+                    (lookup, postcode, json.dumps(value), fetched_at)
+                    for postcode, value in values
+                ],
+            )
+            entries = self._entries[lookup]
+            for postcode, value in values:
+                entries[postcode] = (value, fetched_at)
+
+    def _refresh_later(self, lookup, postcode):
+        with self._lock:
+            if (lookup, postcode) in self._refreshing:
+                return
+            self._refreshing.add((lookup, postcode))
+            if self._refresher is None:
+                # One worker, so refreshes never compete with lookups for
+                # more than a connection
+                self._refresher = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix='ensek-postcodes',
+                )
+        self._refresher.submit(self._refresh, lookup, postcode)
+
+    def _refresh(self, lookup, postcode):
+        try:
+            self._fetch(lookup, postcode)
+        except Exception:
+            # The stale entry is kept, and refreshed on a later lookup
+            logger.exception('Refreshing %s of %s failed', lookup, postcode)
+        finally:
+            with self._lock:
+                self._refreshing.discard((lookup, postcode))
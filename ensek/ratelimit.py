@@ -0,0 +1,99 @@
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+__all__ = ['RateLimiter']
+
+
+class RateLimiter:
+    # Governs how fast a client talks to ENSEK: a token bucket refilled at
+    # `rate` requests per second (holding up to `burst` tokens), and at most
+    # `max_in_flight` concurrent requests. Either can be left as `None`.
+    # A `Retry-After` from the server pauses every request until it passes.
+    # One limiter can be shared by several clients to govern them together.
+
+    def __init__(
+        self, *, rate=None, burst=None, max_in_flight=None,
+        clock=time.monotonic, sleep=time.sleep,
+    ):
+        if rate is not None and rate <= 0:
+            raise ValueError('rate must be positive')
+        self._rate = rate
+        self._burst = burst or max(1, rate or 1)
+        self._tokens = self._burst
+        self._clock = clock
+        self._sleep = sleep
+        self._updated_at = clock()
+        self._resume_at = None
+        self._lock = threading.Lock()
+        self._slots = (
+            threading.BoundedSemaphore(max_in_flight)
+            if max_in_flight else None
+        )
+
+    @contextmanager
+    def limit(self):
+        if self._slots is not None:
+            self._slots.acquire()
+        try:
+            self._wait_for_token()
+            yield
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+    def defer(self, seconds):
+        with self._lock:
+            resume_at = self._clock() + seconds
+            if self._resume_at is None or resume_at > self._resume_at:
+                self._resume_at = resume_at
+
+    def defer_for_response(self, headers):
+        seconds = _retry_after_seconds(headers.get('Retry-After'))
+        if seconds is not None:
+            self.defer(seconds)
+        return seconds
+
+    def _wait_for_token(self):
+        while True:
+            with self._lock:
+                wait = self._next_wait()
+            if wait <= 0:
+                return
+            self._sleep(wait)
+
+    def _next_wait(self):
+        # Returns 0 once a request may go ahead, having taken its token
+        now = self._clock()
+        if self._resume_at is not None:
+            if now < self._resume_at:
+                return self._resume_at - now
+            self._resume_at = None
+        if self._rate is None:
+            return 0
+        elapsed = now - self._updated_at
+        self._tokens = min(self._burst, self._tokens + elapsed * self._rate)
+        self._updated_at = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self._rate
+
+
+def _retry_after_seconds(value):
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0, (retry_at - datetime.now(timezone.utc)).total_seconds())
@@ -0,0 +1,209 @@
+import csv
+import os
+from datetime import timezone
+
+import numpy as np
+
+from .client import DEFAULT_POOLSIZE
+from .models import Reading, parse_datetime
+
+__all__ = ['ColumnTable', 'ReadingCollection', 'READING_COLUMNS']
+
+# One row per register reading, with the fields of the reading it belongs
+# to repeated on each row
+READING_COLUMNS = {
+    'meter_point_id': np.int64,
+    'reading_id': np.int64,
+    'register_id': np.int64,
+    'timestamp': 'datetime64[us]',
+    'value': np.float64,
+    'source': object,
+    'reading_type': object,
+}
+
+
+def _is_naive(value):
+    return value[-1] != 'Z' and (len(value) < 25 or value[-6] not in '+-')
+
+
+def _naive_utc(value):
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _to_datetime64(values):
+    # ENSEK sends naive timestamps, which numpy parses in one go. Those with
+    # an offset (and `datetime`s from models) are converted to naive UTC
+    # one by one first.
+    if all(isinstance(value, str) and _is_naive(value) for value in values):
+        return np.array(values, dtype='datetime64[us]')
+    return np.array(
+        [_naive_utc(value) for value in values], dtype='datetime64[us]'
+    )
+
+
+class ColumnTable:
+    # Named, equal length numpy arrays
+
+    def __init__(self, columns):
+        self.columns = dict(columns)
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()), ()))
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __repr__(self):
+        return f'ColumnTable({list(self.columns)}, rows={len(self)})'
+
+    def to_arrow(self):
+        # pyarrow is an optional dependency
+        import pyarrow
+        return pyarrow.table({
+            name: pyarrow.array(values)
+            for name, values in self.columns.items()
+        })
+
+    def to_parquet(self, path, **kwargs):
+        import pyarrow.parquet
+        pyarrow.parquet.write_table(self.to_arrow(), path, **kwargs)
+
+    def to_csv(self, file):
+        # `file` is a path or a text file opened with `newline=''`
+        if isinstance(file, (str, os.PathLike)):
+            with open(file, 'w', newline='') as f:
+                return self.to_csv(f)
+        columns = []
+        for values in self.columns.values():
+            if values.dtype.kind == 'M':
+                values = np.where(np.isnat(values), '', values.astype(str))
+            columns.append(values.tolist())
+        writer = csv.writer(file)
+        writer.writerow(self.columns)
+        writer.writerows(zip(*columns))
+
+
+class ReadingCollection:
+    # Accumulates meter point readings (as returned by
+    # `get_meter_point_readings`, dicts or models) into columnar arrays for
+    # vectorised analysis and export.
+
+    def __init__(self):
+        self._chunks = []
+        self._table = None
+        # Meter point id -> exception, for meter points `fetch` couldn't get
+        self.errors = {}
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self._chunks)
+
+    def add(self, meter_point_id, readings):
+        reading_ids = []
+        timestamps = []
+        sources = []
+        reading_types = []
+        counts = []
+        register_ids = []
+        values = []
+        for reading in readings:
+            if isinstance(reading, Reading):
+                reading_ids.append(reading.id)
+                timestamps.append(reading.date_time)
+                sources.append(reading.meter_reading_source)
+                reading_types.append(reading.reading_type)
+                registers = reading.readings or ()
+                for register in registers:
+                    register_ids.append(register.register_id)
+                    values.append(register.value)
+            else:
+                reading_ids.append(reading['id'])
+                timestamps.append(reading['dateTime'])
+                sources.append(reading.get('meterReadingSource'))
+                reading_types.append(reading.get('readingType'))
+                registers = reading.get('readings') or ()
+                for register in registers:
+                    register_ids.append(register['registerId'])
+                    values.append(register['value'])
+            counts.append(len(registers))
+        if not register_ids:
+            return self
+        # Fields of each reading are converted once, then repeated for each
+        # of its registers
+        counts = np.array(counts)
+        columns = {
+            'meter_point_id': np.full(
+                len(register_ids), meter_point_id, dtype=np.int64
+            ),
+            'reading_id': np.array(reading_ids, dtype=np.int64),
+            'register_id': np.array(register_ids, dtype=np.int64),
+            'timestamp': _to_datetime64(timestamps),
+            'value': np.array(values, dtype=np.float64),
+            'source': np.array(sources, dtype=object),
+            'reading_type': np.array(reading_types, dtype=object),
+        }
+        for name in ('reading_id', 'timestamp', 'source', 'reading_type'):
+            columns[name] = np.repeat(columns[name], counts)
+        self._chunks.append(ColumnTable(columns))
+        self._table = None
+        return self
+
+    def fetch(self, client, meter_point_ids, *, concurrency=DEFAULT_POOLSIZE):
+        # Adds the readings of many meter points, fetched concurrently with
+        # `client.get_many`. Failures are kept in `errors`.
+        results = client.get_many(
+            'get_meter_point_readings',
+            ({'meter_point_id': id_} for id_ in meter_point_ids),
+            concurrency=concurrency,
+        )
+        for params, result, error in results:
+            meter_point_id = params['meter_point_id']
+            if error is not None:
+                self.errors[meter_point_id] = error
+            else:
+                self.errors.pop(meter_point_id, None)
+                self.add(meter_point_id, result)
+        return self
+
+    @property
+    def table(self):
+        if self._table is None:
+            if not self._chunks:
+                self._table = ColumnTable({
+                    name: np.empty(0, dtype=dtype)
+                    for name, dtype in READING_COLUMNS.items()
+                })
+            else:
+                self._table = ColumnTable({
+                    name: np.concatenate([
+                        chunk[name] for chunk in self._chunks
+                    ])
+                    for name in READING_COLUMNS
+                })
+                self._chunks = [self._table]
+        return self._table
+
+    def consumption(self):
+        # Difference between consecutive reads of each register, ordered by
+        # time. A meter exchange or rollover shows up as a negative value.
+        table = self.table
+        order = np.lexsort((
+            table['timestamp'], table['register_id'], table['meter_point_id'],
+        ))
+        meter_point_ids = table['meter_point_id'][order]
+        register_ids = table['register_id'][order]
+        timestamps = table['timestamp'][order]
+        same = (
+            (meter_point_ids[1:] == meter_point_ids[:-1]) &
+            (register_ids[1:] == register_ids[:-1])
+        )
+        return ColumnTable({
+            'meter_point_id': meter_point_ids[1:][same],
+            'register_id': register_ids[1:][same],
+            'start': timestamps[:-1][same],
+            'end': timestamps[1:][same],
+            'consumption': np.diff(table['value'][order])[same],
+        })
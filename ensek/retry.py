@@ -0,0 +1,80 @@
+import random
+import threading
+import time
+
+__all__ = ['RetryPolicy']
+
+IDEMPOTENT_METHODS = frozenset({'get', 'head', 'options', 'put', 'delete'})
+
+
+class RetryPolicy:
+    # Decides whether and when a failed request is retried. Built once per
+    # client and shared by all its calls.
+    #
+    # - Waits grow exponentially from `base_wait` up to `max_wait`, with full
+    #   jitter so retries from many workers don't land at the same moment
+    #   (unless `jitter` is off).
+    # - A call gives up once `max_attempts` have been made, or if waiting
+    #   again would take it past `deadline` seconds since it started.
+    # - Retries are paid for from a budget that every request tops up by
+    #   `budget_ratio` (up to `budget_reserve`), so during an outage retries
+    #   stay at roughly that fraction of traffic. `budget_ratio=None` turns
+    #   the budget off.
+    # - Only idempotent methods are retried, unless `retry_non_idempotent`.
+
+    def __init__(
+        self, *, max_attempts=3, base_wait=0.1, max_wait=10, deadline=None,
+        budget_ratio=0.1, budget_reserve=10, retry_non_idempotent=False,
+        jitter=True, clock=time.monotonic, sleep=time.sleep,
+        random=random.random,
+    ):
+        if max_attempts < 1:
+            raise ValueError('max_attempts must be at least 1')
+        self.max_attempts = max_attempts
+        self.base_wait = base_wait
+        self.max_wait = max_wait
+        self.deadline = deadline
+        self.budget_ratio = budget_ratio
+        self.budget_reserve = budget_reserve
+        self.retry_non_idempotent = retry_non_idempotent
+        self.jitter = jitter
+        self.clock = clock
+        self.sleep = sleep
+        self._random = random
+        self._budget = budget_reserve
+        self._lock = threading.Lock()
+
+    @property
+    def budget(self):
+        return self._budget
+
+    def record_request(self):
+        if self.budget_ratio is None:
+            return
+        with self._lock:
+            self._budget = min(
+                self.budget_reserve, self._budget + self.budget_ratio
+            )
+
+    def next_wait(self, *, method, attempt, started_at):
+        # Seconds to wait before making attempt number `attempt + 1`, or
+        # `None` if the call should give up
+        if attempt >= self.max_attempts:
+            return None
+        if method not in IDEMPOTENT_METHODS and not self.retry_non_idempotent:
+            return None
+        wait = min(self.max_wait, self.base_wait * 2 ** (attempt - 1))
+        if self.jitter:
+            wait *= self._random()
+        if (
+            self.deadline is not None and
+            self.clock() - started_at + wait > self.deadline
+        ):
+            return None
+        if self.budget_ratio is None:
+            return wait
+        with self._lock:
+            if self._budget < 1:
+                return None
+            self._budget -= 1
+        return wait
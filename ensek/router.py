@@ -0,0 +1,141 @@
+from functools import lru_cache
+from string import Template
+
+import stringcase
+
+
+@lru_cache(maxsize=None)
+def _camelcase(name):
+    # API query params are in camelCase
+    return stringcase.camelcase(name)
+
+
+class _Route:
+    # An `ENDPOINTS` entry compiled once, so calls don't re-parse it: the
+    # path is split into literal text and placeholders, and query param
+    # names are camelCased up front.
+    #
+    # Placeholders in the template's query string (e.g.
+    # '/PostcodeLookups?postcode=$postcode') become query params, so their
+    # values are URL-encoded like any other. Every placeholder is a
+    # required argument; `query_params` are the optional ones. With
+    # `query_params=None`, any other argument is sent as a query param.
+    # `converters` map argument names to functions applied to their values
+    # first (e.g. to normalise them).
+
+    __slots__ = (
+        'name', 'template', 'placeholders', '_required', '_path_count',
+        '_head', '_segments', '_query', '_strict', '_converters',
+    )
+
+    def __init__(self, name, template, query_params=None, converters=None):
+        if isinstance(template, str):
+            template = Template(template)
+        self.name = name
+        self.template = template.template
+        path, _, query = self.template.partition('?')
+        self._head, self._segments = self._split(template, path)
+        self._query = {}
+        for item in filter(None, query.split('&')):
+            key, _, value = item.partition('=')
+            head, segments = self._split(template, value)
+            if head or len(segments) != 1 or segments[0][1]:
+                raise ValueError(
+                    f'{name}: query param {key!r} must be a placeholder'
+                )
+            self._query[segments[0][0]] = key
+        self._required = tuple(dict.fromkeys(
+            [placeholder for placeholder, _ in self._segments] +
+            list(self._query)
+        ))
+        self.placeholders = frozenset(self._required)
+        self._path_count = len(self._required) - len(self._query)
+        for param in query_params or ():
+            self._query.setdefault(param, _camelcase(param))
+        self._strict = query_params is not None
+        self._converters = {
+            key: convert for key, convert in (converters or {}).items()
+            if key in self.placeholders or key in self._query
+        }
+
+    @staticmethod
+    def _split(template, text):
+        # '/a/$x/b/$y' -> ('/a/', [('x', '/b/'), ('y', '')])
+        head = None
+        segments = []
+        literal = []
+        position = 0
+        for match in template.pattern.finditer(text):
+            literal.append(text[position:match.start()])
+            position = match.end()
+            if match.group('escaped') is not None:
+                literal.append(template.delimiter)
+                continue
+            placeholder = match.group('named') or match.group('braced')
+            if placeholder is None:
+                raise ValueError(f'Invalid placeholder in {text!r}')
+            if head is None:
+                head = ''.join(literal)
+            else:
+                segments[-1] = (segments[-1][0], ''.join(literal))
+            segments.append((placeholder, ''))
+            literal = []
+        literal.append(text[position:])
+        if head is None:
+            return ''.join(literal), []
+        segments[-1] = (segments[-1][0], ''.join(literal))
+        return head, segments
+
+    def build(self, kwargs):
+        # Returns the path and query params for a call's kwargs
+        if self._converters:
+            kwargs = self.convert(kwargs)
+        for placeholder in self._required:
+            if placeholder not in kwargs:
+                raise TypeError(
+                    f'{self.name}() missing required argument: '
+                    f'{placeholder!r}'
+                )
+        path = self._head
+        for placeholder, literal in self._segments:
+            path += f'{kwargs[placeholder]}{literal}'
+        params = {}
+        if len(kwargs) > self._path_count:
+            for key, val in kwargs.items():
+                param = self._query.get(key)
+                if param is not None:
+                    params[param] = val
+                elif key in self.placeholders:
+                    continue
+                elif self._strict:
+                    raise TypeError(
+                        f'{self.name}() got an unexpected argument {key!r}'
+                    )
+                else:
+                    params[_camelcase(key)] = val
+        return path, params
+
+    def path(self, **kwargs):
+        return self.build(kwargs)[0]
+
+    def convert(self, kwargs):
+        if not self._converters:
+            return kwargs
+        return {
+            key: (
+                self._converters[key](val) if key in self._converters
+                else val
+            )
+            for key, val in kwargs.items()
+        }
+
+
+def _compile_routes(endpoints, query_params, converters):
+    return {
+        name: _Route(
+            name, template,
+            query_params.get(name, ()) if name.startswith('get_') else None,
+            converters,
+        )
+        for name, template in endpoints.items()
+    }
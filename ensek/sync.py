@@ -0,0 +1,297 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from .cache import _ImmediateTransaction
+from .client import DEFAULT_POOLSIZE
+
+__all__ = ['AccountSync', 'ChangeEvent', 'SnapshotStore', 'SYNC_RESOURCES']
+
+# `get_*` endpoints taking an `account_id` that are synced by default
+SYNC_RESOURCES = (
+    'get_account', 'get_meter_points', 'get_account_tariffs',
+    'get_account_attributes',
+)
+
+# `kind` is 'added', 'changed' or 'removed'. `old` and `new` are the
+# resource's JSON before and after (`None` when there is none).
+ChangeEvent = namedtuple('ChangeEvent', 'account_id resource kind old new')
+
+_Snapshot = namedtuple('_Snapshot', 'hash data')
+
+
+def _snapshot(data):
+    # Keys are sorted so equal JSON always hashes the same
+    text = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return _Snapshot(hashlib.sha256(text.encode()).hexdigest(), text)
+
+
+class SnapshotStore:
+    # SQLite file holding what `AccountSync` last saw: the completed signups
+    # cursor, when each account is next due for a refresh, and a snapshot
+    # and content hash of each of its resources.
+
+    _SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS state (
+            name TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS accounts (
+            account_id INTEGER PRIMARY KEY,
+            due_at REAL NOT NULL,
+            interval REAL,
+            synced_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS accounts_due_at ON accounts (due_at);
+        CREATE TABLE IF NOT EXISTS snapshots (
+            account_id INTEGER NOT NULL,
+            resource TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (account_id, resource)
+        );
+    '''
+
+    def __init__(self, path=':memory:', *, timeout=30):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(path), timeout=timeout, isolation_level=None,
+            check_same_thread=False,
+        )
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(self._SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        with self._lock:
+            count, = self._conn.execute(
+                'SELECT COUNT(*) FROM accounts'
+            ).fetchone()
+        return count
+
+    @property
+    def cursor(self):
+        # `after` cursor of the last completed signups page added
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM state WHERE name = 'signups_cursor'"
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def add_accounts(self, account_ids, *, due_at, cursor=None):
+        # Accounts already in the store keep their schedule. The cursor is
+        # saved in the same transaction, so a crash can't skip a page.
+        with self._lock, _ImmediateTransaction(self._conn):
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO accounts (account_id, due_at) '
+                'VALUES (?, ?)',
+                [(account_id, due_at) for account_id in account_ids],
+            )
+            if cursor is not None:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO state (name, value) '
+                    "VALUES ('signups_cursor', ?)",
+                    (json.dumps(cursor),),
+                )
+
+    def due_accounts(self, now, *, limit=None):
+        # Ids of the accounts due at `now`, the most overdue first
+        with self._lock:
+            return [
+                account_id for account_id, in self._conn.execute(
+                    'SELECT account_id FROM accounts WHERE due_at <= ? '
+                    'ORDER BY due_at, account_id LIMIT ?',
+                    (now, -1 if limit is None else limit),
+                )
+            ]
+
+    def interval(self, account_id):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT interval FROM accounts WHERE account_id = ?',
+                (account_id,),
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def snapshots(self, account_id):
+        # Resource name -> `(hash, JSON text)`
+        with self._lock:
+            return {
+                resource: _Snapshot(hash_, data)
+                for resource, hash_, data in self._conn.execute(
+                    'SELECT resource, hash, data FROM snapshots '
+                    'WHERE account_id = ?',
+                    (account_id,),
+                )
+            }
+
+    def get(self, account_id):
+        # Resource name -> the account's last synced JSON
+        return {
+            resource: json.loads(snapshot.data)
+            for resource, snapshot in self.snapshots(account_id).items()
+        }
+
+    def save(self, account_id, snapshots, *, synced_at, due_at, interval):
+        # `snapshots` maps resource names to a new `(hash, JSON text)`, or
+        # `None` for resources that have gone
+        with self._lock, _ImmediateTransaction(self._conn):
+            for resource, snapshot in snapshots.items():
+                if snapshot is None:
+                    self._conn.execute(
+                        'DELETE FROM snapshots '
+                        'WHERE account_id = ? AND resource = ?',
+                        (account_id, resource),
+                    )
+                else:
+                    self._conn.execute(
+                        'INSERT OR REPLACE INTO snapshots '
+                        '(account_id, resource, hash, data) '
+                        'VALUES (?, ?, ?, ?)',
+                        (account_id, resource, *snapshot),
+                    )
+            self._conn.execute(
+                'INSERT OR REPLACE INTO accounts '
+                '(account_id, due_at, interval, synced_at) '
+                'VALUES (?, ?, ?, ?)',
+                (account_id, due_at, interval, synced_at),
+            )
+
+    def close(self):
+        self._conn.close()
+
+
+class AccountSync:
+    # Keeps a `SnapshotStore` up to date with ENSEK and reports what changed.
+    #
+    # Each `run` first adds the accounts of newly completed signups, read
+    # from the stored cursor onwards, then fetches the `resources` of the
+    # accounts that are due and yields a `ChangeEvent` for each resource
+    # whose content differs from its snapshot. New accounts are due
+    # straight away. Once synced, an account is due again after
+    # `refresh_interval` seconds; with `max_refresh_interval`, that doubles
+    # each time nothing has changed, up to the maximum, so quiet accounts
+    # are fetched less and less often.
+    #
+    # An account's events are yielded before its snapshots are saved, so
+    # a run that is interrupted picks up where it left off and at worst
+    # repeats the events of the account it was on.
+
+    def __init__(
+        self, client, store, *, resources=SYNC_RESOURCES,
+        refresh_interval=24 * 60 * 60, max_refresh_interval=None,
+        concurrency=DEFAULT_POOLSIZE, clock=time.time,
+    ):
+        for name in resources:
+            client._bulk_method(name)
+        self._client = client
+        self._store = store
+        self._resources = tuple(resources)
+        self._refresh_interval = refresh_interval
+        self._max_refresh_interval = max_refresh_interval or refresh_interval
+        self._concurrency = concurrency
+        self._clock = clock
+        # Account id -> exception, for accounts the last run couldn't fetch.
+        # They stay due and are retried by the next run.
+        self.errors = {}
+        self.stats = {}
+
+    def run(self, *, limit=None):
+        # `limit` caps how many due accounts are fetched
+        self.errors = {}
+        self.stats = dict.fromkeys(
+            ('signups', 'accounts', 'changed', 'unchanged', 'failed'), 0
+        )
+        self._add_new_signups()
+        due = self._store.due_accounts(self._clock(), limit=limit)
+        results = self._client._run_many(
+            self._fetch,
+            ({'account_id': account_id} for account_id in due),
+            concurrency=self._concurrency,
+        )
+        for params, fetched, error in results:
+            account_id = params['account_id']
+            self.stats['accounts'] += 1
+            if error is not None:
+                self.stats['failed'] += 1
+                self.errors[account_id] = error
+                continue
+            events, snapshots = self._diff(account_id, fetched)
+            self.stats['changed' if events else 'unchanged'] += 1
+            yield from events
+            self._save(account_id, snapshots, changed=bool(events))
+
+    def _add_new_signups(self):
+        pages = self._client._iter_completed_signup_pages(
+            after=self._store.cursor
+        )
+        for signups, cursor in pages:
+            self._store.add_accounts(
+                [signup['accountId'] for signup in signups],
+                due_at=self._clock(), cursor=cursor,
+            )
+            self.stats['signups'] += len(signups)
+
+    def _fetch(self, account_id):
+        # Resources bypass the response cache, which could hide changes.
+        # A 404 means the account doesn't have that resource (any more).
+        fetched = {}
+        for name in self._resources:
+            path, params = self._client._endpoint_request(
+                name, account_id=account_id
+            )
+            try:
+                fetched[name] = self._client._get(
+                    path, params=params, endpoint=name
+                )
+            except LookupError:
+                fetched[name] = None
+        return fetched
+
+    def _diff(self, account_id, fetched):
+        previous = self._store.snapshots(account_id)
+        events = []
+        snapshots = {}
+        for name, data in fetched.items():
+            old = previous.get(name)
+            if data is None:
+                if old is not None:
+                    events.append(ChangeEvent(
+                        account_id, name, 'removed', json.loads(old.data),
+                        None,
+                    ))
+                    snapshots[name] = None
+                continue
+            new = _snapshot(data)
+            if old is None:
+                events.append(
+                    ChangeEvent(account_id, name, 'added', None, data)
+                )
+            elif old.hash != new.hash:
+                events.append(ChangeEvent(
+                    account_id, name, 'changed', json.loads(old.data), data,
+                ))
+            else:
+                continue
+            snapshots[name] = new
+        return events, snapshots
+
+    def _save(self, account_id, snapshots, *, changed):
+        interval = self._store.interval(account_id)
+        if changed or interval is None:
+            interval = self._refresh_interval
+        else:
+            interval = min(2 * interval, self._max_refresh_interval)
+        now = self._clock()
+        self._store.save(
+            account_id, snapshots, synced_at=now, due_at=now + interval,
+            interval=interval,
+        )
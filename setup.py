@@ -30,8 +30,12 @@ setup(
     author_email=EMAIL,
     python_requires=REQUIRES_PYTHON,
     url=URL,
-    packages=find_packages(exclude=('tests',)),
+    packages=find_packages(exclude=('tests', 'benchmarks')),
     install_requires=REQUIRED,
+    extras_require={
+        'async': ['aiohttp>=3.7'],
+        'analytics': ['numpy>=1.17', 'pyarrow'],
+    },
     include_package_data=True,
     license='Apache 2',
     classifiers=[
@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+from ensek import Ensek
+
+from .fake_server import FakeEnsekServer
+
+ENSEK_API_KEY = os.environ['ENSEK_API_KEY']
+
+
+class Clock:
+    # Stands in for `time.time` or `time.monotonic`; tests move `now` on,
+    # or `sleep` does
+    def __init__(self, now=0):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def routes():
+    # Modules override this with the routes their `server` serves
+    return {}
+
+
+@pytest.fixture
+def server(routes):
+    with FakeEnsekServer(routes=routes) as server:
+        yield server
+
+
+@pytest.fixture
+def client_factory(server):
+    # `Ensek` clients of `server`, with any other options given
+    def factory(**kwargs):
+        return Ensek(api_url=server.url, api_key=ENSEK_API_KEY, **kwargs)
+    return factory
+
+
+@pytest.fixture
+def client(client_factory):
+    with client_factory() as client:
+        yield client
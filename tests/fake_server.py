@@ -0,0 +1,309 @@
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit
+
+import yaml
+
+Request = namedtuple('Request', 'method path port body headers')
+
+CASSETTES = Path(__file__).parent / 'cassettes'
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    # `http.server.ThreadingHTTPServer` is only there from Python 3.7
+    daemon_threads = True
+
+
+class _CaseInsensitiveRoutes(dict):
+    # ENSEK doesn't match paths by case (the cassettes mix '/accounts' and
+    # '/Accounts'), so recordings made with lowercase postcodes still answer
+    # for the upper-cased ones the client sends now
+
+    def __init__(self, routes):
+        super().__init__(routes)
+        self._folded = {key.casefold(): route for key, route in self.items()}
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return self._folded.get(key.casefold(), default)
+
+
+class FakeEnsekServer:
+    # `routes` maps a request path (query string included), or a method and
+    # path such as 'PUT /accounts/1/Attributes', to a `(status, body)` or
+    # `(status, body, headers)` tuple, or to a callable that takes the
+    # recorded `Request` and returns one; unknown paths echo the path back.
+    # Bodies are sent as JSON, or as they are if they're bytes. Requests
+    # are recorded with their client port so connection reuse can be
+    # checked.
+    # `latency` delays every response by that many seconds. With `etags`,
+    # GET responses carry an ETag and matching If-None-Match requests get a
+    # bodyless 304. `error_rate` and `throttle_rate` are the fractions of
+    # requests answered with a 500, or a 429 with a `Retry-After` of
+    # `retry_after` seconds, instead of their route.
+
+    def __init__(
+        self, routes=None, latency=0, etags=False, *, error_rate=0,
+        throttle_rate=0, retry_after=1, seed=None, port=0,
+    ):
+        self.routes = routes or {}
+        self.latency = latency
+        self.etags = etags
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.requests = []
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._server = _ThreadingHTTPServer(
+            ('127.0.0.1', port), self._handler_class()
+        )
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, kwargs={'poll_interval': 0.01},
+            daemon=True,
+        )
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    @property
+    def client_ports(self):
+        return {request.port for request in self.requests}
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @classmethod
+    def from_cassettes(cls, directory=CASSETTES, routes=None, **kwargs):
+        # Serves the responses recorded in vcrpy cassettes, with any
+        # `routes` added on top
+        return cls(_CaseInsensitiveRoutes({
+            **cassette_routes(directory), **(routes or {}),
+        }), **kwargs)
+
+    def _injected_failure(self):
+        with self._lock:
+            roll = self._random.random()
+        if roll < self.throttle_rate:
+            return 429, {'error': 'throttled'}, {
+                'Retry-After': str(self.retry_after),
+            }
+        if roll < self.throttle_rate + self.error_rate:
+            return 500, {'error': 'injected'}
+        return None
+
+    def _record(self, request):
+        with self._lock:
+            self.requests.append(request)
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+
+    def _finish(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def _respond(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                request = Request(
+                    self.command, self.path, self.client_address[1], body,
+                    dict(self.headers),
+                )
+                server._record(request)
+                time.sleep(server.latency)
+                server._finish()
+                route = server._injected_failure() or server.routes.get(
+                    f'{self.command} {self.path}', server.routes.get(
+                        self.path, (200, {'path': self.path})
+                    )
+                )
+                if callable(route):
+                    route = route(request)
+                self._send(*route)
+
+            def _send(self, status, body, headers=None):
+                if isinstance(body, bytes):
+                    payload = body
+                else:
+                    payload = json.dumps(body).encode()
+                headers = {
+                    'Content-Type': 'application/json', **(headers or {})
+                }
+                if server.etags and self.command == 'GET':
+                    etag = f'"{hashlib.md5(payload).hexdigest()}"'
+                    headers['ETag'] = etag
+                    if self.headers.get('If-None-Match') == etag:
+                        status, payload = 304, b''
+                headers['Content-Length'] = str(len(payload))
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = do_PUT = _respond  # noqa: N815
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def cassette_routes(directory=CASSETTES):
+    # Routes for every interaction recorded in a directory of cassettes,
+    # keyed by method and path. Bodies are served as recorded (unzipped).
+    routes = {}
+    for path in sorted(Path(directory).iterdir()):
+        if path.name.startswith(('.', '_')) or not path.is_file():
+            continue
+        with path.open() as f:
+            cassette = yaml.load(f, Loader=yaml.Loader)
+        for interaction in cassette['interactions']:
+            request = interaction['request']
+            response = interaction['response']
+            uri = urlsplit(request['uri'])
+            target = f'{uri.path}?{uri.query}' if uri.query else uri.path
+            body = response['body']['string']
+            if isinstance(body, str):
+                body = body.encode()
+            encoding = response['headers'].get('Content-Encoding', [None])
+            if encoding[0] == 'gzip':
+                body = gzip.decompress(body)
+            content_type = response['headers'].get(
+                'Content-Type', ['application/json']
+            )
+            routes[f'{request["method"]} {target}'] = (
+                response['status']['code'], body,
+                {'Content-Type': content_type[0]},
+            )
+    return routes
+
+
+def signup_routes(*, pages, page_size, first_account_id=1):
+    # `pages` pages of completed signups, read from `after=0`
+    routes = {}
+    for page in range(pages):
+        after = page * page_size
+        first = first_account_id + after
+        routes[f'/SignUps/Completed?after={after}'] = (200, {
+            'results': [
+                {
+                    'accountId': account_id,
+                    'createdDateTime': '2018-08-09T08:29:37.493',
+                }
+                for account_id in range(first, first + page_size)
+            ],
+            'meta': {'after': after + page_size},
+        })
+    routes[f'/SignUps/Completed?after={pages * page_size}'] = (
+        200, {'results': []}
+    )
+    return routes
+
+
+def account_routes(account_id, *, meter_points=2, readings=100):
+    # A synthetic account with `meter_points` meter points of `readings`
+    # monthly readings each. Meter point ids are `account_id * 100 + num`.
+    routes = {
+        f'/accounts/{account_id}': (200, {
+            'id': account_id,
+            'siteAddress': {'postcode': 'NG7 5EB', 'uprn': None},
+            'primaryContact': None,
+            'externalReference': f'A-{account_id}',
+        }),
+        f'/Accounts/{account_id}/MeterPoints': (200, [
+            {
+                'id': account_id * 100 + num,
+                'meterPointNumber': f'99{account_id * 100 + num:011}',
+                'meterPointType': 'E',
+                'meters': [{
+                    'meterId': num,
+                    'meterSerialNumber': f'S{num}',
+                    'registers': [{'id': num, 'registerReference': '1'}],
+                }],
+                'attributes': [],
+            }
+            for num in range(meter_points)
+        ]),
+    }
+    for num in range(meter_points):
+        meter_point_id = account_id * 100 + num
+        routes[f'/MeterPoints/{meter_point_id}/Readings'] = (200, [
+            {
+                'id': meter_point_id * readings + reading,
+                'readingType': 'Actual',
+                'meterPointId': meter_point_id,
+                'dateTime': (
+                    f'{2010 + reading // 12}-{reading % 12 + 1:02}-01T00:00:00'
+                ),
+                'createdDate': '2018-07-30T12:58:53.237',
+                'readings': [{
+                    'id': reading, 'registerId': num, 'value': 10.0 * reading,
+                }],
+                'meterReadingSource': 'SMART',
+            }
+            for reading in range(readings)
+        ])
+    return routes
+
+
+def main():
+    # Runs the server on its own, e.g. to point a client or a benchmark at
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--throttle-rate', type=float, default=0)
+    parser.add_argument('--signup-pages', type=int, default=0)
+    parser.add_argument('--accounts', type=int, default=0)
+    args = parser.parse_args()
+    routes = signup_routes(pages=args.signup_pages, page_size=100)
+    for account_id in range(1, args.accounts + 1):
+        routes.update(account_routes(account_id))
+    server = FakeEnsekServer.from_cassettes(
+        routes=routes, latency=args.latency, error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate, port=args.port,
+    )
+    with server:
+        print(f'Serving on {server.url}')
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import asyncio
+import os
+
+import pytest
+
+from ensek import Ensek, MeterPoint
+from ensek.aio import AsyncEnsek
+
+from .fake_server import account_routes
+
+ENSEK_API_KEY = os.environ['ENSEK_API_KEY']
+
+
+@pytest.fixture
+def routes():
+    return {
+        **account_routes(1, meter_points=2, readings=3),
+        '/accounts/1/AccountSettings': (200, {'paperless': True}),
+        '/Accounts/1/Tariffs': (200, [{'tariffName': 'Fixed'}]),
+        '/Accounts/1/LiveBalancesWithDetail': (200, {'Charges': []}),
+        '/accounts/1/Attributes': (500, {'error': 'down'}),
+        '/MeterPoints/101/Readings': (404, {}),
+    }
+
+
+@pytest.fixture
+def server(server):
+    server.latency = 0.05
+    return server
+
+
+def test_get_account_view(server, client):
+    view = client.get_account_view(1)
+
+    assert view.account_id == 1
+    assert view.account['externalReference'] == 'A-1'
+    assert view.settings == {'paperless': True}
+    assert [meter_point['id'] for meter_point in view.meter_points] == [
+        100, 101,
+    ]
+    assert view.tariffs == [{'tariffName': 'Fixed'}]
+    assert view.live_balances == {'Charges': []}
+    assert view.attributes is None
+    assert view.readings is None
+    assert list(view.errors) == ['attributes']
+    # The parts were fetched at the same time
+    assert len(server.requests) == 6
+    assert server.max_in_flight == 6
+
+
+def test_get_account_view_follows_meter_points(server, client_factory):
+    with client_factory(models=True) as client:
+        view = client.get_account_view(1, include=['account', 'readings'])
+
+    assert isinstance(view.meter_points[0], MeterPoint)
+    assert list(view.readings) == [100]
+    assert len(view.readings[100]) == 3
+    assert isinstance(view.errors['readings', 101], LookupError)
+    assert view.settings is None
+    assert {request.path for request in server.requests} == {
+        '/accounts/1', '/Accounts/1/MeterPoints', '/MeterPoints/100/Readings',
+        '/MeterPoints/101/Readings',
+    }
+
+
+def test_get_account_view_rejects_unknown_parts():
+    client = Ensek(api_url='http://localhost', api_key=ENSEK_API_KEY)
+
+    with pytest.raises(ValueError):
+        client.get_account_view(1, include=['account', 'notes'])
+
+
+def test_async_get_account_view(server):
+    async def fetch():
+        async with AsyncEnsek(
+            api_url=server.url, api_key=ENSEK_API_KEY
+        ) as client:
+            return await client.get_account_view(
+                1, include=['settings', 'readings']
+            )
+
+    loop = asyncio.new_event_loop()
+    try:
+        view = loop.run_until_complete(fetch())
+    finally:
+        loop.close()
+
+    assert view.settings == {'paperless': True}
+    assert list(view.readings) == [100]
+    assert list(view.errors) == [('readings', 101)]
@@ -0,0 +1,317 @@
+import asyncio
+import os
+from datetime import datetime, timezone
+
+import pytest
+
+from ensek import EnsekError
+from ensek.aio import AsyncEnsek
+
+from .fake_server import FakeEnsekServer
+
+ENSEK_API_KEY = os.environ['ENSEK_API_KEY']
+ACCOUNT_ID = 1507
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def client_factory(server, **kwargs):
+    return AsyncEnsek(api_url=server.url, api_key=ENSEK_API_KEY, **kwargs)
+
+
+def test_get_methods_are_routed_to_endpoint(server):
+    async def fetch():
+        async with client_factory(server) as client:
+            return await asyncio.gather(
+                client.get_account(account_id=ACCOUNT_ID),
+                client.get_meter_points(account_id=ACCOUNT_ID),
+                client.get_account_tariffs(
+                    account_id=ACCOUNT_ID, include_history=True
+                ),
+            )
+
+    assert run(fetch()) == [
+        {'path': '/accounts/1507'},
+        {'path': '/Accounts/1507/MeterPoints'},
+        {'path': '/Accounts/1507/Tariffs?includeHistory=True'},
+    ]
+
+
+def test_keeps_many_requests_in_flight_on_one_session(server):
+    async def fetch():
+        async with client_factory(server, limit=50) as client:
+            return await asyncio.gather(*(
+                client.get_account(account_id=account_id)
+                for account_id in range(300)
+            ))
+
+    results = run(fetch())
+
+    assert results == [
+        {'path': f'/accounts/{account_id}'} for account_id in range(300)
+    ]
+    assert len(server.client_ports) <= 50
+
+
+def test_create_meter_reading(server):
+    server.routes['/Accounts/1507/Readings'] = (200, [])
+
+    async def create():
+        async with client_factory(server) as client:
+            return await client.create_meter_reading(
+                account_id=ACCOUNT_ID,
+                meter_point_id=1597,
+                register_id=1496,
+                value=2,
+                timestamp=datetime(2018, 7, 24, 13, 49, tzinfo=timezone.utc),
+                source='SMART',
+            )
+
+    assert run(create()) == []
+    assert server.requests[-1].method == 'POST'
+    assert server.requests[-1].body == [{
+        'meterPointId': 1597,
+        'dateTime': '2018-07-24T13:49:00+00:00',
+        'meterReadingSource': 'SMART',
+        'readings': [{'registerId': 1496, 'value': 2.0}],
+    }]
+
+
+def test_create_meter_readings_reports_rejected_readings(server):
+    def reject_negative_readings(request):
+        if any(entry['readings'][0]['value'] < 0 for entry in request.body):
+            return 400, {}
+        return 200, []
+
+    server.routes['/Accounts/1507/Readings'] = reject_negative_readings
+    readings = [
+        {
+            'meter_point_id': 1597, 'register_id': 1496, 'value': value,
+            'timestamp': datetime(2018, 7, day, tzinfo=timezone.utc),
+        }
+        for day, value in enumerate([1, -2, 3], start=1)
+    ]
+
+    async def create():
+        async with client_factory(server) as client:
+            return await client.create_meter_readings(
+                ACCOUNT_ID, readings, batch_size=3
+            )
+
+    results = run(create())
+
+    assert [item.params for item in results] == readings
+    assert [item.result for item in results] == [[], None, []]
+    assert isinstance(results[1].error, ValueError)
+
+
+def test_create_meter_readings_doesnt_resend_undecodable_responses(server):
+    server.routes['/Accounts/1507/Readings'] = (200, b'not json')
+    readings = [
+        {
+            'meter_point_id': 1597, 'register_id': 1496, 'value': value,
+            'timestamp': datetime(2018, 7, value, tzinfo=timezone.utc),
+        }
+        for value in range(1, 5)
+    ]
+
+    async def create():
+        async with client_factory(server) as client:
+            return await client.create_meter_readings(ACCOUNT_ID, readings)
+
+    results = run(create())
+
+    assert all(isinstance(item.error, ValueError) for item in results)
+    assert len(server.requests) == 1
+
+
+def test_create_meter_readings_reports_invalid_readings(server):
+    server.routes['/Accounts/1507/Readings'] = (200, [])
+    readings = [
+        {
+            'meter_point_id': 1597, 'register_id': 1496, 'value': value,
+            'timestamp': datetime(2018, 7, 1, tzinfo=timezone.utc),
+        }
+        for value in ['abc', 2]
+    ]
+
+    async def create():
+        async with client_factory(server) as client:
+            return await client.create_meter_readings(ACCOUNT_ID, readings)
+
+    results = run(create())
+
+    assert [item.result for item in results] == [None, []]
+    assert isinstance(results[0].error, ValueError)
+    assert len(server.requests) == 1
+
+
+def test_update_account_attribute(server):
+    async def update():
+        async with client_factory(server) as client:
+            return await client.update_account_attribute(
+                account_id=ACCOUNT_ID,
+                name='PaymentType',
+                value='value',
+                type='string',
+            )
+
+    assert run(update()) is None
+    assert server.requests[-1].method == 'PUT'
+    assert server.requests[-1].body == {
+        'updatedAttributes': [{
+            'accountId': ACCOUNT_ID,
+            'name': 'PaymentType',
+            'value': 'value',
+            'type': 'string',
+        }],
+        'deletedAttributes': [],
+    }
+
+
+def test_sync_account_attributes(server):
+    server.routes['/accounts/1507/Attributes'] = (200, [{
+        'accountId': ACCOUNT_ID, 'name': 'Legacy', 'value': 'yes',
+        'type': 'string',
+    }])
+
+    async def sync():
+        async with client_factory(server) as client:
+            return await client.sync_account_attributes(
+                ACCOUNT_ID,
+                [{'name': 'PaymentType', 'value': 'DD', 'type': 'string'}],
+                delete_missing=True,
+            )
+
+    changes = run(sync())
+
+    assert changes.deleted == ['Legacy']
+    assert server.requests[-1].method == 'PUT'
+    assert server.requests[-1].body == {
+        'updatedAttributes': [{
+            'accountId': ACCOUNT_ID,
+            'name': 'PaymentType',
+            'value': 'DD',
+            'type': 'string',
+        }],
+        'deletedAttributes': [{'accountId': ACCOUNT_ID, 'name': 'Legacy'}],
+    }
+
+
+def test_stream(server):
+    server.routes['/Accounts/1507/LiveBalancesWithDetail'] = (200, {
+        'TotalCharges': 3.0,
+        'Charges': [{'amount': num} for num in range(1000)],
+    })
+    server.routes['/SignUps/Completed'] = (200, {'results': [
+        {'accountId': 1}, {'accountId': 2},
+    ]})
+    server.routes['/SignUps/Completed?after=2'] = (200, {'results': []})
+
+    async def stream():
+        async with client_factory(server) as client:
+            charges = [
+                charge async for charge in client.stream(
+                    'get_live_balances_detailed', account_id=ACCOUNT_ID
+                )
+            ]
+            signups = [
+                signup async for signup in
+                client.iter_completed_signups(stream=True)
+            ]
+            return charges, signups
+
+    charges, signups = run(stream())
+
+    assert charges == [{'amount': num} for num in range(1000)]
+    assert signups == [{'accountId': 1}, {'accountId': 2}]
+
+
+def test_get_all_account_ids(server):
+    server.routes.update({
+        '/SignUps/Completed': (200, {'results': [
+            {'accountId': 1513}, {'accountId': 1514},
+        ]}),
+        '/SignUps/Completed?after=1514': (200, {'results': [
+            {'accountId': 1530},
+        ]}),
+        '/SignUps/Completed?after=1530': (200, {'results': []}),
+    })
+
+    async def fetch():
+        async with client_factory(server) as client:
+            return await client.get_all_account_ids()
+
+    assert run(fetch()) == {1513, 1514, 1530}
+
+
+@pytest.mark.parametrize('status_code, exc_class', [
+    (404, LookupError),
+    (400, ValueError),
+    (500, EnsekError),
+])
+def test_raises_for_bad_status_code(server, status_code, exc_class):
+    server.routes['/accounts/1507'] = (status_code, {})
+
+    async def fetch():
+        async with client_factory(server) as client:
+            return await client.get_account(account_id=ACCOUNT_ID)
+
+    with pytest.raises(exc_class) as exc:
+        run(fetch())
+
+    exc.match(rf'{status_code} .+')
+
+
+def test_retries_on_ensek_error(server):
+    server.routes['/accounts/1507'] = (503, {})
+
+    async def fetch():
+        async with client_factory(
+            server, retry_count=3, retry_wait=0.01
+        ) as client:
+            return await client.get_account(account_id=ACCOUNT_ID)
+
+    with pytest.raises(EnsekError):
+        run(fetch())
+
+    assert len(server.requests) == 3
+
+
+def test_raises_ensek_error_when_connection_fails(server):
+    server.stop()
+
+    async def fetch():
+        async with client_factory(server) as client:
+            return await client.get_account(account_id=ACCOUNT_ID)
+
+    with pytest.raises(EnsekError):
+        run(fetch())
+
+
+def test_get_many_collects_per_item_errors():
+    with FakeEnsekServer(
+        routes={'/Accounts/2/MeterPoints': (404, {})}, latency=0.05
+    ) as server:
+        async def fetch():
+            async with client_factory(server) as client:
+                return [
+                    item async for item in client.get_many(
+                        'get_meter_points',
+                        [{'account_id': num} for num in range(30)],
+                        concurrency=10,
+                    )
+                ]
+
+        results = {item.params['account_id']: item for item in run(fetch())}
+
+    assert len(results) == 30
+    assert isinstance(results[2].error, LookupError)
+    assert results[3].result == {'path': '/Accounts/3/MeterPoints'}
+    assert 1 < server.max_in_flight <= 10
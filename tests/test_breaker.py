@@ -0,0 +1,142 @@
+import asyncio
+import os
+
+import pytest
+
+from ensek import EnsekError, CircuitBreaker, CircuitOpenError
+from ensek.aio import AsyncEnsek
+
+ENSEK_API_KEY = os.environ['ENSEK_API_KEY']
+
+
+def fail(breaker, key, times=1):
+    for _ in range(times):
+        with pytest.raises(EnsekError):
+            with breaker.guard(key):
+                raise EnsekError('down', response=None)
+
+
+def succeed(breaker, key):
+    with breaker.guard(key):
+        pass
+
+
+@pytest.fixture
+def routes():
+    return {
+        '/accounts/1': (500, {'error': 'down'}),
+        '/accounts/2/AccountSettings': (404, {}),
+    }
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3)
+    fail(breaker, 'get_account', times=2)
+    succeed(breaker, 'get_account')
+    fail(breaker, 'get_account', times=2)
+    assert breaker.state('get_account') == 'closed'
+
+    fail(breaker, 'get_account')
+
+    assert breaker.states == {'get_account': 'open'}
+    with pytest.raises(CircuitOpenError) as exc_info:
+        succeed(breaker, 'get_account')
+    assert exc_info.value.key == 'get_account'
+    succeed(breaker, 'get_meter_points')
+
+
+def test_half_open_trial_closes_or_reopens_the_circuit(clock):
+    breaker = CircuitBreaker(
+        failure_threshold=1, recovery_time=30, clock=clock
+    )
+    fail(breaker, 'key')
+
+    clock.now = 29
+    with pytest.raises(CircuitOpenError) as exc_info:
+        succeed(breaker, 'key')
+    assert exc_info.value.retry_in == 1
+
+    clock.now = 30
+    assert breaker.state('key') == 'half_open'
+    fail(breaker, 'key')
+    assert breaker.state('key') == 'open'
+
+    clock.now = 60
+    succeed(breaker, 'key')
+    assert breaker.state('key') == 'closed'
+
+
+def test_half_open_lets_limited_trial_calls_through(clock):
+    breaker = CircuitBreaker(failure_threshold=1, clock=clock)
+    fail(breaker, 'key')
+    clock.now = 30
+
+    with breaker.guard('key'):
+        with pytest.raises(CircuitOpenError):
+            succeed(breaker, 'key')
+
+
+def test_client_errors_are_not_failures():
+    breaker = CircuitBreaker(failure_threshold=1)
+
+    with pytest.raises(LookupError):
+        with breaker.guard('key'):
+            raise LookupError('404')
+
+    assert breaker.state('key') == 'closed'
+
+
+def test_client_fails_fast_while_circuit_is_open(server, client_factory):
+    breaker = CircuitBreaker(failure_threshold=2)
+    with client_factory(
+        retry_count=5, retry_wait=0.01, circuit_breaker=breaker,
+    ) as client:
+        with pytest.raises(CircuitOpenError):
+            client.get_account(account_id=1)
+        with pytest.raises(CircuitOpenError):
+            client.get_account(account_id=3)
+        with pytest.raises(LookupError):
+            client.get_account_settings(account_id=2)
+
+        assert client.circuit_states == {
+            'get_account': 'open',
+            'get_account_settings': 'closed',
+        }
+        assert client.metrics['circuit_rejected'] == 2
+
+    # Retrying stopped once the circuit opened
+    assert len(server.requests) == 3
+
+
+def test_circuit_per_host(server, client_factory):
+    breaker = CircuitBreaker(failure_threshold=1, per='host')
+    with client_factory(circuit_breaker=breaker) as client:
+        with pytest.raises(EnsekError):
+            client.get_account(account_id=1)
+        with pytest.raises(CircuitOpenError):
+            client.get_account_settings(account_id=2)
+
+    assert client.circuit_states == {server.url[len('http://'):]: 'open'}
+
+
+def test_async_client_fails_fast_while_circuit_is_open(server):
+    async def fetch(client):
+        for _ in range(2):
+            with pytest.raises(EnsekError):
+                await client.get_account(account_id=1)
+        with pytest.raises(CircuitOpenError):
+            await client.get_account(account_id=1)
+
+    breaker = CircuitBreaker(failure_threshold=2)
+    client = AsyncEnsek(
+        api_url=server.url, api_key=ENSEK_API_KEY, circuit_breaker=breaker,
+    )
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(fetch(client))
+        loop.run_until_complete(client.close())
+    finally:
+        loop.close()
+
+    assert client.circuit_states == {'get_account': 'open'}
+    assert len(server.requests) == 2
@@ -0,0 +1,217 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import pytest
+
+from ensek import (
+    Ensek, ResponseCache, CacheStats, MemoryCacheBackend, SqliteCacheBackend
+)
+
+ENSEK_API_KEY = os.environ['ENSEK_API_KEY']
+ACCOUNT_ID = 1507
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend_factory(request, tmp_path):
+    def factory(maxsize=1024):
+        if request.param == 'memory':
+            return MemoryCacheBackend(maxsize=maxsize)
+        return SqliteCacheBackend(tmp_path / 'cache.db', maxsize=maxsize)
+    return factory
+
+
+def fill_shared_cache(path, worker):
+    cache = ResponseCache(
+        {'get_account': None}, backend=SqliteCacheBackend(path)
+    )
+    for num in range(50):
+        cache.set('get_account', f'{worker}-{num}', {'id': num})
+    cache.backend.close()
+
+
+def test_entries_expire_after_their_ttl(backend_factory, clock):
+    cache = ResponseCache(
+        {'get_gas_utility': 60}, backend=backend_factory(), clock=clock
+    )
+    cache.set('get_gas_utility', 'key', {'ldz': 'NT'})
+
+    clock.now = 59
+    assert cache.get('key') == {'ldz': 'NT'}
+    clock.now = 60
+    with pytest.raises(KeyError):
+        cache.get('key')
+    assert cache.stats == CacheStats(hits=1, misses=1, evictions=0)
+
+
+def test_entries_without_ttl_never_expire(backend_factory, clock):
+    cache = ResponseCache(
+        {'get_gas_utility': None}, backend=backend_factory(), clock=clock
+    )
+    cache.set('get_gas_utility', 'key', 1)
+
+    clock.now = 10 ** 9
+    assert cache.get('key') == 1
+
+
+def test_least_recently_used_entries_are_evicted(backend_factory):
+    cache = ResponseCache(
+        {'get_gas_utility': None}, backend=backend_factory(maxsize=2)
+    )
+    cache.set('get_gas_utility', 'a', 1)
+    cache.set('get_gas_utility', 'b', 2)
+    cache.get('a')
+    cache.set('get_gas_utility', 'c', 3)
+
+    assert len(cache) == 2
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    with pytest.raises(KeyError):
+        cache.get('b')
+    assert cache.stats.evictions == 1
+
+
+def test_returns_copies_of_cached_values(backend_factory):
+    cache = ResponseCache(
+        {'get_gas_utility': None}, backend=backend_factory()
+    )
+    value = {'meterDetails': []}
+    cache.set('get_gas_utility', 'key', value)
+    value['meterDetails'].append('changed')
+    cache.get('key')['meterDetails'].append('changed')
+
+    assert cache.get('key') == {'meterDetails': []}
+
+
+def test_invalidate_tags(backend_factory):
+    cache = ResponseCache(
+        {'get_account': None, 'get_meter_points': None},
+        backend=backend_factory(),
+    )
+    cache.set('get_account', 'a', {}, tags={'account_id=1'})
+    cache.set('get_meter_points', 'b', [], tags={'account_id=1'})
+    cache.set('get_account', 'c', {}, tags={'account_id=2'})
+
+    cache.invalidate_tags({'account_id=1'})
+
+    assert len(cache) == 1
+    cache.invalidate_tags({'endpoint=get_account'})
+    assert len(cache) == 0
+
+
+def test_sqlite_backend_is_shared_between_processes(tmp_path):
+    path = tmp_path / 'cache.db'
+    cache = ResponseCache(
+        {'get_account': None}, backend=SqliteCacheBackend(path)
+    )
+
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        list(executor.map(fill_shared_cache, [path] * 4, range(4)))
+
+    assert len(cache) == 200
+    assert cache.get('3-49') == {'id': 49}
+
+
+def test_client_serves_configured_endpoints_from_cache(
+    server, client_factory
+):
+    cache = ResponseCache({'get_region_id_for_postcode': 3600})
+    with client_factory(cache=cache) as client:
+        first = client.get_region_id_for_postcode(postcode='se14yu')
+        second = client.get_region_id_for_postcode(postcode='SE1 4YU')
+        client.get_region_id_for_postcode(postcode='e10ps')
+        client.get_account(account_id=ACCOUNT_ID)
+        client.get_account(account_id=ACCOUNT_ID)
+
+    assert first == second == {'path': '/Regions/SE14YU'}
+    assert [request.path for request in server.requests] == [
+        '/Regions/SE14YU',
+        '/Regions/E10PS',
+        '/accounts/1507',
+        '/accounts/1507',
+    ]
+    assert cache.stats == CacheStats(hits=1, misses=2, evictions=0)
+
+
+def test_client_rejects_unknown_endpoints():
+    with pytest.raises(ValueError):
+        Ensek(
+            api_url='https://its.mocked', api_key=ENSEK_API_KEY,
+            cache=ResponseCache({'create_meter_reading': 60}),
+        )
+
+
+def test_writes_invalidate_related_entries(server, client_factory):
+    server.routes['/Accounts/1507/Readings'] = (200, [])
+    cache = ResponseCache({
+        'get_account_attributes': 60,
+        'get_meter_point_readings': 60,
+        'get_account': 60,
+    })
+    with client_factory(cache=cache) as client:
+        client.get_account(account_id=1)
+        client.get_account_attributes(account_id=ACCOUNT_ID)
+        client.get_meter_point_readings(meter_point_id=1597)
+        assert len(cache) == 3
+
+        client.update_account_attribute(
+            account_id=ACCOUNT_ID, name='PaymentType', value='value',
+            type='string',
+        )
+        assert len(cache) == 2
+
+        client.create_meter_reading(
+            account_id=ACCOUNT_ID, meter_point_id=1597, register_id=1496,
+            value=2.0, timestamp=datetime.now(timezone.utc),
+        )
+        assert len(cache) == 1
+
+
+def test_invalidate_cache(client_factory):
+    cache = ResponseCache({'get_account': 60, 'get_gas_utility': 60})
+    with client_factory(cache=cache) as client:
+        for account_id in (1, 2, 3):
+            client.get_account(account_id=account_id)
+        client.get_gas_utility(mprn='3226987202')
+
+        client.invalidate_cache('get_account', account_id=1)
+        assert len(cache) == 3
+        client.invalidate_cache(account_id=2)
+        assert len(cache) == 2
+        client.invalidate_cache('get_account')
+        assert len(cache) == 1
+        client.invalidate_cache()
+        assert len(cache) == 0
+
+
+def test_invalidate_cache_normalises_postcodes(client_factory):
+    cache = ResponseCache({
+        'get_region_id_for_postcode': 60, 'get_addresses_at_postcode': 60,
+    })
+    with client_factory(cache=cache) as client:
+        client.get_region_id_for_postcode(postcode='SE1 4YU')
+        client.get_addresses_at_postcode(postcode='se14yu')
+        client.get_region_id_for_postcode(postcode='E1 0PS')
+
+        client.invalidate_cache(postcode='se1 4yu')
+        assert len(cache) == 1
+        client.invalidate_cache('get_region_id_for_postcode', postcode='e10ps')
+        assert len(cache) == 0
+
+
+def test_client_cache_keys_include_template_path_and_query(
+    client_factory, tmp_path
+):
+    backend = SqliteCacheBackend(tmp_path / 'cache.db')
+    cache = ResponseCache({'get_account_tariffs': 60}, backend=backend)
+    with client_factory(cache=cache) as client:
+        client.get_account_tariffs(account_id=1, include_history=True)
+        client.get_account_tariffs(account_id=1)
+
+    assert sorted(
+        key for key, in backend._conn.execute('SELECT key FROM entries')
+    ) == [
+        '/Accounts/$account_id/Tariffs /Accounts/1/Tariffs ',
+        '/Accounts/$account_id/Tariffs /Accounts/1/Tariffs '
+        'includeHistory=True',
+    ]
@@ -0,0 +1,145 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ensek.aio import AsyncEnsek
+
+ENSEK_API_KEY = os.environ['ENSEK_API_KEY']
+
+
+@pytest.fixture
+def routes():
+    return {
+        '/accounts/1': (200, {'id': 1}),
+        '/accounts/2': (200, {'id': 2}),
+        '/accounts/3': (404, {}),
+    }
+
+
+@pytest.fixture
+def server(server):
+    server.latency = 0.2
+    return server
+
+
+def call_concurrently(func, kwargs_list):
+    with ThreadPoolExecutor(max_workers=len(kwargs_list)) as executor:
+        futures = [executor.submit(func, **kwargs) for kwargs in kwargs_list]
+        return [future.exception() or future.result() for future in futures]
+
+
+def test_concurrent_identical_gets_share_one_request(server, client_factory):
+    with client_factory(coalesce=True) as client:
+        results = call_concurrently(
+            client.get_account, [{'account_id': 1}] * 8
+        )
+
+        assert client.metrics['coalesced'] == 7
+
+    assert results == [{'id': 1}] * 8
+    # Each caller gets its own copy
+    assert len({id(result) for result in results}) == 8
+    assert len(server.requests) == 1
+
+
+def test_only_identical_requests_are_coalesced(server, client_factory):
+    with client_factory(coalesce=True) as client:
+        results = call_concurrently(
+            client.get_account, [{'account_id': 1}, {'account_id': 2}]
+        )
+        # Requests that start after the first has finished are made again
+        client.get_account(account_id=1)
+
+        assert 'coalesced' not in client.metrics
+
+    assert results == [{'id': 1}, {'id': 2}]
+    assert len(server.requests) == 3
+
+
+def test_errors_are_shared(server, client_factory):
+    with client_factory(coalesce=True) as client:
+        results = call_concurrently(
+            client.get_account, [{'account_id': 3}] * 4
+        )
+
+    assert all(isinstance(result, LookupError) for result in results)
+    assert len(server.requests) == 1
+
+
+def test_callers_dont_see_each_others_changes(server, client_factory):
+    with client_factory(coalesce=True) as client:
+        def fetch_and_clear(**kwargs):
+            result = client.get_account(**kwargs)
+            seen = dict(result)
+            result.clear()
+            return seen
+
+        results = call_concurrently(fetch_and_clear, [{'account_id': 1}] * 8)
+
+    assert results == [{'id': 1}] * 8
+    assert len(server.requests) == 1
+
+
+def test_coalescing_is_off_by_default(server, client):
+    call_concurrently(client.get_account, [{'account_id': 1}] * 3)
+
+    assert len(server.requests) == 3
+
+
+def test_async_concurrent_identical_gets_share_one_request(server):
+    async def fetch():
+        async with AsyncEnsek(
+            api_url=server.url, api_key=ENSEK_API_KEY, coalesce=True
+        ) as client:
+            calls = [
+                asyncio.ensure_future(client.get_account(account_id=1))
+                for _ in range(5)
+            ]
+            missing = asyncio.gather(
+                client.get_account(account_id=3),
+                client.get_account(account_id=3),
+                return_exceptions=True,
+            )
+            await asyncio.sleep(0.05)
+            # Cancelling one caller leaves the request to the others
+            calls[0].cancel()
+            results = await asyncio.gather(*calls[1:])
+            return results, await missing, client.metrics
+
+    loop = asyncio.new_event_loop()
+    try:
+        results, missing, metrics = loop.run_until_complete(fetch())
+    finally:
+        loop.close()
+
+    assert results == [{'id': 1}] * 4
+    assert all(isinstance(result, LookupError) for result in missing)
+    assert metrics['coalesced'] == 5
+    assert len(server.requests) == 2
+
+
+def test_async_callers_dont_see_each_others_changes(server):
+    async def fetch_and_clear(client):
+        result = await client.get_account(account_id=1)
+        seen = dict(result)
+        result.clear()
+        return seen
+
+    async def fetch():
+        async with AsyncEnsek(
+            api_url=server.url, api_key=ENSEK_API_KEY, coalesce=True
+        ) as client:
+            return await asyncio.gather(
+                *[fetch_and_clear(client) for _ in range(3)]
+            )
+
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(fetch())
+    finally:
+        loop.close()
+
+    assert results == [{'id': 1}] * 3
+    assert len(server.requests) == 1
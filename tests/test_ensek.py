@@ -1,14 +1,24 @@
+import inspect
+import json
 import os
 from datetime import datetime, timezone
 from pathlib import Path
 import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
 from requests.exceptions import RequestException
 from http.client import OK
 
 import pytest
 import vcr
 
-from ensek import Ensek, EnsekError
+from ensek import (
+    Ensek, EnsekError, AttributeChanges, diff_account_attributes
+)
+from ensek.aio import AsyncEnsek
+
+from .fake_server import FakeEnsekServer
 
 my_vcr = vcr.VCR(
     serializer='yaml',
@@ -18,6 +28,15 @@ my_vcr = vcr.VCR(
     filter_headers=['authorization']
 )
 
+
+def path_ignoring_case(r1, r2):
+    # ENSEK doesn't match paths by case, and the postcode cassettes were
+    # recorded before postcodes were upper-cased
+    return r1.path.lower() == r2.path.lower()
+
+
+my_vcr.register_matcher('path_ignoring_case', path_ignoring_case)
+
 ENSEK_API_URL = os.environ['ENSEK_API_URL']
 ENSEK_API_KEY = os.environ['ENSEK_API_KEY']
 STUBS_DIR = Path(Path().parent, 'fixtures')
@@ -73,7 +92,7 @@ def test_request_retries_on_ensek_error(mocker, retries):
         json=expected_result, ok=True, status_code=OK
     )
     side_effect.append(response)
-    mocker.patch('requests.get', side_effect=side_effect)
+    mocker.patch('requests.Session.request', side_effect=side_effect)
     client = client_factory(retries=3, retry_wait=0.1)
 
     result = client._request('get', 'fakepath')
@@ -81,7 +100,7 @@ def test_request_retries_on_ensek_error(mocker, retries):
 
 
 def test_request_raises_after_retries_exceeded(mocker):
-    mocker.patch('requests.get', side_effect=[
+    mocker.patch('requests.Session.request', side_effect=[
         EnsekError('', None),
         EnsekError('', None),
         EnsekError('', None),
@@ -92,11 +111,92 @@ def test_request_raises_after_retries_exceeded(mocker):
 
 
 def test_request_raises_when_request_exception(mocker, client):
-    mocker.patch('requests.get', side_effect=RequestException)
+    mocker.patch('requests.Session.request', side_effect=RequestException)
     with pytest.raises(EnsekError):
         client._request('get', 'fakepath')
 
 
+def test_client_reuses_connections_across_calls():
+    with FakeEnsekServer() as server, Ensek(
+        api_url=server.url, api_key=ENSEK_API_KEY
+    ) as client:
+        client.get_account(account_id=ACCOUNT_ID)
+        client.get_meter_points(account_id=ACCOUNT_ID)
+        client.get_account_tariffs(account_id=ACCOUNT_ID)
+
+    assert len(server.requests) == 3
+    assert len(server.client_ports) == 1
+
+
+def test_client_without_keep_alive_opens_new_connections():
+    with FakeEnsekServer() as server, Ensek(
+        api_url=server.url, api_key=ENSEK_API_KEY, keep_alive=False
+    ) as client:
+        client.get_account(account_id=ACCOUNT_ID)
+        client.get_meter_points(account_id=ACCOUNT_ID)
+
+    assert len(server.client_ports) == 2
+
+
+def test_client_passes_configured_timeout(mocker):
+    response = mock_response(json={}, ok=True, status_code=OK)
+    request = mocker.patch('requests.Session.request', return_value=response)
+    client = Ensek(
+        api_url=ENSEK_API_URL, api_key=ENSEK_API_KEY, timeout=(3, 27)
+    )
+
+    client._request('get', 'fakepath')
+
+    assert request.call_args[1]['timeout'] == (3, 27)
+
+
+def test_client_close_closes_session(mocker):
+    close = mocker.patch('requests.Session.close')
+    with client_factory():
+        pass
+
+    close.assert_called_once_with()
+
+
+def test_get_methods_are_routed_correctly_when_shared_across_threads(
+    mocker, client
+):
+    def request(method, url, **kwargs):
+        return mock_response(json=url, ok=True, status_code=OK)
+
+    mocker.patch('requests.Session.request', side_effect=request)
+    endpoints = [
+        ('get_account', 'account_id', '/accounts/{}'),
+        ('get_meter_points', 'account_id', '/Accounts/{}/MeterPoints'),
+        ('get_live_balances', 'account_id', '/Accounts/{}/LiveBalances'),
+        (
+            'get_meter_point_readings', 'meter_point_id',
+            '/MeterPoints/{}/Readings',
+        ),
+        ('get_gas_utility', 'mprn', '/UtilitiesLookups/Gas/{}'),
+    ]
+    calls = [
+        (endpoints[num % len(endpoints)], num) for num in range(5000)
+    ]
+
+    def call(args):
+        (name, arg_name, _), num = args
+        return getattr(client, name)(**{arg_name: num})
+
+    with ThreadPoolExecutor(max_workers=50) as executor:
+        results = list(executor.map(call, calls))
+
+    assert results == [
+        f'{ENSEK_API_URL}{template.format(num)}'
+        for (_, _, template), num in calls
+    ]
+
+
+def test_unknown_attribute_raises_attribute_error(client):
+    with pytest.raises(AttributeError):
+        client.get_unknown_resource
+
+
 @my_vcr.use_cassette()
 def test_get_account(client):
     result = client.get_account(account_id=ACCOUNT_ID)
@@ -256,7 +356,7 @@ def test_get_account_for_meter_point(client):
     assert result == {'accountId': ACCOUNT_ID}
 
 
-@my_vcr.use_cassette()
+@my_vcr.use_cassette(match_on=['path_ignoring_case', 'method'])
 def test_get_region_id_for_postcode(client):
     result = client.get_region_id_for_postcode(postcode='se14yu')
 
@@ -467,6 +567,25 @@ def test_get_account_attributes(client, mocker):
     assert results == expected_results
 
 
+@pytest.mark.parametrize('client_class', [Ensek, AsyncEnsek])
+def test_write_methods_keep_keyword_only_signatures(client_class):
+    reading = inspect.signature(client_class.create_meter_reading)
+    attribute = inspect.signature(client_class.update_account_attribute)
+
+    assert list(reading.parameters)[1:] == [
+        'account_id', 'meter_point_id', 'register_id', 'value', 'timestamp',
+        'source',
+    ]
+    assert list(attribute.parameters)[1:] == [
+        'account_id', 'name', 'value', 'type',
+    ]
+    assert all(
+        parameter.kind == parameter.KEYWORD_ONLY
+        for signature in (reading, attribute)
+        for parameter in list(signature.parameters.values())[1:]
+    )
+
+
 @my_vcr.use_cassette()
 def test_update_account_attribute(client):
     client.update_account_attribute(
@@ -485,3 +604,499 @@ def test_update_account_attribute(client):
         'type': 'string',
     }]
     assert results == expected_results
+
+
+def test_get_many_streams_results_tagged_with_params():
+    with FakeEnsekServer(routes={
+        '/Accounts/2/LiveBalances': (404, {}),
+        '/Accounts/3/LiveBalances': (400, {}),
+        '/Accounts/4/LiveBalances': (500, {}),
+    }) as server, Ensek(api_url=server.url, api_key=ENSEK_API_KEY) as client:
+        results = {
+            item.params['account_id']: item
+            for item in client.get_many(
+                'get_live_balances',
+                [{'account_id': account_id} for account_id in range(1, 6)],
+                concurrency=3,
+            )
+        }
+
+    assert results[1].result == {'path': '/Accounts/1/LiveBalances'}
+    assert results[1].error is None
+    assert results[5].result == {'path': '/Accounts/5/LiveBalances'}
+    assert isinstance(results[2].error, LookupError)
+    assert isinstance(results[3].error, ValueError)
+    assert isinstance(results[4].error, EnsekError)
+    assert all(results[num].result is None for num in (2, 3, 4))
+
+
+@pytest.mark.parametrize('concurrency, pool_maxsize, expected_max', [
+    (1, 10, 1),
+    (5, 10, 5),
+    (20, 4, 4),
+])
+def test_get_many_runs_calls_concurrently_up_to_pool_size(
+    concurrency, pool_maxsize, expected_max
+):
+    with FakeEnsekServer(latency=0.05) as server, Ensek(
+        api_url=server.url, api_key=ENSEK_API_KEY, pool_maxsize=pool_maxsize
+    ) as client:
+        results = list(client.get_many(
+            'get_account',
+            [{'account_id': account_id} for account_id in range(20)],
+            concurrency=concurrency,
+        ))
+
+    assert len(results) == 20
+    assert server.max_in_flight == expected_max
+
+
+def test_get_many_rejects_unknown_endpoint(client):
+    with pytest.raises(ValueError):
+        list(client.get_many('create_meter_reading', []))
+
+
+@my_vcr.use_cassette()
+def test_get_completed_signups(client):
+    signups = client.iter_completed_signups(after=1500)
+
+    assert list(itertools.islice(signups, 4)) == [
+        {'accountId': 1513, 'createdDateTime': '2017-10-09T10:55:37.543'},
+        {'accountId': 1514, 'createdDateTime': '2017-10-09T17:15:47.3'},
+        {'accountId': 1515, 'createdDateTime': '2017-10-10T17:30:25.257'},
+        {'accountId': 1516, 'createdDateTime': '2017-10-17T08:44:16.343'},
+    ]
+
+
+def test_iter_completed_signups_yields_each_page_as_it_arrives():
+    with FakeEnsekServer(routes={
+        '/SignUps/Completed?after=10': (200, {'results': [
+            {'accountId': 11}, {'accountId': 12},
+        ]}),
+        '/SignUps/Completed?after=12': (200, {'results': [
+            {'accountId': 13},
+        ]}),
+        '/SignUps/Completed?after=13': (200, {'results': []}),
+    }) as server, Ensek(api_url=server.url, api_key=ENSEK_API_KEY) as client:
+        signups = client.iter_completed_signups(after=10)
+
+        assert next(signups) == {'accountId': 11}
+        assert [request.path for request in server.requests] == [
+            '/SignUps/Completed?after=10',
+        ]
+        assert list(signups) == [{'accountId': 12}, {'accountId': 13}]
+        assert len(server.requests) == 3
+
+
+def signup_pages(page_count, page_size):
+    routes = {}
+    for page in range(page_count):
+        after = page * page_size
+        results = [
+            {'accountId': account_id}
+            for account_id in range(after + 1, after + page_size + 1)
+        ]
+        routes[f'/SignUps/Completed?after={after}'] = (200, {
+            'results': results,
+            'meta': {'after': after + page_size},
+        })
+    after = page_count * page_size
+    routes[f'/SignUps/Completed?after={after}'] = (200, {'results': []})
+    return routes
+
+
+def test_iter_completed_signups_prefetches_next_pages():
+    with FakeEnsekServer(routes=signup_pages(5, 2)) as server, Ensek(
+        api_url=server.url, api_key=ENSEK_API_KEY
+    ) as client:
+        signups = client.iter_completed_signups(after=0, prefetch=2)
+
+        assert next(signups) == {'accountId': 1}
+        for _ in range(100):
+            if len(server.requests) == 3:
+                break
+            time.sleep(0.01)
+        assert [request.path for request in server.requests] == [
+            '/SignUps/Completed?after=0',
+            '/SignUps/Completed?after=2',
+            '/SignUps/Completed?after=4',
+        ]
+        assert [signup['accountId'] for signup in signups] == list(
+            range(2, 11)
+        )
+
+
+def test_iter_completed_signups_prefetch_raises_errors_in_order():
+    routes = signup_pages(3, 2)
+    routes['/SignUps/Completed?after=2'] = (500, {})
+    with FakeEnsekServer(routes=routes) as server, Ensek(
+        api_url=server.url, api_key=ENSEK_API_KEY
+    ) as client:
+        signups = client.iter_completed_signups(after=0, prefetch=3)
+
+        assert next(signups) == {'accountId': 1}
+        assert next(signups) == {'accountId': 2}
+        with pytest.raises(EnsekError):
+            next(signups)
+
+
+def test_conditional_requests_revalidate_with_etags():
+    readings = [{'id': num, 'value': 2.0} for num in range(100)]
+    with FakeEnsekServer(
+        routes={'/MeterPoints/1597/Readings': (200, readings)}, etags=True
+    ) as server, Ensek(
+        api_url=server.url, api_key=ENSEK_API_KEY, conditional_requests=True
+    ) as client:
+        first = client.get_meter_point_readings(meter_point_id=1597)
+        second = client.get_meter_point_readings(meter_point_id=1597)
+        server.routes['/MeterPoints/1597/Readings'] = (200, readings[:1])
+        third = client.get_meter_point_readings(meter_point_id=1597)
+
+    assert first == second == readings
+    assert third == readings[:1]
+    etag = server.requests[1].headers['If-None-Match']
+    assert 'If-None-Match' not in server.requests[0].headers
+    assert server.requests[2].headers['If-None-Match'] == etag
+    assert client.metrics == {
+        'not_modified': 1,
+        'bytes_saved': len(json.dumps(readings)),
+    }
+
+
+def test_conditional_requests_dont_share_bodies():
+    readings = [{'id': num} for num in range(3)]
+    with FakeEnsekServer(
+        routes={'/MeterPoints/1597/Readings': (200, readings)}, etags=True
+    ) as server, Ensek(
+        api_url=server.url, api_key=ENSEK_API_KEY, conditional_requests=True
+    ) as client:
+        first = client.get_meter_point_readings(meter_point_id=1597)
+        first.pop()
+        second = client.get_meter_point_readings(meter_point_id=1597)
+        second[0]['id'] = 10
+        third = client.get_meter_point_readings(meter_point_id=1597)
+
+    assert second is not third
+    assert third == readings
+    assert client.metrics['not_modified'] == 2
+
+
+def test_conditional_requests_are_off_by_default():
+    with FakeEnsekServer(etags=True) as server, Ensek(
+        api_url=server.url, api_key=ENSEK_API_KEY
+    ) as client:
+        client.get_account(account_id=ACCOUNT_ID)
+        client.get_account(account_id=ACCOUNT_ID)
+
+    assert 'If-None-Match' not in server.requests[1].headers
+    assert client.metrics == {}
+
+
+def reject_negative_readings(request):
+    values = [
+        reading['value']
+        for entry in request.body for reading in entry['readings']
+    ]
+    if any(value < 0 for value in values):
+        return 400, {}
+    return 200, []
+
+
+def test_create_meter_readings_batches_readings():
+    timestamp = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    readings = [
+        {
+            'meter_point_id': 1597, 'register_id': register_id,
+            'value': register_id * 10, 'timestamp': timestamp,
+        }
+        for register_id in (1, 2, 3)
+    ] + [{
+        'meter_point_id': 1598, 'register_id': 4, 'value': 5,
+        'timestamp': timestamp, 'source': 'SMART',
+    }]
+    with FakeEnsekServer(routes={
+        '/Accounts/1507/Readings': (200, []),
+    }) as server, Ensek(api_url=server.url, api_key=ENSEK_API_KEY) as client:
+        results = client.create_meter_readings(
+            ACCOUNT_ID, readings, batch_size=2
+        )
+
+    assert [item.params for item in results] == readings
+    assert all(item.result == [] for item in results)
+    assert [request.body for request in server.requests] == [
+        [{
+            'meterPointId': 1597,
+            'dateTime': '2020-01-01T00:00:00+00:00',
+            'meterReadingSource': None,
+            'readings': [
+                {'registerId': 1, 'value': 10.0},
+                {'registerId': 2, 'value': 20.0},
+            ],
+        }],
+        [
+            {
+                'meterPointId': 1597,
+                'dateTime': '2020-01-01T00:00:00+00:00',
+                'meterReadingSource': None,
+                'readings': [{'registerId': 3, 'value': 30.0}],
+            },
+            {
+                'meterPointId': 1598,
+                'dateTime': '2020-01-01T00:00:00+00:00',
+                'meterReadingSource': 'SMART',
+                'readings': [{'registerId': 4, 'value': 5.0}],
+            },
+        ],
+    ]
+
+
+def test_create_meter_readings_reports_rejected_readings():
+    readings = [
+        {
+            'meter_point_id': 1597, 'register_id': 1, 'value': value,
+            'timestamp': datetime(2020, 1, day, tzinfo=timezone.utc),
+        }
+        for day, value in enumerate([1, 2, -3, 4], start=1)
+    ]
+    with FakeEnsekServer(routes={
+        '/Accounts/1507/Readings': reject_negative_readings,
+    }) as server, Ensek(api_url=server.url, api_key=ENSEK_API_KEY) as client:
+        results = client.create_meter_readings(ACCOUNT_ID, readings)
+
+    assert [item.params['value'] for item in results] == [1, 2, -3, 4]
+    assert [item.error is None for item in results] == [
+        True, True, False, True,
+    ]
+    assert isinstance(results[2].error, ValueError)
+    # The batch, its halves, then the bad reading's half split again
+    assert len(server.requests) == 5
+
+
+def test_create_meter_readings_doesnt_resend_undecodable_responses():
+    readings = [
+        {
+            'meter_point_id': 1597, 'register_id': 1, 'value': value,
+            'timestamp': datetime(2020, 1, value, tzinfo=timezone.utc),
+        }
+        for value in range(1, 5)
+    ]
+    with FakeEnsekServer(routes={
+        '/Accounts/1507/Readings': (200, b'not json'),
+    }) as server, Ensek(api_url=server.url, api_key=ENSEK_API_KEY) as client:
+        results = client.create_meter_readings(ACCOUNT_ID, readings)
+
+    assert all(isinstance(item.error, ValueError) for item in results)
+    # ENSEK took the batch, so it isn't split and sent again
+    assert len(server.requests) == 1
+
+
+def test_bulk_readings_report_readings_that_cannot_be_sent():
+    timestamp = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    readings = [
+        {
+            'account_id': ACCOUNT_ID, 'meter_point_id': 1597,
+            'register_id': register_id, 'value': value,
+            'timestamp': timestamp,
+        }
+        for register_id, value in enumerate([1, 'abc', 3], start=1)
+    ]
+    readings.append({'account_id': ACCOUNT_ID, 'meter_point_id': 1597})
+    with FakeEnsekServer(routes={
+        '/Accounts/1507/Readings': (200, []),
+    }) as server, Ensek(api_url=server.url, api_key=ENSEK_API_KEY) as client:
+        created = client.create_meter_readings(ACCOUNT_ID, readings)
+        submitted = list(client.submit_meter_readings(readings))
+
+    for results in (created, submitted):
+        assert [item.params for item in results] == readings
+        assert [item.result for item in results] == [[], None, [], None]
+        assert all(
+            isinstance(item.error, ValueError) for item in results[1::2]
+        )
+    # Only the valid readings were sent, in one POST per call
+    assert [
+        [reading['value'] for reading in request.body[0]['readings']]
+        for request in server.requests
+    ] == [[1.0, 3.0], [1.0, 3.0]]
+
+
+def test_submit_meter_readings_batches_per_account():
+    readings = [
+        {
+            'account_id': account_id, 'meter_point_id': 1,
+            'register_id': 1, 'value': num,
+            'timestamp': datetime(2020, 1, 1, tzinfo=timezone.utc),
+        }
+        for num in range(10) for account_id in (1, 2, 3)
+    ]
+    readings.append({**readings[0], 'account_id': 4, 'value': -1})
+    with FakeEnsekServer(latency=0.02, routes={
+        f'/Accounts/{account_id}/Readings': reject_negative_readings
+        for account_id in (1, 2, 3, 4)
+    }) as server, Ensek(api_url=server.url, api_key=ENSEK_API_KEY) as client:
+        results = list(client.submit_meter_readings(
+            readings, batch_size=4, concurrency=3
+        ))
+
+    assert len(results) == len(readings)
+    assert [item.params for item in results if item.error] == [readings[-1]]
+    sent = {}
+    for request in server.requests:
+        sent.setdefault(request.path, []).append([
+            reading['value']
+            for entry in request.body for reading in entry['readings']
+        ])
+    # Each account's readings are sent in order, in batches of up to 4
+    for account_id in (1, 2, 3):
+        assert sent[f'/Accounts/{account_id}/Readings'] == [
+            [0.0, 1.0, 2.0, 3.0], [4.0, 5.0, 6.0, 7.0], [8.0, 9.0],
+        ]
+    assert 1 < server.max_in_flight <= 3
+
+
+def test_update_account_attributes_sends_updates_and_deletes():
+    with FakeEnsekServer() as server, Ensek(
+        api_url=server.url, api_key=ENSEK_API_KEY
+    ) as client:
+        client.update_account_attributes(
+            ACCOUNT_ID,
+            updated=[{'name': 'PaymentType', 'value': 'DD', 'type': 'string'}],
+            deleted=['Legacy'],
+        )
+
+    assert server.requests[-1].method == 'PUT'
+    assert server.requests[-1].body == {
+        'updatedAttributes': [{
+            'accountId': ACCOUNT_ID,
+            'name': 'PaymentType',
+            'value': 'DD',
+            'type': 'string',
+        }],
+        'deletedAttributes': [{'accountId': ACCOUNT_ID, 'name': 'Legacy'}],
+    }
+
+
+@pytest.mark.parametrize('delete_missing, expected_deleted', [
+    (False, []),
+    (True, ['Legacy']),
+])
+def test_diff_account_attributes(delete_missing, expected_deleted):
+    current = [
+        {'accountId': 1, 'name': 'PaymentType', 'value': 'DD',
+         'type': 'string'},
+        {'accountId': 1, 'name': 'Legacy', 'value': 'yes', 'type': 'string'},
+        {'accountId': 1, 'name': 'Priority', 'value': '1', 'type': 'string'},
+    ]
+    desired = [
+        {'name': 'PaymentType', 'value': 'DD', 'type': 'string'},
+        {'name': 'Priority', 'value': '2', 'type': 'string'},
+        {'name': 'Region', 'value': 'North', 'type': 'string'},
+    ]
+
+    changes = diff_account_attributes(
+        current, desired, delete_missing=delete_missing
+    )
+
+    assert changes == AttributeChanges(desired[1:], expected_deleted)
+
+
+def test_sync_account_attributes_only_sends_changes():
+    current = [{
+        'accountId': ACCOUNT_ID, 'name': 'PaymentType', 'value': 'DD',
+        'type': 'string',
+    }]
+    with FakeEnsekServer(routes={
+        '/accounts/1507/Attributes': (200, current),
+    }) as server, Ensek(api_url=server.url, api_key=ENSEK_API_KEY) as client:
+        unchanged = client.sync_account_attributes(ACCOUNT_ID, [
+            {'name': 'PaymentType', 'value': 'DD', 'type': 'string'},
+        ])
+        changed = client.sync_account_attributes(ACCOUNT_ID, [
+            {'name': 'PaymentType', 'value': 'BACS', 'type': 'string'},
+        ])
+
+    assert unchanged == AttributeChanges([], [])
+    assert changed.updated == [
+        {'name': 'PaymentType', 'value': 'BACS', 'type': 'string'}
+    ]
+    assert [request.method for request in server.requests] == [
+        'GET', 'GET', 'PUT',
+    ]
+
+
+def test_update_many_account_attributes():
+    with FakeEnsekServer(latency=0.05, routes={
+        '/accounts/3/Attributes': (400, {}),
+    }) as server, Ensek(api_url=server.url, api_key=ENSEK_API_KEY) as client:
+        results = {
+            item.params['account_id']: item
+            for item in client.update_many_account_attributes(
+                [{'account_id': account_id, 'deleted': ['Legacy']}
+                 for account_id in range(1, 6)],
+                concurrency=3,
+            )
+        }
+
+    assert sorted(results) == [1, 2, 3, 4, 5]
+    assert isinstance(results[3].error, ValueError)
+    assert all(results[num].error is None for num in (1, 2, 4, 5))
+    assert server.max_in_flight == 3
+
+
+def test_stream_yields_array_items():
+    readings = [{'id': num, 'value': num / 2} for num in range(1000)]
+    with FakeEnsekServer(routes={
+        '/MeterPoints/1597/Readings': (200, readings),
+        '/Accounts/1507/LiveBalancesWithDetail': (200, {
+            'TotalCharges': 1.5, 'Charges': [{'amount': 1.5}],
+        }),
+    }) as server, Ensek(api_url=server.url, api_key=ENSEK_API_KEY) as client:
+        streamed = client.stream(
+            'get_meter_point_readings', meter_point_id=1597
+        )
+        charges = client.stream(
+            'get_live_balances_detailed', account_id=ACCOUNT_ID
+        )
+
+        assert next(streamed) == readings[0]
+        assert list(streamed) == readings[1:]
+        assert list(charges) == [{'amount': 1.5}]
+        with pytest.raises(ValueError):
+            list(client.stream('get_account', account_id=ACCOUNT_ID))
+        with pytest.raises(ValueError):
+            client.stream('create_meter_reading')
+
+
+def test_stream_raises_for_bad_status_code(mocker):
+    close = mocker.spy(requests.Response, 'close')
+    with FakeEnsekServer(routes={
+        '/MeterPoints/1/Readings': (404, {}),
+        '/MeterPoints/2/Readings': (500, {'error': 'Broken'}),
+    }) as server, Ensek(
+        api_url=server.url, api_key=ENSEK_API_KEY, retry_count=0,
+    ) as client:
+        with pytest.raises(LookupError):
+            list(client.stream('get_meter_point_readings', meter_point_id=1))
+        with pytest.raises(EnsekError) as excinfo:
+            list(client.stream('get_meter_point_readings', meter_point_id=2))
+
+    # Failed responses are closed, with their body kept for the error
+    assert close.call_count == 2
+    assert 'Broken' in str(excinfo.value)
+
+
+def test_iter_completed_signups_streams_pages():
+    with FakeEnsekServer(routes={
+        '/SignUps/Completed?after=10': (200, {
+            'results': [{'accountId': 11}, {'accountId': 12}],
+            'meta': {'after': 20},
+        }),
+        '/SignUps/Completed?after=20': (200, {'results': [
+            {'accountId': 21},
+        ]}),
+        '/SignUps/Completed?after=21': (200, {'results': []}),
+    }) as server, Ensek(api_url=server.url, api_key=ENSEK_API_KEY) as client:
+        signups = list(client.iter_completed_signups(after=10, stream=True))
+
+    assert signups == [{'accountId': 11}, {'accountId': 12}, {'accountId': 21}]
+    assert len(server.requests) == 3
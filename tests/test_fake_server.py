@@ -0,0 +1,88 @@
+import os
+
+import pytest
+
+from ensek import Ensek, EnsekError
+
+from .fake_server import FakeEnsekServer, account_routes, signup_routes
+
+ENSEK_API_KEY = os.environ['ENSEK_API_KEY']
+
+
+def test_serves_recorded_cassettes():
+    with FakeEnsekServer.from_cassettes() as server, Ensek(
+        api_url=server.url, api_key=ENSEK_API_KEY
+    ) as client:
+        account = client.get_account(account_id=1507)
+        region = client.get_region_id_for_postcode(postcode='se1 4yu')
+        addresses = client.get_addresses_at_postcode(postcode='se14yu')
+        client.update_account_attribute(
+            account_id=1507, name='PaymentType', value='value',
+            type='string',
+        )
+        with pytest.raises(LookupError):
+            client.get_account_tariffs(account_id=1234567890)
+
+    assert account['id'] == 1507
+    assert region == 12
+    assert addresses[0]['postcode'] == 'SE1 4YU'
+    # Postcodes are sent normalised, and the recordings answer regardless
+    assert [request.path for request in server.requests[1:3]] == [
+        '/Regions/SE14YU', '/PostcodeLookups?postcode=SE14YU',
+    ]
+    assert [request.method for request in server.requests][-2:] == [
+        'PUT', 'GET',
+    ]
+
+
+def test_synthetic_accounts_and_signups():
+    routes = {
+        **signup_routes(pages=3, page_size=10),
+        **account_routes(1, meter_points=2, readings=24),
+    }
+    with FakeEnsekServer(routes=routes) as server, Ensek(
+        api_url=server.url, api_key=ENSEK_API_KEY
+    ) as client:
+        signups = list(client.iter_completed_signups(after=0))
+        meter_points = client.get_meter_points(account_id=1)
+        readings = client.get_meter_point_readings(meter_point_id=101)
+
+    assert [signup['accountId'] for signup in signups] == list(range(1, 31))
+    assert [meter_point['id'] for meter_point in meter_points] == [100, 101]
+    assert len(readings) == 24
+    assert readings[-1]['dateTime'] == '2011-12-01T00:00:00'
+
+
+@pytest.mark.parametrize('options, status', [
+    ({'error_rate': 1}, 500),
+    ({'throttle_rate': 1, 'retry_after': 7}, 429),
+])
+def test_injected_failures(options, status):
+    with FakeEnsekServer(
+        routes={'/accounts/1': (200, {'id': 1})}, **options
+    ) as server, Ensek(api_url=server.url, api_key=ENSEK_API_KEY) as client:
+        with pytest.raises(EnsekError) as exc_info:
+            client.get_account(account_id=1)
+
+    assert exc_info.value.response.status_code == status
+    if status == 429:
+        assert exc_info.value.response.headers['Retry-After'] == '7'
+
+
+def test_failure_rates_are_reproducible_with_a_seed():
+    def statuses():
+        with FakeEnsekServer(error_rate=0.5, seed=1) as server, Ensek(
+            api_url=server.url, api_key=ENSEK_API_KEY
+        ) as client:
+            results = []
+            for _ in range(20):
+                try:
+                    client.get_account(account_id=1)
+                    results.append(200)
+                except EnsekError:
+                    results.append(500)
+        return results
+
+    first = statuses()
+    assert first == statuses()
+    assert 200 in first and 500 in first
@@ -0,0 +1,219 @@
+import asyncio
+import os
+
+import pytest
+
+from ensek import (
+    EnsekError, Instrumentation, LatencyHistogram, OpenTelemetryHook,
+    RequestRecord, prometheus_text,
+)
+from ensek.aio import AsyncEnsek
+
+ENSEK_API_KEY = os.environ['ENSEK_API_KEY']
+
+
+def record(endpoint='get_account', duration=0.1, status=200, **kwargs):
+    fields = dict.fromkeys(RequestRecord._fields)
+    fields.update(
+        endpoint=endpoint, method='GET', path='/accounts/1', status=status,
+        bytes=10, attempt=1, started_at=1500000000.0, duration=duration,
+    )
+    fields.update(kwargs)
+    return RequestRecord(**fields)
+
+
+@pytest.fixture
+def routes():
+    return {
+        '/accounts/1': (200, {'id': 1}),
+        '/accounts/2': (500, {'error': 'down'}),
+        '/SignUps/Completed': (200, {'results': []}),
+        '/MeterPoints/1/Readings': (200, [{'id': 1}]),
+    }
+
+
+def test_records_each_request(client_factory):
+    records = []
+    with client_factory(
+        instrumentation=Instrumentation([records.append]),
+    ) as client:
+        client.get_account(account_id=1)
+        client.get_all_account_ids()
+        list(client.stream('get_meter_point_readings', meter_point_id=1))
+
+    account, signups, readings = records
+    assert account.endpoint == 'get_account'
+    assert account.method == 'GET'
+    assert account.path == '/accounts/1'
+    assert (account.status, account.bytes, account.attempt) == (200, 9, 1)
+    assert account.error is None
+    assert account.connect is None
+    assert all(
+        phase >= 0 for phase in (
+            account.queued, account.wait, account.transfer, account.decode,
+        )
+    )
+    assert account.duration >= (
+        account.queued + account.wait + account.transfer + account.decode
+    )
+    assert signups.endpoint == '/SignUps/Completed'
+    # Streamed bodies are read after the request has been recorded
+    assert readings.status == 200
+    assert readings.bytes is readings.transfer is readings.decode is None
+
+
+def test_records_each_retry_and_error(client_factory):
+    records = []
+    with client_factory(
+        retry_count=2, retry_wait=0.01,
+        instrumentation=Instrumentation([records.append]),
+    ) as client:
+        with pytest.raises(EnsekError):
+            client.get_account(account_id=2)
+
+    assert [(r.attempt, r.status) for r in records] == [(1, 500), (2, 500)]
+    assert all(isinstance(r.error, EnsekError) for r in records)
+    assert records[0].decode is None
+
+
+def test_failing_hooks_are_ignored(client_factory, caplog):
+    def broken(record):
+        raise RuntimeError('broken')
+
+    records = []
+    instrumentation = Instrumentation([broken, records.append])
+    with client_factory(instrumentation=instrumentation) as client:
+        assert client.get_account(account_id=1) == {'id': 1}
+        instrumentation.unsubscribe(broken)
+        client.get_account(account_id=1)
+
+    assert len(records) == 2
+    assert len([r for r in caplog.records if r.levelname == 'ERROR']) == 1
+
+
+def test_async_client_records_connect_time(server):
+    async def fetch():
+        async with AsyncEnsek(
+            api_url=server.url, api_key=ENSEK_API_KEY,
+            instrumentation=Instrumentation([records.append]),
+        ) as client:
+            await client.get_account(account_id=1)
+            await client.get_account(account_id=1)
+
+    records = []
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(fetch())
+    finally:
+        loop.close()
+
+    first, second = records
+    assert first.connect > 0
+    assert second.connect == 0
+    assert (first.status, first.bytes) == (200, 9)
+    assert first.decode >= 0 and first.transfer >= 0
+
+
+def test_latency_histogram_percentiles():
+    histogram = LatencyHistogram(buckets=(0.1, 0.2, 0.4))
+    for duration in [0.05] * 50 + [0.15] * 40 + [0.3] * 9 + [5]:
+        histogram(record(duration=duration))
+    histogram(record(endpoint='get_meter_points', duration=None, status=None))
+
+    assert histogram.endpoints == ['get_account', 'get_meter_points']
+    assert histogram.percentile('get_account', 50) == pytest.approx(0.1)
+    assert histogram.percentile('get_account', 70) == pytest.approx(0.15)
+    assert histogram.percentile('get_account', 100) == 0.4
+    assert histogram.percentile('get_meter_points', 50) is None
+    summary = histogram.summary(percents=(50,))
+    assert summary['get_account']['count'] == 100
+    assert summary['get_account']['mean'] == pytest.approx(0.162)
+    assert summary['get_meter_points'] == {
+        'count': 0, 'mean': None, 'p50': None,
+    }
+
+
+def test_prometheus_text():
+    histogram = LatencyHistogram(buckets=(0.1, 1))
+    histogram(record(duration=0.5))
+    histogram(record(duration=0.05, status=404, bytes=None))
+    histogram(record(endpoint='/SignUps/"x"', duration=2, status=None))
+
+    assert prometheus_text(histogram) == '\n'.join([
+        '# HELP ensek_request_duration_seconds ENSEK API request duration '
+        'in seconds.',
+        '# TYPE ensek_request_duration_seconds histogram',
+        'ensek_request_duration_seconds_bucket'
+        '{endpoint="/SignUps/\\"x\\"",le="0.1"} 0',
+        'ensek_request_duration_seconds_bucket'
+        '{endpoint="/SignUps/\\"x\\"",le="1.0"} 0',
+        'ensek_request_duration_seconds_bucket'
+        '{endpoint="/SignUps/\\"x\\"",le="+Inf"} 1',
+        'ensek_request_duration_seconds_sum{endpoint="/SignUps/\\"x\\""} 2',
+        'ensek_request_duration_seconds_count{endpoint="/SignUps/\\"x\\""} 1',
+        'ensek_request_duration_seconds_bucket'
+        '{endpoint="get_account",le="0.1"} 1',
+        'ensek_request_duration_seconds_bucket'
+        '{endpoint="get_account",le="1.0"} 2',
+        'ensek_request_duration_seconds_bucket'
+        '{endpoint="get_account",le="+Inf"} 2',
+        'ensek_request_duration_seconds_sum{endpoint="get_account"} 0.55',
+        'ensek_request_duration_seconds_count{endpoint="get_account"} 2',
+        '# HELP ensek_requests_total ENSEK API requests by status.',
+        '# TYPE ensek_requests_total counter',
+        'ensek_requests_total{endpoint="/SignUps/\\"x\\"",status="error"} 1',
+        'ensek_requests_total{endpoint="get_account",status="200"} 1',
+        'ensek_requests_total{endpoint="get_account",status="404"} 1',
+        '# HELP ensek_response_bytes_total ENSEK API response bytes.',
+        '# TYPE ensek_response_bytes_total counter',
+        'ensek_response_bytes_total{endpoint="/SignUps/\\"x\\""} 10',
+        'ensek_response_bytes_total{endpoint="get_account"} 10',
+    ]) + '\n'
+
+
+class FakeSpan:
+    def __init__(self, name, start_time, attributes):
+        self.name = name
+        self.start_time = start_time
+        self.attributes = attributes
+        self.exceptions = []
+        self.end_time = None
+
+    def record_exception(self, exc):
+        self.exceptions.append(exc)
+
+    def end(self, end_time):
+        self.end_time = end_time
+
+
+class FakeTracer:
+    def __init__(self):
+        self.spans = []
+
+    def start_span(self, name, *, start_time, attributes):
+        span = FakeSpan(name, start_time, attributes)
+        self.spans.append(span)
+        return span
+
+
+def test_open_telemetry_hook():
+    tracer = FakeTracer()
+    hook = OpenTelemetryHook(tracer)
+    error = LookupError('404')
+
+    hook(record(duration=0.25, wait=0.2, status=404, error=error))
+
+    span, = tracer.spans
+    assert span.name == 'ENSEK GET get_account'
+    assert span.start_time == 1500000000 * 10 ** 9
+    assert span.end_time == span.start_time + 250000000
+    assert span.attributes == {
+        'http.request.method': 'GET',
+        'http.response.status_code': 404,
+        'url.path': '/accounts/1',
+        'ensek.endpoint': 'get_account',
+        'ensek.attempt': 1,
+        'ensek.response_bytes': 10,
+        'ensek.wait': 0.2,
+    }
+    assert span.exceptions == [error]
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from ensek.jsonstream import _ArrayParser, _iter_json_array
+
+
+def chunked(text, size):
+    return [text[start:start + size] for start in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize('size', [1, 2, 7, 1000])
+def test_yields_items_of_top_level_array(size):
+    items = [1, -2.5e3, 'a "quoted" ]', None, True, [], {'a': [1, {}]}]
+    text = json.dumps(items, indent=2)
+
+    assert list(_iter_json_array(chunked(text, size))) == items
+
+
+@pytest.mark.parametrize('size', [1, 3, 1000])
+def test_yields_items_of_member_array_and_collects_the_rest(size):
+    doc = {
+        'TotalCharges': 12.5,
+        'Charges': [{'amount': num} for num in range(5)],
+        'meta': {'after': 4},
+    }
+    rest = {}
+
+    items = list(_iter_json_array(
+        chunked(json.dumps(doc), size), key='Charges', rest=rest
+    ))
+
+    assert items == doc['Charges']
+    assert rest == {'TotalCharges': 12.5, 'meta': {'after': 4}}
+
+
+@pytest.mark.parametrize('text, key', [
+    ('{"Charges": []}', None),
+    ('[1, 2', None),
+    ('[1] [2]', None),
+    ('{"TotalCharges": 0}', 'Charges'),
+    ('[]', 'Charges'),
+])
+def test_rejects_unexpected_documents(text, key):
+    with pytest.raises(ValueError):
+        list(_iter_json_array(chunked(text, 3), key=key))
+
+
+def test_memory_use_does_not_grow_with_the_response():
+    parser = _ArrayParser()
+    item = json.dumps({'registerId': 1, 'value': 1.5, 'id': 'x' * 100})
+    chunk = '[' + ','.join([item] * 500)
+    largest_buffer = count = 0
+    for _ in range(100):
+        count += len(parser.feed(chunk))
+        largest_buffer = max(largest_buffer, len(parser._buffer))
+        chunk = ',' + chunk[1:]
+    count += len(parser.feed(']'))
+    parser.close()
+
+    assert count == 50000
+    assert largest_buffer < 2 * len(chunk)
@@ -0,0 +1,128 @@
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from ensek import (
+    Ensek, Account, Address, MeterPoint, Reading, RegisterReading, Signup,
+    parse_datetime,
+)
+from ensek.aio import AsyncEnsek
+
+from .fake_server import FakeEnsekServer
+
+ENSEK_API_KEY = os.environ['ENSEK_API_KEY']
+
+READING = {
+    'id': 11108,
+    'readingType': 'Actual',
+    'meterPointId': 0,
+    'dateTime': '2018-07-30T00:00:00',
+    'createdDate': '2018-07-30T12:58:53.237',
+    'readings': [{'id': 11148, 'registerId': 1496, 'value': 2.0}],
+    'meterReadingSource': 'SMART',
+}
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('2017-10-09T17:15:47.3', datetime(2017, 10, 9, 17, 15, 47, 300000)),
+    ('0001-01-01T00:00:00', datetime(1, 1, 1)),
+    (
+        '2018-07-30T12:58:53.2371234Z',
+        datetime(2018, 7, 30, 12, 58, 53, 237123, tzinfo=timezone.utc),
+    ),
+    (
+        '2018-07-30T12:58:53-01:30',
+        datetime(
+            2018, 7, 30, 12, 58, 53,
+            tzinfo=timezone(-timedelta(hours=1, minutes=30)),
+        ),
+    ),
+])
+def test_parse_datetime(value, expected):
+    assert parse_datetime(value) == expected
+
+
+def test_fields_are_snake_case_and_converted_on_first_access():
+    reading = Reading(READING)
+
+    assert reading._date_time == '2018-07-30T00:00:00'
+    assert reading._readings == READING['readings']
+    assert reading.date_time == datetime(2018, 7, 30)
+    assert reading.readings == (
+        RegisterReading({'id': 11148, 'registerId': 1496, 'value': 2.0}),
+    )
+    assert reading.readings[0].register_id == 1496
+    assert reading.readings is reading.readings
+    assert reading.meter_reading_source == 'SMART'
+
+
+def test_missing_and_unknown_keys():
+    account = Account({'id': 1507, '$type': 'Account', 'siteAddress': None})
+
+    assert account.site_address is None
+    assert account.external_reference is None
+    assert account.extra == {'$type': 'Account'}
+
+
+def test_models_are_compact_and_read_only():
+    signup = Signup({'accountId': 1513, 'createdDateTime': None})
+
+    assert not hasattr(signup, '__dict__')
+    with pytest.raises(AttributeError):
+        signup.account_id = 1
+    assert repr(signup) == 'Signup(account_id=1513, created_date_time=None)'
+
+
+def test_client_returns_models_when_asked_to():
+    with FakeEnsekServer(routes={
+        '/accounts/1507': (200, {
+            'id': 1507, 'siteAddress': {'postcode': 'NG7 5EB'},
+        }),
+        '/Accounts/1507/MeterPoints': (200, [{'id': 1597, 'meters': []}]),
+        '/MeterPoints/1597/Readings': (200, [READING]),
+        '/SignUps/Completed': (200, {'results': [
+            {'accountId': 1507, 'createdDateTime': '2017-10-09T10:55:37.543'},
+        ]}),
+        '/SignUps/Completed?after=1507': (200, {'results': []}),
+    }) as server, Ensek(
+        api_url=server.url, api_key=ENSEK_API_KEY, models=True
+    ) as client:
+        account = client.get_account(account_id=1507)
+        meter_points = client.get_meter_points(account_id=1507)
+        readings = list(client.stream(
+            'get_meter_point_readings', meter_point_id=1597
+        ))
+        signups = list(client.iter_completed_signups())
+        account_ids = client.get_all_account_ids()
+        attributes = client.get_account_attributes(account_id=1507)
+
+    assert account.site_address == Address({'postcode': 'NG7 5EB'})
+    assert meter_points == [MeterPoint({'id': 1597, 'meters': []})]
+    assert readings == [Reading(READING)]
+    assert signups[0].created_date_time == datetime(
+        2017, 10, 9, 10, 55, 37, 543000
+    )
+    assert account_ids == {1507}
+    # Endpoints without a model still return plain JSON
+    assert attributes == {'path': '/accounts/1507/Attributes'}
+
+
+def test_async_client_returns_models_when_asked_to():
+    async def fetch():
+        async with AsyncEnsek(
+            api_url=server.url, api_key=ENSEK_API_KEY, models=True
+        ) as client:
+            return await client.get_meter_point_readings(meter_point_id=1597)
+
+    with FakeEnsekServer(routes={
+        '/MeterPoints/1597/Readings': (200, [READING]),
+    }) as server:
+        loop = asyncio.new_event_loop()
+        try:
+            readings = loop.run_until_complete(fetch())
+        finally:
+            loop.close()
+
+    assert readings == [Reading(READING)]
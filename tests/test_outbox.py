@@ -0,0 +1,214 @@
+import json
+import sqlite3
+import time
+from datetime import datetime
+
+import pytest
+
+from ensek import Outbox
+
+
+def reading(value, account_id=1, meter_point_id=10):
+    return {
+        'account_id': account_id, 'meter_point_id': meter_point_id,
+        'register_id': 100, 'value': value,
+        'timestamp': datetime(2018, 7, 30, value), 'source': 'SMART',
+    }
+
+
+def posted_values(server, account_id=None):
+    return [
+        [entry['readings'][0]['value'] for entry in request.body]
+        for request in server.requests if request.method == 'POST' and (
+            account_id is None or
+            request.path == f'/Accounts/{account_id}/Readings'
+        )
+    ]
+
+
+@pytest.fixture
+def routes():
+    return {
+        'POST /Accounts/1/Readings': (200, {}),
+        'POST /Accounts/2/Readings': (200, {}),
+        'PUT /accounts/1/Attributes': (200, b''),
+    }
+
+
+def test_writes_are_spooled_and_flushed_in_batches(server, client, clock):
+    with Outbox(client, clock=clock) as outbox:
+        for value in range(3):
+            outbox.create_meter_reading(**reading(value))
+        outbox.create_meter_reading(**reading(5, account_id=2))
+        clock.now += 30
+
+        assert server.requests == []
+        assert outbox.metrics['depth'] == 4
+        assert outbox.metrics['lag'] == 30
+        assert outbox.flush() == 4
+        assert outbox.metrics == {
+            'sent': 4, 'retried': 0, 'spooled': 4, 'depth': 0, 'lag': 0,
+            'failed': 0,
+        }
+
+    assert sorted(posted_values(server)) == [[0, 1, 2], [5]]
+
+
+def test_spooled_writes_survive_a_restart(tmp_path, server, client):
+    path = tmp_path / 'outbox.db'
+    with Outbox(client, path) as outbox:
+        outbox.create_meter_reading(**reading(1))
+        outbox.update_account_attribute(
+            account_id=1, name='PaymentType', value='DD', type='string',
+        )
+    with Outbox(client, path) as outbox:
+        assert len(outbox) == 2
+        assert outbox.flush() == 2
+
+    assert posted_values(server) == [[1]]
+    assert server.requests[-1].method == 'PUT'
+
+
+def test_duplicate_keys_are_spooled_once(server, client):
+    with Outbox(client) as outbox:
+        key = outbox.create_meter_reading(key='reading-1', **reading(1))
+        outbox.create_meter_reading(key='reading-1', **reading(1))
+        assert key == 'reading-1'
+        assert len(outbox) == 1
+
+
+def test_server_errors_are_retried_in_order(server, client, clock):
+    responses = iter([(500, {'error': 'down'})])
+    server.routes['POST /Accounts/1/Readings'] = (
+        lambda request: next(responses, (200, {}))
+    )
+    with Outbox(client, clock=clock, batch_size=1, retry_wait=10) as outbox:
+        outbox.create_meter_reading(**reading(1))
+        outbox.create_meter_reading(**reading(2))
+        outbox.create_meter_reading(**reading(3, account_id=2))
+
+        assert outbox.flush() == 1
+        assert outbox.metrics['retried'] == 1
+        # The account's next reading waits for the one being retried
+        assert outbox.flush() == 0
+        clock.now += 10
+        assert outbox.flush() == 1
+        assert outbox.flush() == 1
+
+    # Accounts are sent concurrently, so only their own order is defined
+    assert posted_values(server, account_id=1) == [[1], [1], [2]]
+    assert posted_values(server, account_id=2) == [[3]]
+
+
+def test_accounts_backing_off_dont_hold_others_up(server, client, clock):
+    server.routes['POST /Accounts/1/Readings'] = (500, {'error': 'down'})
+    with Outbox(
+        client, clock=clock, batch_size=10, concurrency=2, retry_wait=10,
+    ) as outbox:
+        # More than the rows one flush looks at
+        for value in range(200):
+            outbox.create_meter_reading(**reading(value % 24))
+        for value in range(5):
+            outbox.create_meter_reading(**reading(value, account_id=2))
+
+        # Account 1's first batch fails, and fills the window
+        assert outbox.flush() == 0
+        assert outbox.flush() == 5
+        assert outbox.flush() == 0
+
+    assert posted_values(server, account_id=1) == [list(range(10))]
+    assert posted_values(server, account_id=2) == [list(range(5))]
+
+
+def test_rejected_writes_are_kept_as_failed(server, client):
+    server.routes['PUT /accounts/1/Attributes'] = (400, {'error': 'bad'})
+    with Outbox(client) as outbox:
+        key = outbox.update_account_attribute(
+            account_id=1, name='PaymentType', value='DD', type='string',
+        )
+        assert outbox.flush() == 0
+        failed, = outbox.failed()
+        assert (failed.key, failed.kind, failed.attempts) == (
+            key, 'attribute', 1,
+        )
+        assert failed.params['value'] == 'DD'
+        assert outbox.metrics['failed'] == 1
+
+        server.routes['PUT /accounts/1/Attributes'] = (200, b'')
+        outbox.requeue_failed()
+        assert outbox.flush() == 1
+        assert outbox.failed() == []
+
+
+def test_invalid_writes_are_refused_when_spooled(client):
+    with Outbox(client) as outbox:
+        with pytest.raises(ValueError):
+            outbox.create_meter_reading(**dict(reading(1), value='abc'))
+        with pytest.raises(ValueError):
+            outbox.create_meter_reading(**dict(reading(1), timestamp=None))
+        with pytest.raises(ValueError):
+            outbox.update_account_attribute(
+                account_id='abc', name='PaymentType', value='DD',
+                type='string',
+            )
+        with pytest.raises(TypeError):
+            outbox.update_account_attribute(account_id=1, name='PaymentType')
+
+        assert len(outbox) == 0
+
+
+def test_unsendable_entries_fail_on_their_own(tmp_path, server, client):
+    # e.g. spooled to the file by an older version that didn't check them
+    path = tmp_path / 'outbox.db'
+    with Outbox(client, path) as outbox:
+        outbox.create_meter_reading(**reading(1))
+        outbox.create_meter_reading(**reading(2))
+        outbox.update_account_attribute(
+            account_id=1, name='PaymentType', value='DD', type='string',
+        )
+    with sqlite3.connect(str(path)) as conn:
+        conn.executemany('UPDATE entries SET params = ? WHERE id = ?', [
+            (json.dumps(dict(
+                reading(1), value='abc', timestamp='2018-07-30T01:00:00',
+            )), 1),
+            (json.dumps({'account_id': 1, 'value': 'DD'}), 3),
+        ])
+
+    with Outbox(client, path) as outbox:
+        assert outbox.flush() == 1
+        assert len(outbox) == 0
+        assert sorted(entry.id for entry in outbox.failed()) == [1, 3]
+        assert outbox.flush() == 0
+
+    assert posted_values(server) == [[2]]
+
+
+def test_attribute_updates_are_sent_together(server, client):
+    with Outbox(client) as outbox:
+        for value in ('DD', 'Card'):
+            outbox.update_account_attribute(
+                account_id=1, name='PaymentType', value=value, type='string',
+            )
+        outbox.update_account_attribute(
+            account_id=1, name='Plan', value='Fixed', type='string',
+        )
+        assert outbox.flush() == 3
+
+    request, = server.requests
+    assert [
+        (attribute['name'], attribute['value'])
+        for attribute in request.body['updatedAttributes']
+    ] == [('PaymentType', 'Card'), ('Plan', 'Fixed')]
+
+
+def test_background_flusher(server, client):
+    outbox = Outbox(client, flush_interval=0.01).start()
+    try:
+        outbox.create_meter_reading(**reading(1))
+        deadline = time.monotonic() + 5
+        while len(outbox) and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        outbox.close()
+
+    assert posted_values(server) == [[1]]
@@ -0,0 +1,91 @@
+import pytest
+
+from ensek import PostcodeIndex, normalise_postcode
+
+
+@pytest.fixture
+def routes():
+    return {
+        '/Regions/SE14YU': (200, 12),
+        '/Regions/E10PS': (200, 12),
+        '/Regions/ME145SX': (200, 19),
+        '/Regions/N11AA': (404, {}),
+        '/PostcodeLookups?postcode=SE14YU': (200, [{'postcode': 'SE1 4YU'}]),
+    }
+
+
+@pytest.mark.parametrize('postcode', [
+    'SE1 4YU', 'se14yu', ' se1  4yu\n', 'SE14YU',
+])
+def test_normalise_postcode(postcode):
+    assert normalise_postcode(postcode) == 'SE14YU'
+
+
+@pytest.mark.parametrize('postcode', ['', 'SE1', 'SE1 4YU X', '../x'])
+def test_normalise_postcode_rejects_invalid_postcodes(postcode):
+    with pytest.raises(ValueError):
+        normalise_postcode(postcode)
+
+
+def test_index_fetches_misses_once(server, client):
+    with PostcodeIndex(client) as index:
+        assert index.region_id('se1 4yu') == 12
+        assert index.region_id('SE14YU') == 12
+        assert index.addresses('SE1 4YU') == [{'postcode': 'SE1 4YU'}]
+        with pytest.raises(LookupError):
+            index.region_id('N1 1AA')
+
+    assert [request.path for request in server.requests] == [
+        '/Regions/SE14YU', '/PostcodeLookups?postcode=SE14YU',
+        '/Regions/N11AA',
+    ]
+
+
+def test_index_persists_entries(tmp_path, server, client):
+    path = tmp_path / 'postcodes.db'
+    with PostcodeIndex(client, path) as index:
+        index.region_id('SE1 4YU')
+    with PostcodeIndex(client, path) as index:
+        assert len(index) == 1
+        assert index.region_id('se14yu') == 12
+
+    assert len(server.requests) == 1
+
+
+def test_index_refreshes_stale_entries_in_the_background(
+    server, client, clock
+):
+    with PostcodeIndex(client, max_age=60, clock=clock) as index:
+        index.region_id('SE1 4YU')
+        server.routes['/Regions/SE14YU'] = (200, 13)
+        clock.now += 61
+        # The stale value is served while the refresh is in flight
+        assert index.region_id('SE1 4YU') == 12
+        index._refresher.shutdown(wait=True)
+        assert index.region_id('SE1 4YU') == 13
+
+    assert len(server.requests) == 2
+
+
+def test_warm_fetches_missing_postcodes(server, client):
+    with PostcodeIndex(client) as index:
+        index.region_id('SE1 4YU')
+        errors = index.warm(
+            ['se1 4yu', 'E1 0PS', 'me14 5sx', 'e10ps', 'N1 1AA', 'nope'],
+            lookups=['region_id'], concurrency=2,
+        )
+        assert index.region_id('ME14 5SX') == 19
+
+    assert sorted(errors) == [('region_id', 'N11AA'), ('region_id', 'nope')]
+    assert isinstance(errors['region_id', 'N11AA'], LookupError)
+    assert isinstance(errors['region_id', 'nope'], ValueError)
+    assert sorted(request.path for request in server.requests[1:]) == [
+        '/Regions/E10PS', '/Regions/ME145SX', '/Regions/N11AA',
+    ]
+    assert server.max_in_flight <= 2
+
+
+def test_warm_rejects_unknown_lookups(client):
+    with PostcodeIndex(client) as index:
+        with pytest.raises(ValueError):
+            index.warm(['SE1 4YU'], lookups=['uprn'])
@@ -0,0 +1,111 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+from ensek import Ensek, EnsekError, RateLimiter
+from ensek.ratelimit import _retry_after_seconds
+
+from .fake_server import FakeEnsekServer
+
+ENSEK_API_KEY = os.environ['ENSEK_API_KEY']
+
+
+def limiter_factory(clock, **kwargs):
+    return RateLimiter(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def acquire(limiter, times):
+    for _ in range(times):
+        with limiter.limit():
+            pass
+
+
+def test_requests_are_spaced_out_to_the_rate(clock):
+    limiter = limiter_factory(clock, rate=2, burst=1)
+
+    acquire(limiter, 5)
+
+    assert clock.now == pytest.approx(2)
+
+
+def test_burst_lets_requests_through_straight_away(clock):
+    limiter = limiter_factory(clock, rate=1, burst=5)
+
+    acquire(limiter, 5)
+    assert clock.sleeps == []
+
+    acquire(limiter, 1)
+    assert clock.now == pytest.approx(1)
+
+
+def test_defer_pauses_all_requests(clock):
+    limiter = limiter_factory(clock)
+    limiter.defer(30)
+    limiter.defer(10)
+
+    acquire(limiter, 2)
+
+    assert clock.sleeps == [30]
+
+
+@pytest.mark.parametrize('value, expected', [
+    (None, None),
+    ('', None),
+    ('120', 120),
+    ('-1', 0),
+    ('soon', None),
+])
+def test_retry_after_seconds(value, expected):
+    assert _retry_after_seconds(value) == expected
+
+
+def test_retry_after_http_date():
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=60)
+
+    seconds = _retry_after_seconds(format_datetime(retry_at, usegmt=True))
+
+    assert 58 < seconds <= 60
+
+
+def test_client_caps_requests_in_flight():
+    limiter = RateLimiter(max_in_flight=3)
+    with FakeEnsekServer(latency=0.05) as server, Ensek(
+        api_url=server.url, api_key=ENSEK_API_KEY, rate_limiter=limiter
+    ) as client:
+        results = list(client.get_many(
+            'get_account',
+            [{'account_id': account_id} for account_id in range(12)],
+            concurrency=10,
+        ))
+
+    assert all(result.error is None for result in results)
+    assert server.max_in_flight == 3
+
+
+def test_client_honours_retry_after():
+    limiter = RateLimiter()
+    with FakeEnsekServer(routes={
+        '/accounts/1507': (429, {}, {'Retry-After': '0.2'}),
+    }) as server, Ensek(
+        api_url=server.url, api_key=ENSEK_API_KEY, retry_count=2,
+        retry_wait=0.01, rate_limiter=limiter,
+    ) as client:
+        start = time.monotonic()
+        with pytest.raises(EnsekError):
+            client.get_account(account_id=1507)
+        elapsed = time.monotonic() - start
+
+    assert len(server.requests) == 2
+    assert elapsed >= 0.2
+    assert client.metrics['throttled'] == 2
+
+
+def test_too_many_requests_raises_ensek_error():
+    with FakeEnsekServer(routes={
+        '/accounts/1507': (429, {}),
+    }) as server, Ensek(api_url=server.url, api_key=ENSEK_API_KEY) as client:
+        with pytest.raises(EnsekError):
+            client.get_account(account_id=1507)
@@ -0,0 +1,136 @@
+import io
+import os
+
+import pytest
+
+from ensek import Ensek, Reading
+
+from .fake_server import FakeEnsekServer
+
+np = pytest.importorskip('numpy')
+from ensek.readings import ColumnTable, ReadingCollection  # noqa: E402
+
+ENSEK_API_KEY = os.environ['ENSEK_API_KEY']
+
+
+def reading(id_, date_time, *registers, source='SMART'):
+    return {
+        'id': id_,
+        'readingType': 'Actual',
+        'meterPointId': 0,
+        'dateTime': date_time,
+        'createdDate': '2018-07-30T12:58:53.237',
+        'readings': [
+            {'id': id_ * 10 + num, 'registerId': register_id, 'value': value}
+            for num, (register_id, value) in enumerate(registers)
+        ],
+        'meterReadingSource': source,
+    }
+
+
+READINGS = [
+    reading(2, '2018-08-30T00:00:00', (1496, 150.5), (1497, 40.0)),
+    reading(1, '2018-07-30T00:00:00.1234567', (1496, 100.0), (1497, 30.0)),
+    reading(3, '2018-09-30T00:00:00', (1496, 175.0), source='CUSTOMER'),
+]
+
+
+def test_readings_are_stored_in_typed_columns():
+    readings = ReadingCollection().add(1597, READINGS)
+    table = readings.table
+
+    assert len(readings) == len(table) == 5
+    assert table['meter_point_id'].tolist() == [1597] * 5
+    assert table['reading_id'].tolist() == [2, 2, 1, 1, 3]
+    assert table['register_id'].tolist() == [1496, 1497, 1496, 1497, 1496]
+    assert table['value'].dtype == np.float64
+    assert table['timestamp'].dtype == np.dtype('datetime64[us]')
+    assert table['timestamp'][2] == np.datetime64('2018-07-30T00:00:00.123456')
+    assert table['source'].tolist()[-2:] == ['SMART', 'CUSTOMER']
+
+
+def test_models_and_offsets_are_converted_to_naive_utc():
+    readings = ReadingCollection()
+    readings.add(1, [Reading(READINGS[0])])
+    readings.add(2, [reading(4, '2018-07-30T01:30:00+01:00', (1, 2.0))])
+    readings.add(3, [reading(5, '2018-07-30T00:00:00Z', (1, 3.0))])
+
+    assert readings.table['timestamp'].tolist() == [
+        np.datetime64('2018-08-30T00:00:00', 'us').item(),
+        np.datetime64('2018-08-30T00:00:00', 'us').item(),
+        np.datetime64('2018-07-30T00:30:00', 'us').item(),
+        np.datetime64('2018-07-30T00:00:00', 'us').item(),
+    ]
+
+
+def test_consumption_between_consecutive_reads_of_each_register():
+    readings = ReadingCollection()
+    readings.add(1597, READINGS)
+    readings.add(1598, [reading(4, '2018-08-01T00:00:00', (1496, 7.0))])
+    readings.add(1598, [reading(5, '2018-09-01T00:00:00', (1496, 9.5))])
+
+    consumption = readings.consumption()
+
+    assert consumption['meter_point_id'].tolist() == [1597, 1597, 1597, 1598]
+    assert consumption['register_id'].tolist() == [1496, 1496, 1497, 1496]
+    assert consumption['consumption'].tolist() == [50.5, 24.5, 10.0, 2.5]
+    assert consumption['start'][0] == np.datetime64(
+        '2018-07-30T00:00:00.123456'
+    )
+    assert consumption['end'][0] == np.datetime64('2018-08-30T00:00:00')
+
+
+def test_empty_collection():
+    readings = ReadingCollection().add(1597, [])
+
+    assert len(readings) == 0
+    assert len(readings.consumption()) == 0
+    assert readings.table['timestamp'].dtype == np.dtype('datetime64[us]')
+
+
+def test_to_csv():
+    table = ColumnTable({
+        'register_id': np.array([1496, 1497]),
+        'timestamp': np.array(
+            ['2018-07-30T00:00:00', 'NaT'], dtype='datetime64[us]'
+        ),
+        'value': np.array([2.5, 3.0]),
+    })
+    out = io.StringIO()
+
+    table.to_csv(out)
+
+    assert out.getvalue().splitlines() == [
+        'register_id,timestamp,value',
+        '1496,2018-07-30T00:00:00.000000,2.5',
+        '1497,,3.0',
+    ]
+
+
+def test_to_arrow_and_parquet(tmpdir):
+    pyarrow = pytest.importorskip('pyarrow')
+    import pyarrow.parquet
+    table = ReadingCollection().add(1597, READINGS).table
+
+    arrow = table.to_arrow()
+    path = str(tmpdir.join('readings.parquet'))
+    table.to_parquet(path)
+
+    assert arrow.schema.field('timestamp').type == pyarrow.timestamp('us')
+    assert arrow.column('value').to_pylist() == table['value'].tolist()
+    assert pyarrow.parquet.read_table(path).equals(arrow)
+
+
+def test_fetch_many_meter_points():
+    with FakeEnsekServer(routes={
+        '/MeterPoints/1/Readings': (200, READINGS[:1]),
+        '/MeterPoints/2/Readings': (200, READINGS[1:]),
+        '/MeterPoints/3/Readings': (404, {}),
+    }) as server, Ensek(api_url=server.url, api_key=ENSEK_API_KEY) as client:
+        readings = ReadingCollection().fetch(client, [1, 2, 3])
+
+    assert sorted(readings.table['meter_point_id'].tolist()) == [
+        1, 1, 2, 2, 2,
+    ]
+    assert list(readings.errors) == [3]
+    assert isinstance(readings.errors[3], LookupError)
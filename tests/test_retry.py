@@ -0,0 +1,160 @@
+import os
+from datetime import datetime, timezone
+
+import pytest
+
+from ensek import Ensek, EnsekError, RetryPolicy
+
+from .fake_server import FakeEnsekServer
+
+ENSEK_API_KEY = os.environ['ENSEK_API_KEY']
+
+
+@pytest.fixture
+def policy_factory(clock):
+    def factory(**kwargs):
+        kwargs = {
+            'clock': clock, 'sleep': clock.sleep, 'random': lambda: 1,
+            **kwargs,
+        }
+        return RetryPolicy(**kwargs)
+    return factory
+
+
+def waits(policy, method='get', started_at=0):
+    result = []
+    attempt = 1
+    while True:
+        wait = policy.next_wait(
+            method=method, attempt=attempt, started_at=started_at
+        )
+        if wait is None:
+            return result
+        result.append(wait)
+        policy.sleep(wait)
+        attempt += 1
+
+
+def test_waits_grow_exponentially_up_to_max_wait(policy_factory):
+    policy = policy_factory(max_attempts=6, base_wait=0.5, max_wait=3)
+
+    assert waits(policy) == [0.5, 1, 2, 3, 3]
+
+
+def test_waits_are_jittered(policy_factory):
+    policy = policy_factory(max_attempts=3, base_wait=1, random=lambda: 0.25)
+
+    assert waits(policy) == [0.25, 0.5]
+
+
+def test_gives_up_before_passing_the_deadline(policy_factory):
+    policy = policy_factory(max_attempts=10, base_wait=1, deadline=5)
+
+    assert waits(policy) == [1, 2]
+
+
+@pytest.mark.parametrize('method, retry_non_idempotent, expected', [
+    ('get', False, [0.1, 0.2]),
+    ('put', False, [0.1, 0.2]),
+    ('post', False, []),
+    ('post', True, [0.1, 0.2]),
+])
+def test_only_retries_idempotent_methods_by_default(
+    policy_factory, method, retry_non_idempotent, expected
+):
+    policy = policy_factory(retry_non_idempotent=retry_non_idempotent)
+
+    assert waits(policy, method=method) == pytest.approx(expected)
+
+
+def test_retries_are_limited_by_the_budget(policy_factory):
+    policy = policy_factory(
+        max_attempts=2, budget_ratio=0.25, budget_reserve=3
+    )
+
+    assert sum(len(waits(policy)) for _ in range(10)) == 3
+
+    for _ in range(4):
+        policy.record_request()
+    assert len(waits(policy)) == 1
+    assert waits(policy) == []
+
+
+def test_waits_without_jitter_or_budget(policy_factory):
+    policy = policy_factory(
+        max_attempts=20, base_wait=1, jitter=False, budget_ratio=None,
+        random=lambda: 0.25,
+    )
+
+    assert waits(policy) == [1, 2, 4, 8, 10] + [10] * 14
+
+
+def test_retry_count_keeps_the_legacy_behaviour():
+    with FakeEnsekServer(routes={
+        '/Accounts/1507/Readings': (503, {}),
+    }) as server, Ensek(
+        api_url=server.url, api_key=ENSEK_API_KEY, retry_count=3,
+        retry_wait=0.05,
+    ) as client:
+        policy = client._retry_policy
+        with pytest.raises(EnsekError):
+            client.create_meter_reading(
+                account_id=1507, meter_point_id=1597, register_id=1496,
+                value=2.0, timestamp=datetime.now(timezone.utc),
+            )
+
+    # POSTs are retried too, always `retry_wait` apart
+    assert len(server.requests) == 3
+    assert waits(policy, method='post') == [0.05, 0.05]
+    assert waits(policy) == [0.05, 0.05]
+
+
+def test_policy_cannot_be_combined_with_retry_count():
+    with pytest.raises(ValueError):
+        Ensek(
+            api_url='https://its.mocked', api_key=ENSEK_API_KEY,
+            retry_count=3, retry_wait=1, retry_policy=RetryPolicy(),
+        )
+
+
+@pytest.mark.parametrize('retry_non_idempotent, expected_requests', [
+    (False, 1),
+    (True, 3),
+])
+def test_client_only_retries_posts_when_asked_to(
+    retry_non_idempotent, expected_requests
+):
+    policy = RetryPolicy(
+        base_wait=0.01, retry_non_idempotent=retry_non_idempotent
+    )
+    with FakeEnsekServer(routes={
+        '/Accounts/1507/Readings': (503, {}),
+    }) as server, Ensek(
+        api_url=server.url, api_key=ENSEK_API_KEY, retry_policy=policy
+    ) as client:
+        with pytest.raises(EnsekError):
+            client.create_meter_reading(
+                account_id=1507, meter_point_id=1597, register_id=1496,
+                value=2.0, timestamp=datetime.now(timezone.utc),
+            )
+
+    assert len(server.requests) == expected_requests
+
+
+def test_client_retries_share_one_budget():
+    policy = RetryPolicy(
+        max_attempts=5, base_wait=0.001, budget_ratio=0.25, budget_reserve=2
+    )
+    with FakeEnsekServer(routes={
+        f'/accounts/{num}': (500, {}) for num in range(20)
+    }) as server, Ensek(
+        api_url=server.url, api_key=ENSEK_API_KEY, retry_policy=policy
+    ) as client:
+        for num in range(20):
+            with pytest.raises(EnsekError):
+                client.get_account(account_id=num)
+
+    # The reserve pays for the first 2 retries; after that each request
+    # earns a quarter of a retry
+    assert client.metrics['retries'] == 6
+    assert len(server.requests) == 26
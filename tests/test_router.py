@@ -0,0 +1,96 @@
+from string import Template
+
+import pytest
+
+from ensek import Ensek
+from ensek.router import _Route
+
+from .fake_server import FakeEnsekServer
+
+ENSEK_API_URL = 'http://localhost'
+
+
+def test_route_builds_path_and_camelcased_params():
+    route = _Route(
+        'get_tariffs', Template('/Accounts/$account_id/Tariffs/${kind}s'),
+        query_params=('include_history',),
+    )
+
+    assert route.build({
+        'account_id': 1, 'kind': 'gas', 'include_history': True,
+    }) == ('/Accounts/1/Tariffs/gass', {'includeHistory': True})
+    assert route.path(account_id=2, kind='elec') == '/Accounts/2/Tariffs/elecs'
+    assert route.placeholders == {'account_id', 'kind'}
+
+
+def test_route_moves_template_query_into_params():
+    route = _Route('get_addresses', '/PostcodeLookups?postcode=$postcode')
+
+    assert route.build({'postcode': 'SE1 4YU'}) == (
+        '/PostcodeLookups', {'postcode': 'SE1 4YU'},
+    )
+    with pytest.raises(ValueError):
+        _Route('get_addresses', '/PostcodeLookups?postcode=SE1')
+
+
+def test_route_validates_arguments():
+    strict = _Route('get_account', '/accounts/$account_id', query_params=())
+    loose = _Route('get_account', '/accounts/$account_id')
+
+    with pytest.raises(TypeError, match="missing required argument"):
+        strict.build({})
+    with pytest.raises(TypeError, match="unexpected argument 'acount_id'"):
+        strict.build({'account_id': 1, 'acount_id': 1})
+    assert loose.build({'account_id': 1, 'page_size': 5}) == (
+        '/accounts/1', {'pageSize': 5},
+    )
+
+
+def test_escaped_delimiters_are_kept():
+    route = _Route('get_price', '/prices/$$$currency')
+
+    assert route.path(currency='GBP') == '/prices/$GBP'
+
+
+def test_client_sends_postcode_as_query_param():
+    with FakeEnsekServer(routes={
+        '/PostcodeLookups': (200, []),
+    }) as server, Ensek(api_url=server.url, api_key='key') as client:
+        client.get_addresses_at_postcode(postcode='se1 4yu')
+        with pytest.raises(ValueError):
+            client.get_addresses_at_postcode(postcode='SE1 4YU&x=1')
+        with pytest.raises(TypeError):
+            client.get_account(account_id=1, include_history=True)
+
+    request, = server.requests
+    assert request.path == '/PostcodeLookups?postcode=SE14YU'
+
+
+def test_route_converts_arguments():
+    route = _Route(
+        'get_region', '/Regions/$postcode', query_params=('name',),
+        converters={'postcode': str.upper, 'name': str.title, 'x': int},
+    )
+
+    assert route.build({'postcode': 'se1', 'name': 'ann'}) == (
+        '/Regions/SE1', {'name': 'Ann'},
+    )
+
+
+def test_subclass_endpoints_are_compiled():
+    class MyEnsek(Ensek):
+        ENDPOINTS = {
+            **Ensek.ENDPOINTS,
+            'get_account_notes': Template('/Accounts/$account_id/Notes'),
+        }
+        QUERY_PARAMS = {
+            **Ensek.QUERY_PARAMS,
+            'get_account_notes': ('page_size',),
+        }
+
+    client = MyEnsek(api_url=ENSEK_API_URL, api_key='key')
+
+    assert client._endpoint_request(
+        'get_account_notes', account_id=1, page_size=10
+    ) == ('/Accounts/1/Notes', {'pageSize': 10})
+    assert 'get_account_notes' not in Ensek._routes
@@ -0,0 +1,164 @@
+import pytest
+
+from ensek import AccountSync, ChangeEvent, SnapshotStore
+
+RESOURCES = ('get_account', 'get_account_attributes')
+
+
+@pytest.fixture
+def routes():
+    return {
+        '/SignUps/Completed': (200, {'results': [
+            {'accountId': 1, 'createdDateTime': None},
+            {'accountId': 2, 'createdDateTime': None},
+        ]}),
+        '/SignUps/Completed?after=2': (200, {'results': []}),
+        '/accounts/1': (200, {'id': 1, 'externalReference': 'A'}),
+        '/accounts/2': (200, {'id': 2, 'externalReference': 'B'}),
+        '/accounts/1/Attributes': (200, [{'name': 'x', 'value': '1'}]),
+        '/accounts/2/Attributes': (404, {}),
+    }
+
+
+def test_first_run_adds_every_completed_signup(client, clock):
+    store = SnapshotStore()
+    sync = AccountSync(
+        client, store, resources=RESOURCES, concurrency=1, clock=clock,
+    )
+
+    events = sorted(sync.run())
+
+    assert events == [
+        ChangeEvent(1, 'get_account', 'added', None, {
+            'id': 1, 'externalReference': 'A',
+        }),
+        ChangeEvent(1, 'get_account_attributes', 'added', None, [
+            {'name': 'x', 'value': '1'},
+        ]),
+        ChangeEvent(2, 'get_account', 'added', None, {
+            'id': 2, 'externalReference': 'B',
+        }),
+    ]
+    assert store.cursor == 2
+    assert len(store) == 2
+    assert store.get(2) == {'get_account': {'id': 2, 'externalReference': 'B'}}
+    assert sync.stats == {
+        'signups': 2, 'accounts': 2, 'changed': 2, 'unchanged': 0,
+        'failed': 0,
+    }
+
+
+def test_hot_resync_only_fetches_new_signups_and_due_accounts(
+    server, client, clock
+):
+    sync = AccountSync(
+        client, SnapshotStore(), resources=RESOURCES, refresh_interval=100,
+        clock=clock,
+    )
+    list(sync.run())
+    server.requests.clear()
+
+    clock.now = 50
+    assert list(sync.run()) == []
+    assert [request.path for request in server.requests] == [
+        '/SignUps/Completed?after=2',
+    ]
+
+    server.routes['/SignUps/Completed?after=2'] = (200, {'results': [
+        {'accountId': 3, 'createdDateTime': None},
+    ]})
+    server.routes['/SignUps/Completed?after=3'] = (200, {'results': []})
+    server.routes['/accounts/3'] = (200, {'id': 3})
+    server.routes['/accounts/3/Attributes'] = (200, [])
+    server.requests.clear()
+
+    events = list(sync.run())
+
+    assert {(event.account_id, event.kind) for event in events} == {
+        (3, 'added'),
+    }
+    assert len(server.requests) == 4
+
+
+def test_changes_and_removals_are_reported(server, client, clock):
+    store = SnapshotStore()
+    sync = AccountSync(
+        client, store, resources=RESOURCES, refresh_interval=100,
+        clock=clock,
+    )
+    list(sync.run())
+    # Only the key order differs, which isn't a change
+    server.routes['/accounts/1'] = (200, {'externalReference': 'A', 'id': 1})
+    server.routes['/accounts/2'] = (200, {'id': 2, 'externalReference': 'D'})
+    server.routes['/accounts/1/Attributes'] = (404, {})
+
+    clock.now = 100
+    events = sorted(sync.run())
+
+    assert events == [
+        ChangeEvent(1, 'get_account_attributes', 'removed', [
+            {'name': 'x', 'value': '1'},
+        ], None),
+        ChangeEvent(2, 'get_account', 'changed', {
+            'id': 2, 'externalReference': 'B',
+        }, {
+            'id': 2, 'externalReference': 'D',
+        }),
+    ]
+    assert set(store.get(1)) == {'get_account'}
+
+
+def test_quiet_accounts_are_refreshed_less_often(client, clock):
+    store = SnapshotStore()
+    sync = AccountSync(
+        client, store, resources=RESOURCES, refresh_interval=100,
+        max_refresh_interval=300, clock=clock,
+    )
+    list(sync.run())
+
+    for now, interval in [(100, 200), (300, 300), (600, 300)]:
+        clock.now = now
+        list(sync.run())
+        assert sync.stats['accounts'] == 2
+        assert store.interval(1) == interval
+
+
+def test_failed_accounts_stay_due(server, client, clock):
+    store = SnapshotStore()
+    sync = AccountSync(
+        client, store, resources=RESOURCES, clock=clock, concurrency=1,
+    )
+    server.routes['/accounts/2'] = (400, {})
+
+    assert {event.account_id for event in sync.run()} == {1}
+    assert list(sync.errors) == [2]
+    assert store.due_accounts(clock.now) == [2]
+
+
+def test_interrupted_run_resumes(tmpdir, server, client, clock):
+    path = str(tmpdir.join('sync.db'))
+    with SnapshotStore(path) as store:
+        sync = AccountSync(
+            client, store, resources=RESOURCES, concurrency=1, clock=clock,
+        )
+        events = sync.run()
+        first = next(events)
+        # The process dies while handling the first account's events
+        events.close()
+
+    with SnapshotStore(path) as store:
+        sync = AccountSync(
+            client, store, resources=RESOURCES, concurrency=1, clock=clock,
+        )
+        resumed = list(sync.run())
+        assert store.due_accounts(0) == []
+
+    # Neither account's snapshots were saved, but the signups were
+    assert first in resumed
+    assert sorted({event.account_id for event in resumed}) == [1, 2]
+    assert sync.stats['signups'] == 0
+
+
+def test_resources_must_be_get_endpoints(client):
+    with pytest.raises(ValueError):
+        AccountSync(client, SnapshotStore(), resources=['update_account'])